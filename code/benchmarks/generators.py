@@ -0,0 +1,224 @@
+## Seeded generators of synthetic MycoBank, GBIF occurrence, polygon and GBIF download data used to benchmark the pipeline
+## presented in the manuscript entitled "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import zipfile
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+
+
+SYLLABLES = ['ma', 'ni', 'to', 'cor', 'phy', 'lo', 'ra', 'mu', 'sce', 'tri', 'cho', 'der', 'ma', 'pel', 'lus', 'gan',
+             'od', 'er', 'ia', 'xy', 'la', 'ria', 'bo', 'le', 'tus', 'my', 'ce', 'na', 'ag', 'ar', 'icus', 'po', 'rus']
+AUTHORS = ['L.', 'Fr.', 'Pers.', 'Berk.', 'Berk. & M.A. Curtis', 'Lév.', 'Speg.', 'Bres.', 'Singer', 'Ryvarden',
+           'Corner', 'Murrill', 'P. Karst.', 'Pat.', '(Fr.) P. Karst.', '(Pers.) Fr.', 'Lloyd', 'Sacc.', 'Rick', 'Mont.']
+JOURNALS = ['Systema Mycologicum', 'Sylloge Fungorum', 'Mycologia', 'Synopsis Fungorum', 'Anales de la Sociedad Científica Argentina',
+            'Brotéria', 'Annales des Sciences Naturelles Botanique', 'Persoonia', 'Mycotaxon', 'Fungal Diversity']
+STATES = ['Amazonas', 'Pará', 'Bahia', 'Minas Gerais', 'São Paulo', 'Paraná', 'Santa Catarina', 'Rio Grande do Sul',
+          'Pernambuco', 'Mato Grosso', 'Goiás', 'Rio de Janeiro']
+COUNTRIES = ['BR', 'AR', 'PY', 'UY', 'BO', 'PE', 'CO', 'VE', 'EC', 'US', 'MX', 'CR', 'GF', 'SR', 'GY']
+
+
+def _words(rng, n, n_syllables=(2, 4)):
+    lengths = rng.integers(n_syllables[0], n_syllables[1] + 1, n)
+    picks = rng.integers(0, len(SYLLABLES), lengths.sum())
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+
+    return [''.join(SYLLABLES[j] for j in picks[bounds[i]:bounds[i + 1]]) for i in range(n)]
+
+def mycobank_table(n_names, seed=0, synonym_rate=0.3, n_genera=None):
+    """
+    MycoBank-like export with 'Taxon name', 'Authors', 'Rank.Rank name', 'Name status' and 'Synonymy' columns.
+
+    Accepted species carry 'Current name: <name> <authors>, <journal> <volume>: <page> (<year>) [MB#<id>]' Synonymy
+    strings followed by their synonyms; synonyms point to the current name of their accepted species. A few genus and
+    family records are added, as in the real export.
+    """
+
+    rng = np.random.default_rng(seed)
+    n_genera = n_genera or max(n_names // 20, 5)
+
+    genera = pd.Series(_words(rng, n_genera)).str.capitalize().drop_duplicates().to_numpy()
+    genus = genera[rng.integers(0, len(genera), n_names)]
+    epithet = np.asarray(_words(rng, n_names))
+    taxon = pd.Series(genus + ' ' + epithet)
+    authors = np.asarray(AUTHORS)[rng.integers(0, len(AUTHORS), n_names)]
+
+    ## Synonyms point to an accepted name drawn among the non-synonyms
+    is_synonym = rng.random(n_names) < synonym_rate
+    accepted_pool = np.flatnonzero(~is_synonym)
+    accepted = np.arange(n_names)
+    accepted[is_synonym] = accepted_pool[rng.integers(0, len(accepted_pool), is_synonym.sum())]
+
+    journal = np.asarray(JOURNALS)[rng.integers(0, len(JOURNALS), n_names)]
+    volume = rng.integers(1, 120, n_names).astype(str)
+    page = rng.integers(1, 900, n_names).astype(str)
+    year = rng.integers(1753, 2024, n_names).astype(str)
+    mb_id = rng.integers(100_000, 900_000, n_names).astype(str)
+
+    citation = pd.Series(authors + ', ' + journal + ' ' + volume + ': ' + page + ' (' + year + ') [MB#' + mb_id + ']')
+    current = 'Current name: ' + taxon[accepted].to_numpy() + ' ' + citation[accepted].to_numpy()
+    synonymy = pd.Series(current) + ' synonyms: ' + taxon.to_numpy() + ' ' + authors + ' [MB#' + mb_id + ']'
+
+    species = pd.DataFrame({
+        'Taxon name': taxon,
+        'Authors': authors,
+        'Rank.Rank name': 'sp.',
+        'Name status': np.where(rng.random(n_names) < 0.95, 'Legitimate', 'Illegitimate'),
+        'Synonymy': synonymy
+    })
+
+    higher = pd.DataFrame({
+        'Taxon name': list(genera[:10]) + [g + 'ceae' for g in genera[:10]],
+        'Authors': 'Fr.',
+        'Rank.Rank name': ['gen.'] * min(10, len(genera)) + ['fam.'] * min(10, len(genera)),
+        'Name status': 'Legitimate',
+        'Synonymy': 'Current name: ' + pd.Series(list(genera[:10]) * 2) + ' Fr., Systema Mycologicum 1: 1 (1821) [MB#1]'
+    })
+
+    return pd.concat([species, higher], ignore_index=True)
+
+def _typo(names, rng):
+    """
+    Introduce one substitution, deletion or transposition in the epithet of each name.
+    """
+
+    out = []
+    for name in names:
+        parts = name.split(' ', 2)
+        if len(parts) < 2 or len(parts[1]) < 3:
+            out.append(name)
+            continue
+        epithet = list(parts[1])
+        pos = rng.integers(1, len(epithet) - 1)
+        kind = rng.integers(0, 3)
+        if kind == 0:
+            epithet[pos] = SYLLABLES[rng.integers(0, len(SYLLABLES))][0]
+        elif kind == 1:
+            del epithet[pos]
+        else:
+            epithet[pos], epithet[pos - 1] = epithet[pos - 1], epithet[pos]
+        parts[1] = ''.join(epithet)
+        out.append(' '.join(parts))
+
+    return out
+
+def occurrence_table(mycobank, n_rows, seed=0, duplicate_rate=0.1, typo_rate=0.05, author_variant_rate=0.05, no_coordinate_rate=0.3,
+                     locality_rate=0.1):
+    """
+    GBIF-like occurrence table (the columns kept by format_occurrences for the strict dataset) drawing names from a
+    mycobank_table output.
+
+    Parameters:
+        duplicate_rate (float): Share of rows repeating an earlier record (same specimen keys).
+        typo_rate (float): Share of rows whose scientificName has a misspelled epithet.
+        author_variant_rate (float): Share of rows whose authorship is written differently (spacing, abbreviation dots).
+        no_coordinate_rate (float): Share of rows without coordinates (county, municipality or locality only).
+        locality_rate (float): Share of the rows without coordinates that only carry free-text locality.
+    """
+
+    rng = np.random.default_rng(seed)
+    species = mycobank[mycobank['Rank.Rank name'] == 'sp.']
+    full_names = (species['Taxon name'] + ' ' + species['Authors']).to_numpy()
+    binomials = species['Taxon name'].to_numpy()
+
+    n_unique = max(int(n_rows * (1 - duplicate_rate)), 1)
+    ## Skewed species frequencies, as in real occurrence data
+    weights = rng.pareto(1.2, len(full_names)) + 1e-3
+    picks = rng.choice(len(full_names), n_unique, p=weights / weights.sum())
+
+    scientific = full_names[picks].astype(object)
+    typos = rng.random(n_unique) < typo_rate
+    scientific[typos] = _typo(scientific[typos], rng)
+    variants = ~typos & (rng.random(n_unique) < author_variant_rate)
+    scientific[variants] = pd.Series(scientific[variants], dtype=object).str.replace('.', '', regex=False).str.replace(' & ', ' et ', regex=False).to_numpy()
+
+    lon = np.round(rng.uniform(-73.9, -34.8, n_unique), rng.integers(1, 6))
+    lat = np.round(rng.uniform(-33.7, 5.2, n_unique), rng.integers(1, 6))
+    missing = rng.random(n_unique) < no_coordinate_rate
+    lon[missing] = np.nan
+    lat[missing] = np.nan
+
+    state = np.asarray(STATES)[rng.integers(0, len(STATES), n_unique)]
+    county = pd.Series(_words(rng, 500)).str.capitalize().to_numpy()[rng.integers(0, 500, n_unique)]
+    county_only = missing & (rng.random(n_unique) < 1 - locality_rate)
+
+    occurrences = pd.DataFrame({
+        'gbifID': np.arange(1, n_unique + 1),
+        'institutionCode': np.asarray(['INPA', 'SP', 'URM', 'ICN', 'RB', 'MBM'])[rng.integers(0, 6, n_unique)],
+        'collectionCode': 'Fungi',
+        'catalogNumber': rng.integers(1, 500_000, n_unique).astype(str),
+        'year': rng.integers(1850, 2025, n_unique),
+        'month': rng.integers(1, 13, n_unique),
+        'day': rng.integers(1, 29, n_unique),
+        'continent': 'SOUTH_AMERICA',
+        'stateProvince': state,
+        'county': np.where(county_only, county, None),
+        'municipality': None,
+        'locality': np.where(missing & ~county_only, 'Parque Estadual ' + county, None),
+        'decimalLatitude': lat,
+        'decimalLongitude': lon,
+        'scientificName': scientific,
+        'species': binomials[picks],
+        'acceptedScientificName': full_names[picks],
+        'recordedBy': np.asarray(['A. Silva', 'Silva, A.', 'J.P. Souza', 'M. Santos', 'R. Oliveira'])[rng.integers(0, 5, n_unique)]
+    })
+
+    ## Duplicates repeat whole earlier records
+    n_duplicates = n_rows - n_unique
+    if n_duplicates > 0:
+        duplicates = occurrences.iloc[rng.integers(0, n_unique, n_duplicates)]
+        occurrences = pd.concat([occurrences, duplicates], ignore_index=True)
+
+    return occurrences.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+def polygon_layer(n_regions, field, extent=(-74, -34, -34, 6), seed=0):
+    """
+    Polygon layer covering extent with n_regions labels, each made of several grid cells (so regions are irregular).
+    """
+
+    rng = np.random.default_rng(seed)
+    n_side = max(int(np.ceil(np.sqrt(n_regions * 4))), 1)
+    xs = np.linspace(extent[0], extent[1], n_side + 1)
+    ys = np.linspace(extent[2], extent[3], n_side + 1)
+
+    cells = [box(xs[i], ys[j], xs[i + 1], ys[j + 1]) for i in range(n_side) for j in range(n_side)]
+    labels = np.asarray([f'{field}_{k}' for k in range(n_regions)])[rng.integers(0, n_regions, len(cells))]
+
+    layer = gpd.GeoDataFrame({field: labels}, geometry=cells, crs='epsg:4326')
+
+    return layer.dissolve(by=field).reset_index()
+
+def download_archive(path, n_rows, species, seed=0, bad_line_rate=0.0001, brazil_share=0.6):
+    """
+    Write a GBIF SIMPLE_CSV-like download archive (tab-separated, unquoted) with n_rows records of the given species.
+    """
+
+    rng = np.random.default_rng(seed)
+    species = np.asarray(species)
+
+    picks = rng.integers(0, len(species), n_rows)
+    countries = np.where(rng.random(n_rows) < brazil_share, 'BR', np.asarray(COUNTRIES)[rng.integers(0, len(COUNTRIES), n_rows)])
+    countries = np.where(rng.random(n_rows) < 0.01, '', countries)
+
+    table = pd.DataFrame({
+        'gbifID': np.arange(1, n_rows + 1),
+        'kingdom': 'Fungi',
+        'species': species[picks],
+        'countryCode': countries,
+        'decimalLatitude': np.round(rng.uniform(-40, 10, n_rows), 4),
+        'decimalLongitude': np.round(rng.uniform(-80, -30, n_rows), 4)
+    })
+    lines = table.to_csv(sep='\t', index=False, header=False).splitlines()
+
+    ## Malformed lines (extra tab-separated fields) as found in real downloads
+    for i in np.flatnonzero(rng.random(len(lines)) < bad_line_rate):
+        lines[i] = lines[i] + '\tunexpected\tfields'
+
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('occurrence.csv', '\t'.join(table.columns) + '\n' + '\n'.join(lines) + '\n')
+
+    return path
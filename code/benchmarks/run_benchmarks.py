@@ -0,0 +1,216 @@
+## Timed benchmarks of the pipeline stages on synthetic data, with results stored as JSON and compared against a baseline,
+## for the code presented in the manuscript entitled "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+##
+## Usage (from the code directory, fully offline):
+##     python -m benchmarks.run_benchmarks --sizes 10000 1000000 --output bench.json
+##     python -m benchmarks.run_benchmarks --sizes 10000 --baseline bench.json --tolerance 0.25
+##     python -m benchmarks.run_benchmarks --benchmarks cold_start --repeats 5
+## The second command exits with status 1 when any benchmark is slower than the baseline by more than the tolerance.
+
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import subprocess
+import tempfile
+import contextlib
+import geopandas as gpd
+
+from benchmarks.generators import mycobank_table, occurrence_table, polygon_layer, download_archive
+from modules.format_mb import format_mb_table
+from modules.taxonomic_harmonisation import exact_matches, fuzzy_match, fuzzy_match_genera
+from modules.spatial_analysis import label_regions
+from modules.endemic_analysis import species_country_pairs
+from modules.country_index import CountryIndex
+
+
+BENCHMARKS = ['format_mb', 'exact_matches', 'fuzzy_match', 'fuzzy_match_genera', 'label_regions', 'endemic_aggregation', 'cold_start']
+
+## CLI commands whose start-up (interpreter, imports and stage declaration, nothing run) is timed by the cold_start benchmark
+COLD_START_COMMANDS = ['run1', 'run2', 'run3', 'stream', 'scenarios']
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def mycobank_size(n_rows):
+    """
+    Number of MycoBank names generated for a benchmark with n_rows occurrences (the real export has ~500k names).
+    """
+
+    return min(max(n_rows // 10, 2000), 500_000)
+
+def timed(func, *args, repeats=1, **kwargs):
+    """
+    Best wall time of repeats calls, and the result of the last call.
+    """
+
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+def run_size(n_rows, benchmarks, seed=0, repeats=1, workdir=None):
+    """
+    Generate the synthetic inputs for one size and time every requested benchmark on them.
+    Inputs of later benchmarks come from the (untimed) outputs of earlier ones, as in the pipeline.
+    """
+
+    results = []
+
+    def record(name, seconds, rows):
+        results.append({'benchmark': name, 'size': n_rows, 'rows': int(rows), 'seconds': round(seconds, 4),
+                        'rows_per_s': round(rows / seconds, 1) if seconds > 0 else None})
+        logging.info(f"{name} ({n_rows} rows): {seconds:.3f} s")
+
+    needs_taxonomy = any(name in benchmarks for name in BENCHMARKS[:4])
+    needs_occurrences = needs_taxonomy or 'label_regions' in benchmarks
+
+    if needs_occurrences:
+        raw_mycobank = mycobank_table(mycobank_size(n_rows), seed=seed)
+        occurrences = occurrence_table(raw_mycobank, n_rows, seed=seed)
+
+    if needs_taxonomy:
+        seconds, mycobank = timed(format_mb_table, raw_mycobank.copy(), repeats=repeats)
+        mycobank = mycobank.reset_index(drop=True)
+        if 'format_mb' in benchmarks:
+            record('format_mb', seconds, len(raw_mycobank))
+
+        seconds, current_names = timed(exact_matches, occurrences, mycobank, repeats=repeats)
+        if 'exact_matches' in benchmarks:
+            record('exact_matches', seconds, len(occurrences))
+
+        mismatches = occurrences[[name == 'NA' for name in current_names]].reset_index(drop=True)
+        seconds, (_, _, fuzzy_names) = timed(fuzzy_match, mismatches, mycobank, repeats=repeats)
+        if 'fuzzy_match' in benchmarks:
+            record('fuzzy_match', seconds, len(mismatches))
+
+        if 'fuzzy_match_genera' in benchmarks:
+            remaining = mismatches[[name == 'NA' for name in fuzzy_names]].reset_index(drop=True)
+            ## tqdm progress bars are silenced so they do not interleave with the benchmark log
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+                seconds, _ = timed(fuzzy_match_genera, remaining, mycobank, repeats=repeats)
+            record('fuzzy_match_genera', seconds, len(remaining))
+
+    if 'label_regions' in benchmarks:
+        points = occurrences.dropna(subset=['decimalLongitude', 'decimalLatitude']).reset_index(drop=True)
+        points = gpd.GeoDataFrame(points[['species']], geometry=gpd.points_from_xy(points['decimalLongitude'], points['decimalLatitude']), crs='epsg:4326')
+        layers = {
+            'biome': (polygon_layer(6, 'name', seed=seed), 'name'),
+            'province': (polygon_layer(50, 'Provincias', seed=seed + 1), 'Provincias'),
+            'municipality': (polygon_layer(2000, 'CD_MUN', seed=seed + 2), 'CD_MUN')
+        }
+        seconds, _ = timed(label_regions, points, layers, repeats=repeats)
+        record('label_regions', seconds, len(points))
+
+    if 'endemic_aggregation' in benchmarks:
+        species = mycobank_table(mycobank_size(n_rows), seed=seed)['Taxon name']
+        zip_path = download_archive(os.path.join(workdir, f'download_{n_rows}.zip'), n_rows, species, seed=seed)
+
+        def aggregate():
+            pairs, _ = species_country_pairs(zip_path)
+            index = CountryIndex()
+            index.update(pairs, archive=os.path.basename(zip_path))
+            return index
+
+        seconds, _ = timed(aggregate, repeats=repeats)
+        record('endemic_aggregation', seconds, n_rows)
+
+    return results
+
+def cold_start(repeats=1):
+    """
+    Wall time of a fresh interpreter (baseline) and of 'cli.py <command> --list-stages' for each command, best of repeats.
+    """
+
+    results = []
+    targets = [('interpreter', [sys.executable, '-c', 'pass'])]
+    targets += [(command, [sys.executable, os.path.join(CODE_DIR, 'cli.py'), command, '--list-stages']) for command in COLD_START_COMMANDS]
+
+    for name, args in targets:
+        seconds, _ = timed(subprocess.run, args, cwd=CODE_DIR, check=True, capture_output=True, repeats=repeats)
+        results.append({'benchmark': f'cold_start_{name}', 'size': 0, 'rows': 0, 'seconds': round(seconds, 4), 'rows_per_s': None})
+        logging.info(f"cold_start_{name}: {seconds:.3f} s")
+
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Ratio of each benchmark's time to the baseline time for the same benchmark and size.
+
+    Returns:
+        list: Comparison rows; 'regression' is True when the ratio exceeds 1 + tolerance.
+    """
+
+    reference = {(r['benchmark'], r['size']): r['seconds'] for r in baseline['results']}
+    rows = []
+    for r in results:
+        base = reference.get((r['benchmark'], r['size']))
+        if base is None:
+            continue
+        ratio = r['seconds'] / base if base > 0 else float('inf')
+        rows.append({'benchmark': r['benchmark'], 'size': r['size'], 'baseline_s': base, 'seconds': r['seconds'],
+                     'ratio': round(ratio, 3), 'regression': ratio > 1 + tolerance})
+
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pipeline stages on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000], help='Occurrence rows per benchmark (e.g. 10000 1000000 10000000).')
+    parser.add_argument('--benchmarks', nargs='+', default=BENCHMARKS, choices=BENCHMARKS)
+    parser.add_argument('--repeats', type=int, default=1, help='Calls per benchmark; the best time is kept.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='Earlier results file to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown relative to the baseline (0.2 = 20%%).')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_rows in args.sizes:
+            results.extend(run_size(n_rows, args.benchmarks, seed=args.seed, repeats=args.repeats, workdir=workdir))
+
+    if 'cold_start' in args.benchmarks:
+        results.extend(cold_start(repeats=args.repeats))
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'seed': args.seed,
+            'repeats': args.repeats
+        },
+        'results': results
+    }
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare(results, json.load(f), args.tolerance)
+        for row in report['comparison']:
+            flag = 'REGRESSION' if row['regression'] else 'ok'
+            logging.info(f"{row['benchmark']} ({row['size']} rows): {row['seconds']} s vs {row['baseline_s']} s baseline (x{row['ratio']}) {flag}")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    logging.info(f"Benchmark results written to {args.output}")
+
+    if any(row['regression'] for row in report.get('comparison', [])):
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
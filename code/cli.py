@@ -0,0 +1,80 @@
+## Single command line entry point for the analyses presented in the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+##
+## Usage (from the code directory):
+##     python cli.py run1 --settings settings.toml
+##     python cli.py run2 --set use_strict_spatial=false --set map_render_mode=grid
+##     FUNGA_JARO_THRESHOLD=0.12 python cli.py run1
+##     python cli.py run2 --list-stages
+##     python cli.py benchmarks --sizes 10000
+## Only the modules of the invoked command are imported, after settings are applied, so short jobs start quickly.
+
+
+import sys
+import argparse
+import importlib
+
+from modules.settings import Settings, parse_value, config_defaults
+
+
+## Command -> module providing main() (and build_stages() for pipeline scripts)
+COMMANDS = {
+    'run1': 'run1_total_numbers',
+    'run2': 'run2_spatial_analysis',
+    'run3': 'run3_endemic_analysis',
+    'stream': 'run_streaming',
+    'scenarios': 'run_scenarios',
+    'benchmarks': 'benchmarks.run_benchmarks'
+}
+
+
+def parse_overrides(assignments):
+    """
+    Parse '--set name=value' assignments, with values typed like the config.py default (see parse_value).
+    """
+
+    defaults = config_defaults()
+    overrides = {}
+    for assignment in assignments:
+        key, sep, text = assignment.partition('=')
+        if not sep:
+            raise SystemExit(f"--set expects name=value, got '{assignment}'")
+        if key not in defaults:
+            raise SystemExit(f"Unknown setting '{key}'")
+        overrides[key] = parse_value(key, text, defaults[key])
+
+    return overrides
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the fungal conservation analyses.')
+    parser.add_argument('command', choices=COMMANDS)
+    parser.add_argument('--settings', help='JSON or TOML file with settings overriding config.py.')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', help='Override one setting (repeatable).')
+    parser.add_argument('--list-stages', action='store_true', help='Print the stages of the command and exit without running them.')
+    args, rest = parser.parse_known_args(argv)
+
+    settings = Settings.load(args.settings, overrides=parse_overrides(args.set))
+    settings.apply()
+
+    module = importlib.import_module(COMMANDS[args.command])
+
+    if args.list_stages:
+        if hasattr(module, 'build_stages'):
+            for stage in module.build_stages():
+                print(stage.name)
+        return 0
+
+    if args.command == 'benchmarks':
+        return module.main(rest)
+
+    if rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+
+    module.main()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,6 +12,42 @@ use_strict = True
 occ_strict = data+'/gbif/occurrence_strict.csv'
 occ_relaxed = data+'/gbif/occurrence.txt'
 
+## Cached stage outputs of run1, run2 and run3. Each stage's outputs are stored under a hash of its inputs, input files,
+## code and the config values it reads; unchanged stages are skipped on reruns. Stage names in 'pipeline_force' always run.
+pipeline_cache_dir = output+'pipeline_cache/'
+pipeline_force = []
+
+## Run manifests: every stage's wall time, CPU time, peak RSS, rows in/out and cache hits are written to a JSON file per run
+## in 'manifest_dir'. The stage named in 'profile_stage' (e.g. 'perform_region_labelling') runs under cProfile, and
+## 'trace_memory' adds tracemalloc allocation peaks per stage (slower).
+manifest_dir = output+'run_manifests/'
+profile_stage = None
+trace_memory = False
+
+## Streaming mode (run_streaming.py): occurrences are read, harmonised and labelled with regions in chunks instead of loading
+## the full download at each stage. Chunks are resized after each one from the measured RSS (which includes the state kept
+## between chunks) to stay under 'streaming_memory_budget_mb'; when that state alone outgrows it, chunks fall to their minimum
+## size and a warning is logged, as the budget cannot be held.
+streaming_memory_budget_mb = 4096
+
+## Scenarios run side by side by run_scenarios.py: scenario name -> config values set for it (any name in this file).
+## The scripts in 'scenario_scripts' run for every scenario in its own worker process; MycoBank, shapefiles and the gazetteer
+## are loaded once beforehand and shared with the workers. Totals are compared in output/scenario_comparison.csv.
+scenarios = {
+    'strict': {'use_strict': True, 'use_strict_spatial': True},
+    'relaxed': {'use_strict': False, 'use_strict_spatial': False, 'pending_verification': output+'pending_verification_relaxed.csv'}
+}
+scenario_scripts = ['run1_total_numbers', 'run2_spatial_analysis']
+scenario_max_workers = None
+
+## Duplicate specimens (the same collection held by several herbaria, e.g. recordedBy 'Rick, J.' vs 'J. Rick') are clustered
+## after exact duplicates are dropped: records are blocked on species, date and normalised collector surname, and collectors
+## within a block scoring at least 'collector_score_threshold' (RapidFuzz token set ratio, 0-100) share a 'specimenCluster'.
+## With 'collapse_duplicate_specimens' only the first record of each cluster is kept for the later stages (off by default,
+## so record counts match the published analyses unless asked for).
+collector_score_threshold = 90
+collapse_duplicate_specimens = False
+
 ## Path to MycoBank
 mb_path = data+'MBList_2025_2.xlsx'
 
@@ -22,6 +58,16 @@ jaro_threshold = 0.15
 verified_manually_strict = output+'verified_names_manually_strict.xlsx'
 verified_manually_relaxed = output+'verified_names_manually_relaxed.xlsx'
 
+## Headless mode for scheduled runs: nothing waits for keyboard input. Decisions from the verified spreadsheets accumulate
+## in 'verification_store' (keyed by original scientificName, shared by scenarios and written under a file lock) and are
+## applied in bulk; names without a decision keep their fuzzy match and are written to 'pending_verification' for the next
+## round. Download archives expected in data are polled every 'download_poll_interval' seconds for at most
+## 'archive_wait_timeout' seconds.
+headless = False
+verification_store = output+'verified_names_store.csv'
+pending_verification = output+'pending_verification.csv'
+archive_wait_timeout = 6 * 3600
+
 ## Boolean to define if spatial analysis will be performed with strict or relaxed dataset.
 ## Set according to dataset used for taxonomic harmonisation and total species estimates.
 ## For running with relaxed dataset, change to 'False' the 'use_strict_spatial' object bellow.
@@ -31,13 +77,71 @@ use_strict_spatial = True
 occ_strict_harmonised = output+'occurrences_harmonised_strict.csv'
 occ_relaxed_harmonised = output+'occurrences_harmonised_relaxed.csv'
 
+## Taxon vocabularies written next to the harmonised occurrences: sorted MycoBank current names (plus manual decisions), whose
+## positions are the integer codes of 'current_name'. Taxon and region columns are kept as categoricals from reading to output.
+taxon_vocabulary_strict = output+'taxon_vocabulary_strict.csv'
+taxon_vocabulary_relaxed = output+'taxon_vocabulary_relaxed.csv'
+
 ## Path for shapefiles used in the spatial analysis:
 biome_path = data+'dashboard_biomes-static-layer/dashboard_biomes-static-layer.shp'
 muni_path = data+'BR_Municipios_2022/BR_Municipios_2022.shp'
 neo_path = data+'neotropicalBioregionsSHP/NeotropicMap_Geo.shp'
 
-## Boolean to define if endemic analysis will be performed with strict or relaxed dataset. Also affects the second
-## iteration of usageKey gathering behavior. Set according to dataset used for taxonomic harmonisation, 
+## Local gazetteer (CSV with 'name', 'decimalLatitude' and 'decimalLongitude' columns, e.g. IBGE localities and protected-area
+## names) used to geocode records that only carry free-text locality information. Matches scoring below 'geocode_score_threshold'
+## (RapidFuzz token set ratio, 0-100) are discarded.
+gazetteer_path = data+'gazetteer/localities.csv'
+geocode_score_threshold = 90
+
+## Coordinate cleaning ahead of spatial joins. Flags: 'zero' (zero latitude or longitude), 'outside_bbox' (outside Brazil),
+## 'swapped' (latitude and longitude swapped according to the declared stateProvince), 'outside_state' (outside the declared
+## state envelope), 'centroid' (on a municipality or country centroid, within 'centroid_tolerance' degrees) and
+## 'low_precision' (fewer than 'min_coordinate_decimals' decimal places). Records with any flag in 'coordinate_flags_reject'
+## are removed; swapped coordinates are corrected and kept when 'fix_swapped_coordinates' is True. Every flag is written to
+## the coordinate flags table, but only invalid coordinates are removed by default: add 'centroid' and 'low_precision' to
+## also drop records that may be georeferenced to a municipality or with coarse precision.
+coordinate_flags_reject = ['zero', 'outside_bbox', 'swapped']
+fix_swapped_coordinates = True
+centroid_tolerance = 0.001
+min_coordinate_decimals = 2
+
+## Reference layers used to label every occurrence in a single spatial pass: layer name -> (shapefile path, label field).
+## Labels are stored as integer codes in '<layer>_code' columns. Adding a layer here costs one extra lookup per unique location.
+region_layers = {
+    'biome': (biome_path, 'name'),
+    'province': (neo_path, 'Provincias'),
+    'municipality': (muni_path, 'CD_MUN')
+}
+
+## Species x region x year cube (record counts per species, region of every layer in 'region_layers' and year) used for quick
+## summaries, see modules/occurrence_cube.py. Records are tracked by gbifID, so reruns only merge new records, move changed
+## ones and subtract removed ones; the cube is rebuilt from scratch only when the region labels change.
+occurrence_cube_strict = output+'occurrence_cube_strict.npz'
+occurrence_cube_relaxed = output+'occurrence_cube_relaxed.npz'
+
+## Species recorded in this many biomes (or Neotropical provinces) or fewer are counted as restricted-range in the
+## sub-national endemism tables (weighted and corrected weighted endemism are also reported per region)
+restricted_range_max_regions = 1
+
+## Sampling completeness per biome and province (Chao1, Chao2, ACE and rarefaction/extrapolation curves up to twice the
+## observed sample). Incidence-based estimates use grid cells of 'completeness_unit_size' degrees as sampling units;
+## standard errors come from 'completeness_bootstrap' replicates drawn with a fixed seed, regions run in parallel.
+completeness_unit_size = 0.1
+completeness_bootstrap = 200
+rarefaction_points = 40
+completeness_seed = 42
+completeness_max_workers = None
+
+## Map rendering. 'grid' draws occurrences binned into cells of 'map_cell_size' degrees as a single image layer,
+## 'points' draws every occurrence record (slow and memory-hungry for the relaxed dataset).
+## Polygon layers are drawn with topology-preserving simplified geometries ('map_simplify_tolerance' in degrees).
+map_render_mode = 'grid'
+map_cell_size = 0.1
+map_simplify_tolerance = 0.01
+map_extent = (-80, -30, -35, 8)
+
+## Boolean to define if endemic analysis will be performed with strict or relaxed dataset. Also defines the harmonised
+## occurrences from which original names are taken as fallbacks for usageKey gathering. Set according to dataset used for taxonomic harmonisation, 
 ## total species estimates, and spatial analysis. For running with relaxed dataset, change to 'False' the 'use_strict_endemic' object bellow.
 use_strict_endemic = True
 
@@ -48,13 +152,47 @@ comb_matrix_relaxed = output+'combinedDataMatrix_relaxed.csv'
 ## GBIF API url to gather species usageKeys
 api_url = "https://api.gbif.org/v1/species/match"
 
-## Paths for both strict and combined dereplicated occurrences (for usage in endemic analysis usageKey gathering second iteration)
-derep_occs_strict = output+'derep_occs_strict.csv'
-derep_occs_relaxed = output+'derep_occs_relaxed.csv'
+## GBIF name resolution: maximum number of requests in flight on the pooled session, starting request rate (requests/second,
+## halved on each 429 response and recovered gradually) and retries with exponential backoff per name
+gbif_max_in_flight = 20
+gbif_rate_limit = 10
+gbif_max_retries = 5
+
+## SQLite cache of GBIF name resolutions (raw match response, chosen usageKey and scientificName), shared by both resolution
+## passes. Entries older than 'gbif_cache_ttl_days' are resolved again; set to None to keep entries forever.
+gbif_cache_path = output+'gbif_match_cache.sqlite'
+gbif_cache_ttl_days = 90
+
+## Offline alternative to the species/match API. When 'use_offline_backbone' is True, names are resolved against a local index
+## built once from the GBIF Backbone Taxonomy dump (Taxon.tsv from https://hosted-datasets.gbif.org/datasets/backbone/),
+## using the same acceptance rules as the API pass.
+use_offline_backbone = False
+gbif_backbone_path = data+'backbone/Taxon.tsv'
+gbif_backbone_db = output+'gbif_backbone.sqlite'
 
 ## Batch size to divide species names into queries (recommended to leave at 5000)
 batch_size = 5000
 
 ## GBIF credentials for sending requests 
 ## Change username:password to your personal GBIF account and password. These files will be available for download in the GBIF website (https://www.gbif.org)
-username_password = 'username:password'
\ No newline at end of file
+username_password = 'username:password'
+
+## GBIF occurrence downloads. Submitted download keys are kept in output/gbif_download_jobs.json by query content (downloads
+## that failed are resubmitted); each download status is polled every 'download_poll_interval' seconds until 'download_timeout'
+## seconds have passed (pending downloads are resumed on the next run), and finished archives are fetched into the data directory.
+gbif_base_url = "https://api.gbif.org/v1"
+download_poll_interval = 60
+download_timeout = 24 * 3600
+
+## Number of processes reading GBIF download archives in parallel during the endemic analysis (None uses all CPUs)
+endemic_max_workers = None
+
+## Persistent species x country index (one bitset over country codes per species), one per dataset. Archives already merged
+## (identified by the MD5 of their content) are skipped, so new downloads only add their own records. Species restricted to each
+## group of countries below are also reported.
+country_index_strict = output+'species_country_index_strict.npz'
+country_index_relaxed = output+'species_country_index_relaxed.npz'
+country_groups = {
+    'Mercosur': ['AR', 'BR', 'PY', 'UY', 'BO'],
+    'Amazon basin': ['BR', 'BO', 'PE', 'EC', 'CO', 'VE', 'GY', 'SR', 'GF']
+}
\ No newline at end of file
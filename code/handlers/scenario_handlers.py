@@ -0,0 +1,99 @@
+import os
+import logging
+import importlib
+import pandas as pd
+
+import config
+from config import *
+from modules.format_mb import format_mb
+from modules.spatial_analysis import read_layer, load_reference_layers
+from modules.locality_geocoding import load_gazetteer
+from modules.map_rendering import simplified_layer
+from modules.pipeline import Pipeline
+from modules.instrumentation import RunManifest
+
+
+def preload_references(scripts):
+    """
+    Load the reference data used by the given run scripts once, before scenario workers are forked.
+    """
+
+    logging.info("Loading shared reference data")
+
+    if 'run1_total_numbers' in scripts:
+        format_mb(mb_path)
+
+    if 'run2_spatial_analysis' in scripts:
+        read_layer(muni_path)
+        load_reference_layers(region_layers)
+        if os.path.exists(gazetteer_path):
+            load_gazetteer(gazetteer_path)
+        ## Simplified once here, so scenario workers share it instead of each writing the GeoPackage cache
+        simplified_layer(neo_path, tolerance=map_simplify_tolerance, cache_dir=output+'cache/')
+
+def run_scenario(name):
+    """
+    Run the pipelines of scenario_scripts with the config values of the current scenario, and return its totals.
+    """
+
+    for script in scenario_scripts:
+        stages = importlib.import_module(script).build_stages()
+        manifest = RunManifest(f'{script}_{name}', manifest_dir, config_values={key: value for key, value in vars(config).items() if not key.startswith('_')},
+                               profile_stage=profile_stage, trace_memory=trace_memory)
+
+        Pipeline(stages, cache_dir=pipeline_cache_dir, force=pipeline_force, manifest=manifest).run()
+
+    return scenario_totals()
+
+def scenario_totals():
+    """
+    Headline totals of the current scenario, read from its saved outputs (missing outputs are left out).
+    """
+
+    totals = {}
+
+    if use_strict:
+        harmonised_path = output+'occurrences_harmonised_strict.csv'
+    else:
+        harmonised_path = output+'occurrences_harmonised_relaxed.csv'
+
+    if os.path.exists(harmonised_path):
+        names = pd.read_csv(harmonised_path, usecols=['current_name'])['current_name'].dropna()
+        totals['harmonised_records'] = len(names)
+        totals['species'] = names.nunique()
+        totals['genera'] = names.str.split().str[0].nunique()
+
+    if use_strict_spatial:
+        combined_path = output+'combinedDataMatrix_strict.csv'
+    else:
+        combined_path = output+'combinedDataMatrix_relaxed.csv'
+
+    if os.path.exists(combined_path):
+        names = pd.read_csv(combined_path, usecols=['current_name'])['current_name'].dropna()
+        totals['georeferenced_records'] = len(names)
+        totals['georeferenced_species'] = names.nunique()
+
+    for layer in region_layers:
+        if use_strict_spatial:
+            richness_path = output+f'richness_{layer}_strict.csv'
+        else:
+            richness_path = output+f'richness_{layer}_relaxed.csv'
+
+        if os.path.exists(richness_path):
+            totals[f'regions_{layer}'] = len(pd.read_csv(richness_path))
+
+    return totals
+
+def compare_scenarios(totals):
+    """
+    Side-by-side table of scenario totals (one row per total, one column per scenario), saved as scenario_comparison.csv.
+    """
+
+    comparison = pd.DataFrame(totals)
+    comparison.index.name = 'total'
+    comparison.to_csv(output+'scenario_comparison.csv')
+
+    for total, row in comparison.iterrows():
+        logging.info(f"{total}: " + ' | '.join(f"{scenario} {value}" for scenario, value in row.items()))
+
+    return comparison
@@ -1,16 +1,19 @@
-import math
+import os
 import logging
 import pandas as pd
 import numpy as np
 import geopandas as gpd
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
-
-from shapely.geometry import Point
-from matplotlib_scalebar.scalebar import ScaleBar
 
 from config import *
 from modules.spatial_analysis import *
+from modules.coordinate_cleaning import *
+from modules.locality_geocoding import *
+from modules.incidence_matrix import *
+from modules.regional_endemism import *
+from modules.sampling_completeness import *
+from modules.map_rendering import *
+from modules.encoding import *
+from modules.occurrence_cube import OccurrenceCube
 
 
 def read_harmonised_occurrences(use_strict_spatial:bool, occ_strict_harmonised:str, occ_relaxed_harmonised:str):
@@ -21,54 +24,107 @@ def read_harmonised_occurrences(use_strict_spatial:bool, occ_strict_harmonised:s
     logging.info("Reading harmonised occurrences")
 
     if use_strict_spatial:
-        occurrences_harmonised = pd.read_csv(occ_strict_harmonised)
+        path, vocabulary_path = occ_strict_harmonised, taxon_vocabulary_strict
     else:
-        occurrences_harmonised = pd.read_csv(occ_relaxed_harmonised)
+        path, vocabulary_path = occ_relaxed_harmonised, taxon_vocabulary_relaxed
+
+    ## Taxon and region columns are read as categoricals; current names keep the codes of the run1 vocabulary when available
+    vocabulary = load_vocabulary(vocabulary_path) if os.path.exists(vocabulary_path) else None
+    occurrences_harmonised = read_encoded_csv(path, vocabulary=vocabulary)
 
     return occurrences_harmonised
 
-def treat_georeferenced(occurrences_harmonised):
+def clean_coordinates(CoordsMatrix, centroids, envelopes):
     """
-    Convert georeferenced occurrence records into a GeoDataFrame.
-    Filters out records with missing or zero coordinates.
+    Flag coordinates of georeferenced records, recover swapped ones and drop records with rejected flags.
+
+    Returns:
+        Tuple[GeoDataFrame, Series]: Kept records as points, and number of records per flag (rejected total in attrs['rejected']).
     """
 
-    logging.info("Processing georeferenced occurrences")
+    flags = flag_coordinates(CoordsMatrix['decimalLongitude'], CoordsMatrix['decimalLatitude'], CoordsMatrix['stateProvince'],
+                             centroids, envelopes, centroid_tolerance=centroid_tolerance, min_decimals=min_coordinate_decimals)
 
-    CoordsMatrix = occurrences_harmonised[~occurrences_harmonised['decimalLongitude'].isna()]
-    CoordsMatrix = CoordsMatrix[CoordsMatrix['decimalLongitude']!=0]
+    reject_flags = flags[coordinate_flags_reject].copy()
+
+    ## Swapped coordinates are recovered instead of rejected
+    if fix_swapped_coordinates:
+        swapped = flags['swapped'].to_numpy()
+        CoordsMatrix.loc[swapped, ['decimalLongitude', 'decimalLatitude']] = CoordsMatrix.loc[swapped, ['decimalLatitude', 'decimalLongitude']].to_numpy()
+        recovered = [flag for flag in ('swapped', 'outside_bbox') if flag in reject_flags.columns]
+        reject_flags.loc[swapped, recovered] = False
+
+    rejected = reject_flags.any(axis=1).to_numpy()
+
+    CoordsMatrix = CoordsMatrix[~rejected]
     CoordsMatrix = gpd.GeoDataFrame(
-        CoordsMatrix, geometry=gpd.points_from_xy(CoordsMatrix.decimalLongitude, CoordsMatrix.decimalLatitude)
+        CoordsMatrix, geometry=gpd.points_from_xy(CoordsMatrix.decimalLongitude, CoordsMatrix.decimalLatitude), crs='epsg:4326'
     )
 
-    return CoordsMatrix
+    flag_counts = flags.sum()
+    flag_counts.attrs['rejected'] = int(rejected.sum())
+
+    return CoordsMatrix, flag_counts
 
-def perform_georeferenced_analysis(CoordsMatrix, biome_path):
+def treat_georeferenced(occurrences_harmonised, muni_path):
     """
-    Conduct biome-level analysis and deduplication on georeferenced occurrences.
+    Convert georeferenced occurrence records into a GeoDataFrame.
+    Filters out records with missing coordinates, then flags and removes problematic coordinates (zero, outside Brazil,
+    swapped, on municipality or country centroids, low precision) before any spatial join.
     """
 
-    logging.info("Starting georeferenced analysis")
+    logging.info("Processing georeferenced occurrences")
 
-    CoordsMatrix = georeferenced_analysis(CoordsMatrix, biome_path)
+    CoordsMatrix = occurrences_harmonised[~occurrences_harmonised['decimalLongitude'].isna()]
+    CoordsMatrix = CoordsMatrix[~CoordsMatrix['decimalLatitude'].isna()].reset_index(drop=True)
 
-    derep_occs = gpd.GeoDataFrame(columns=CoordsMatrix.columns)
-    duplicate_occs = gpd.GeoDataFrame(columns=CoordsMatrix.columns)
+    muni = read_layer(muni_path)
+    centroids, envelopes = reference_coordinates(muni)
 
-    for sp in CoordsMatrix['current_name'].unique():
-        subset = CoordsMatrix[CoordsMatrix['current_name'] == sp]
+    CoordsMatrix, flag_counts = clean_coordinates(CoordsMatrix, centroids, envelopes)
 
-        duplicates_mask = subset.duplicated(subset=['geometry'], keep=False)
-        duplicates = subset[duplicates_mask]
-        duplicate_occs = pd.concat([duplicate_occs, duplicates])
+    for flag, count in flag_counts.items():
+        logging.info(f"Coordinate flag '{flag}': {count} records")
 
-        unique_subset = subset.drop_duplicates(subset=['geometry'])
-        derep_occs = pd.concat([derep_occs, unique_subset])
+    if use_strict_spatial:
+        flag_counts.rename('records').to_csv(output+'coordinate_flags_strict.csv')
+    else:
+        flag_counts.rename('records').to_csv(output+'coordinate_flags_relaxed.csv')
 
-    logging.info(f"Unique georeferenced records: {len(derep_occs)}")
+    logging.info(f"Georeferenced records kept after coordinate cleaning: {len(CoordsMatrix)} ({flag_counts.attrs['rejected']} rejected)")
 
     return CoordsMatrix
 
+def municipality_centroids(noCoordsMatrix, column, muni):
+    """
+    Assign municipality centroids to records without coordinates from a free-text municipality name column
+    ('county' or 'municipality'), after normalising abbreviations and trailing qualifiers.
+    """
+
+    NCMatrix = noCoordsMatrix[~noCoordsMatrix[column].isna()].copy()
+
+    ## Names are normalised once per distinct value (category) and broadcast back to records through the codes
+    names = NCMatrix[column].astype('category')
+    categories = pd.Series(names.cat.categories, dtype=object)
+    categories = categories.replace(r'Mun\..*', '', regex=True)
+    categories = categories.replace(r'\d+', '', regex=True)
+    categories = categories.replace(r',.*', '', regex=True)
+    categories = categories.replace(r'-.*', '', regex=True)
+    categories = categories.replace(r'\(.*', '', regex=True)
+    categories = categories.replace('S\.', 'São', regex=True)
+    categories = categories.replace('Sta\.', 'Santa', regex=True)
+    categories = categories.replace('Ten\.', 'Tenente', regex=True)
+    categories = categories.replace('/.*', '', regex=True)
+    NCMatrix[column] = categories.to_numpy()[names.cat.codes.to_numpy()]
+    NCMatrix = NCMatrix.rename(columns={column:'NM_MUN'})
+    NCMatrix = NCMatrix.merge(muni, on='NM_MUN', how='inner')
+    NCMatrix = NCMatrix[NCMatrix['geometry'].notna()]
+    NCMatrix = gpd.GeoDataFrame(NCMatrix, geometry=NCMatrix['geometry'])
+    NCMatrix['geometry'] = NCMatrix['geometry'].centroid
+    NCMatrix = gpd.GeoDataFrame(NCMatrix, geometry=NCMatrix['geometry'], crs="EPSG:4326")
+
+    return NCMatrix
+
 def treat_nongeoreferenced_county(occurrences_harmonised, muni_path):
     """
     Process occurrences with only 'county' spatial information.
@@ -77,30 +133,12 @@ def treat_nongeoreferenced_county(occurrences_harmonised, muni_path):
 
     logging.info("Processing non-georeferenced data based on county")
 
-    muni = gpd.read_file(muni_path)
-    muni = muni.to_crs('epsg:4326')
+    muni = read_layer(muni_path)
 
     noCoordsMatrix = occurrences_harmonised[occurrences_harmonised['decimalLongitude'].isna()]
 
     # County column
-    NCcountyMatrix = noCoordsMatrix[~noCoordsMatrix['county'].isna()]
-
-
-    NCcountyMatrix['county'] = NCcountyMatrix['county'].replace(r'Mun\..*', '', regex=True)
-    NCcountyMatrix['county'] = NCcountyMatrix['county'].replace(r'\d+', '', regex=True)
-    NCcountyMatrix['county'] = NCcountyMatrix['county'].replace(r',.*', '', regex=True)
-    NCcountyMatrix['county'] = NCcountyMatrix['county'].replace(r'-.*', '', regex=True)
-    NCcountyMatrix['county'] = NCcountyMatrix['county'].replace(r'\(.*', '', regex=True)
-    NCcountyMatrix['county'] = NCcountyMatrix['county'].replace('S\.', 'São', regex=True)
-    NCcountyMatrix['county'] = NCcountyMatrix['county'].replace('Sta\.', 'Santa', regex=True)
-    NCcountyMatrix['county'] = NCcountyMatrix['county'].replace('Ten\.', 'Tenente', regex=True)
-    NCcountyMatrix['county'] = NCcountyMatrix['county'].replace('/.*', '', regex=True)
-    NCcountyMatrix = NCcountyMatrix.rename(columns={'county':'NM_MUN'})
-    NCcountyMatrix = NCcountyMatrix.merge(muni, on='NM_MUN', how='inner')
-    NCcountyMatrix = NCcountyMatrix[NCcountyMatrix['geometry'].notna()]
-    NCcountyMatrix = gpd.GeoDataFrame(NCcountyMatrix, geometry=NCcountyMatrix['geometry'])
-    NCcountyMatrix['geometry'] = NCcountyMatrix['geometry'].centroid
-    NCcountyMatrix = gpd.GeoDataFrame(NCcountyMatrix, geometry=NCcountyMatrix['geometry'], crs="EPSG:4326")
+    NCcountyMatrix = municipality_centroids(noCoordsMatrix, 'county', muni)
 
     logging.info(f"County-level records processed: {len(NCcountyMatrix)}")
 
@@ -114,105 +152,257 @@ def treat_nongeoreferenced_muni(occurrences_harmonised, muni_path):
 
     logging.info("Processing non-georeferenced data based on municipality")
 
-    muni = gpd.read_file(muni_path)
-    muni = muni.to_crs('epsg:4326')
+    muni = read_layer(muni_path)
 
     noCoordsMatrix = occurrences_harmonised[occurrences_harmonised['decimalLongitude'].isna()]
 
-    NCmuniMatrix = noCoordsMatrix[~noCoordsMatrix['municipality'].isna()]
-    NCmuniMatrix['municipality'] = NCmuniMatrix['municipality'].replace(r'Mun\..*', '', regex=True)
-    NCmuniMatrix['municipality'] = NCmuniMatrix['municipality'].replace(r'\d+', '', regex=True)
-    NCmuniMatrix['municipality'] = NCmuniMatrix['municipality'].replace(r',.*', '', regex=True)
-    NCmuniMatrix['municipality'] = NCmuniMatrix['municipality'].replace(r'-.*', '', regex=True)
-    NCmuniMatrix['municipality'] = NCmuniMatrix['municipality'].replace(r'\(.*', '', regex=True)
-    NCmuniMatrix['municipality'] = NCmuniMatrix['municipality'].replace('S\.', 'São', regex=True)
-    NCmuniMatrix['municipality'] = NCmuniMatrix['municipality'].replace('Sta\.', 'Santa', regex=True)
-    NCmuniMatrix['municipality'] = NCmuniMatrix['municipality'].replace('Ten\.', 'Tenente', regex=True)
-    NCmuniMatrix['municipality'] = NCmuniMatrix['municipality'].replace('/.*', '', regex=True)
-    NCmuniMatrix = NCmuniMatrix.rename(columns={'municipality':'NM_MUN'})
-    NCmuniMatrix = NCmuniMatrix.merge(muni, on='NM_MUN', how='inner')
-    NCmuniMatrix = NCmuniMatrix[NCmuniMatrix['geometry'].notna()]
-    NCmuniMatrix = gpd.GeoDataFrame(NCmuniMatrix, geometry=NCmuniMatrix['geometry'])
-    NCmuniMatrix['geometry'] = NCmuniMatrix['geometry'].centroid
-    NCmuniMatrix = gpd.GeoDataFrame(NCmuniMatrix, geometry=NCmuniMatrix['geometry'], crs="EPSG:4326")
+    NCmuniMatrix = municipality_centroids(noCoordsMatrix, 'municipality', muni)
 
     logging.info(f"Municipality-level records processed: {len(NCmuniMatrix)}")
 
     return NCmuniMatrix
 
-def perform_nongeoreferenced_analysis(NCcountyMatrix, NCmuniMatrix):
+def locality_points(noCoordsMatrix, gazetteer, cache_path):
     """
-    Perform biome-level analysis on non-georeferenced records derived from county or municipality data.
+    Geocode records without coordinates, county or municipality from their free-text locality against the gazetteer.
     """
 
-    logging.info("Performing non-georeferenced spatial analysis")
+    NClocalityMatrix = noCoordsMatrix[noCoordsMatrix['county'].isna() & noCoordsMatrix['municipality'].isna()].copy()
+
+    ## 'verbatimLocality' is only available in the relaxed dataset
+    NClocalityMatrix['locality_text'] = NClocalityMatrix['locality']
+    if 'verbatimLocality' in NClocalityMatrix.columns:
+        NClocalityMatrix['locality_text'] = NClocalityMatrix['locality_text'].fillna(NClocalityMatrix['verbatimLocality'])
+    NClocalityMatrix = NClocalityMatrix[~NClocalityMatrix['locality_text'].isna()]
 
-    NCcountyMatrix, NCmuniMatrix = nongeoreferenced_analysis(NCcountyMatrix, NCmuniMatrix, biome_path=biome_path)
+    geocoded = geocode_localities(NClocalityMatrix['locality_text'], gazetteer, cache_path=cache_path,
+                                  score_threshold=geocode_score_threshold)
+    NClocalityMatrix[['gazetteerName', 'geocodeScore']] = geocoded[['gazetteerName', 'geocodeScore']]
+    NClocalityMatrix = NClocalityMatrix[~geocoded['decimalLongitude'].isna()]
+    geocoded = geocoded[~geocoded['decimalLongitude'].isna()]
 
-    return NCcountyMatrix, NCmuniMatrix
+    NClocalityMatrix = gpd.GeoDataFrame(
+        NClocalityMatrix, geometry=gpd.points_from_xy(geocoded['decimalLongitude'], geocoded['decimalLatitude']), crs="EPSG:4326"
+    )
+
+    return NClocalityMatrix
 
-def join_gdfs(CoordsMatrix, NCcountyMatrix, NCmuniMatrix):
+def treat_nongeoreferenced_locality(occurrences_harmonised, gazetteer_path):
+    """
+    Process occurrences without coordinates, county or municipality that only carry free-text locality information.
+    Distinct locality strings are geocoded once against a local gazetteer (n-gram index plus fuzzy scoring).
+    """
+
+    logging.info("Processing non-georeferenced data based on locality")
+
+    if not os.path.exists(gazetteer_path):
+        logging.warning(f"Gazetteer {gazetteer_path} not found, skipping locality geocoding")
+        return gpd.GeoDataFrame(columns=['gbifID', 'current_name', 'year', 'geometry'], geometry='geometry', crs="EPSG:4326")
+
+    gazetteer = load_gazetteer(gazetteer_path)
+
+    noCoordsMatrix = occurrences_harmonised[occurrences_harmonised['decimalLongitude'].isna()]
+
+    if use_strict_spatial:
+        cache_path = output+'geocoded_localities_strict.csv'
+    else:
+        cache_path = output+'geocoded_localities_relaxed.csv'
+
+    NClocalityMatrix = locality_points(noCoordsMatrix, gazetteer, cache_path)
+
+    logging.info(f"Locality-level records processed: {len(NClocalityMatrix)}")
+
+    return NClocalityMatrix
+
+def join_gdfs(CoordsMatrix, NCcountyMatrix, NCmuniMatrix, NClocalityMatrix):
     """
     Combine georeferenced and non-georeferenced GeoDataFrames into a single dataset.
     """
 
     logging.info("Joining all geospatially-resolved occurrence datasets")
 
-    combinedDataMatrix = pd.concat([CoordsMatrix, NCcountyMatrix, NCmuniMatrix], ignore_index=True, sort=False)
+    cols = ['gbifID', 'current_name', 'year', 'geometry']
+    ## Empty frames are left out so categorical current names are concatenated as codes instead of being cast to text
+    frames = [matrix[cols] for matrix in (CoordsMatrix, NCcountyMatrix, NCmuniMatrix, NClocalityMatrix) if len(matrix) > 0]
+    combinedDataMatrix = pd.concat(frames or [CoordsMatrix[cols]], ignore_index=True, sort=False)
+    combinedDataMatrix = gpd.GeoDataFrame(combinedDataMatrix, geometry='geometry', crs='epsg:4326')
+
+    return combinedDataMatrix
+
+def perform_region_labelling(combinedDataMatrix, region_layers):
+    """
+    Label every occurrence with biome, Neotropical province and municipality codes in a single spatial pass.
+    Records outside the biome layer are dropped, as in the previous biome-level join.
+    """
+
+    logging.info("Labelling occurrences with reference regions")
+
+    derep_occs = combinedDataMatrix[~combinedDataMatrix['current_name'].isna()]
+    derep_occs = derep_occs.drop_duplicates(subset=['current_name', 'geometry'])
+
+    logging.info(f"Unique species x location records: {len(derep_occs)}")
+
+    layers = load_reference_layers(region_layers)
+    combinedDataMatrix, region_labels = label_regions(combinedDataMatrix, layers)
+
+    combinedDataMatrix = combinedDataMatrix[combinedDataMatrix['biome_code'] >= 0].reset_index(drop=True)
 
     logging.info(f"Estimate of the total number of known and accessible species with georeferenced data: {combinedDataMatrix['current_name'].nunique()} species")
 
-    return combinedDataMatrix
+    for layer in region_labels:
+        richness = richness_by_region(combinedDataMatrix, region_labels, layer)
+        logging.info(f"Regions with records ({layer}): {len(richness)}")
+
+        if use_strict_spatial:
+            richness.to_csv(output+f'richness_{layer}_strict.csv')
+        else:
+            richness.to_csv(output+f'richness_{layer}_relaxed.csv')
+
+    return combinedDataMatrix, region_labels
 
-def plot_results(combinedDataMatrix, neo_path):
+def update_occurrence_cube(combinedDataMatrix, region_labels):
     """
-    Generate draft map showing species richness across biogeographical provinces.
-    Save plot and write combined dataset to file.
+    Bring the species x region x year cube used for summaries up to date with the labelled occurrences: new records are
+    merged, changed ones moved and those no longer present subtracted (the cube is rebuilt only if region labels change).
     """
-    
-    logging.info("Plotting results and saving dataset")
 
-    neo = gpd.read_file(neo_path)
-    neo = neo.to_crs('epsg:4326')
+    logging.info("Updating species x region x year occurrence cube")
 
-    if 'level_0' in combinedDataMatrix.columns:
-        combinedDataMatrix = combinedDataMatrix.drop(columns=['level_0'])
+    if use_strict_spatial:
+        cube_path = occurrence_cube_strict
+    else:
+        cube_path = occurrence_cube_relaxed
 
-    provinces = gpd.sjoin(combinedDataMatrix, neo, how='inner', predicate='within')
-    provinces = provinces[['current_name', 'name', 'Provincias', 'geometry']].fillna('')
+    cube = OccurrenceCube.load(cube_path)
+    changed = cube.update(combinedDataMatrix, region_labels, complete=True)
 
-    sppNeoMatrix = provinces.pivot_table(index='Provincias', columns='current_name', aggfunc='size', fill_value=0)
-    sppNeoMatrix[sppNeoMatrix > 0] = 1
+    if changed > 0 or not os.path.exists(cube_path):
+        cube.save(cube_path)
 
-    ## Mapping species numbers to each province and plotting it (draft map that was edited for publication)
-    points = gpd.GeoSeries(
-        [Point(-60,-20), Point(-61,-20)], crs=4326
-    )
-    points = points.to_crs(32619)
-    distance_meters = points[0].distance(points[1])
-
-    spp_series = sppNeoMatrix.sum(axis=1, numeric_only=True)
-    neo['sppNumber'] = neo['Provincias'].map(spp_series).fillna(0)
-    variable = 'sppNumber'
-    vmin, vmax = 0, math.ceil(max(neo['sppNumber']/100))*100
-    fig, ax = plt.subplots(1, figsize=(30,10))
-    ax.set_xlim([-80, -30])
-    ax.set_ylim([-35, 8])
-    ax.add_artist(ScaleBar(distance_meters, units='km', location='lower right', length_fraction=0.1))
-    ax.set_xticks([])
-    ax.set_yticks([])
-
-    sm = plt.cm.ScalarMappable(cmap='Blues', 
-                            norm=plt.Normalize(vmin=vmin, vmax=vmax))
-    sm.set_array([])
-    fig.colorbar(sm, shrink=0.2, pad=0.0005, ticks=mticker.MultipleLocator(1500), ax=ax)
-    neo.plot(column=variable, cmap='Blues', linewidth=0.8, ax=ax)
-    combinedDataMatrix.plot(ax=ax, markersize=0.1, color='#ebcc34', alpha=0.8)
-    plt.savefig(output+'provinceMap_plasma.png', dpi=300, bbox_inches='tight')
-
-    if occ_strict:
+    logging.info(f"Occurrence cube: {changed} records added, changed or removed, {len(cube.taxa)} species and {sum(len(cells) for cells in cube.cells.values())} cells")
+
+def save_results(combinedDataMatrix, region_labels):
+    """
+    Write the combined dataset, sparse incidence matrices and binned occurrence grid used for mapping.
+    """
+
+    logging.info("Saving spatial analysis results")
+
+    ## Region labels are decoded from the integer codes assigned in perform_region_labelling, no further spatial join needed
+    combinedDataMatrix['name'] = decode_regions(combinedDataMatrix, region_labels, 'biome')
+    combinedDataMatrix['Provincias'] = decode_regions(combinedDataMatrix, region_labels, 'province')
+    combinedDataMatrix['CD_MUN'] = decode_regions(combinedDataMatrix, region_labels, 'municipality')
+
+    provinces = combinedDataMatrix[combinedDataMatrix['province_code'] >= 0]
+
+    ## Sparse province x species and biome x species incidence matrices, saved for downstream region-level analyses
+    sppNeoMatrix, neo_labels, spp_labels = build_incidence_matrix(provinces, region_col='Provincias')
+    sppBiomeMatrix, biome_labels, biome_spp_labels = build_incidence_matrix(combinedDataMatrix, region_col='name')
+
+    ## Occurrences binned into a regular grid, so maps do not need every record to be drawn
+    counts = bin_points(combinedDataMatrix.geometry.x, combinedDataMatrix.geometry.y, extent=map_extent, cell_size=map_cell_size)
+
+    if use_strict_spatial:
+        save_incidence_matrix(output+'incidence_provinces_strict.npz', sppNeoMatrix, neo_labels, spp_labels)
+        save_incidence_matrix(output+'incidence_biomes_strict.npz', sppBiomeMatrix, biome_labels, biome_spp_labels)
+        save_point_grid(output+'occurrence_grid_strict.npz', counts, map_extent, map_cell_size)
         combinedDataMatrix.to_csv(output+'combinedDataMatrix_strict.csv')
     else:
+        save_incidence_matrix(output+'incidence_provinces_relaxed.npz', sppNeoMatrix, neo_labels, spp_labels)
+        save_incidence_matrix(output+'incidence_biomes_relaxed.npz', sppBiomeMatrix, biome_labels, biome_spp_labels)
+        save_point_grid(output+'occurrence_grid_relaxed.npz', counts, map_extent, map_cell_size)
         combinedDataMatrix.to_csv(output+'combinedDataMatrix_relaxed.csv')
 
-    logging.info("Map and combined dataset saved")
\ No newline at end of file
+    logging.info("Combined dataset, incidence matrices and occurrence grid saved")
+
+def perform_endemism_analysis(use_strict_spatial:bool):
+    """
+    Compute restricted-range species, weighted endemism and corrected weighted endemism for every biome and Neotropical
+    province from the saved incidence matrices, and write one table per layer ready for mapping.
+    The dataset is passed explicitly, since the streaming run selects it with 'use_strict' instead of 'use_strict_spatial'.
+    """
+
+    logging.info("Computing biome and province endemism metrics")
+
+    for layer in ['biomes', 'provinces']:
+        if use_strict_spatial:
+            matrix, region_labels, _ = load_incidence_matrix(output+f'incidence_{layer}_strict.npz')
+        else:
+            matrix, region_labels, _ = load_incidence_matrix(output+f'incidence_{layer}_relaxed.npz')
+
+        metrics = endemism_metrics(matrix, region_labels, max_regions=restricted_range_max_regions)
+
+        if use_strict_spatial:
+            metrics.to_csv(output+f'endemism_{layer}_strict.csv')
+        else:
+            metrics.to_csv(output+f'endemism_{layer}_relaxed.csv')
+
+        logging.info(f"Restricted-range species ({layer}, <= {restricted_range_max_regions} regions): {metrics['restrictedSpp'].sum()}")
+
+def perform_completeness_analysis(combinedDataMatrix, region_labels):
+    """
+    Estimate sampling completeness (Chao1, Chao2, ACE and coverage) and rarefaction/extrapolation curves for every
+    biome and Neotropical province. Sampling units for the incidence-based estimates are grid cells of
+    'completeness_unit_size' degrees.
+    """
+
+    logging.info("Estimating sampling completeness per biome and province")
+
+    lon = combinedDataMatrix.geometry.x.to_numpy()
+    lat = combinedDataMatrix.geometry.y.to_numpy()
+    cells = np.floor((lon + 180) / completeness_unit_size).astype(np.int64) * 1_000_000 + np.floor((lat + 90) / completeness_unit_size).astype(np.int64)
+    taxon_codes, _ = pd.factorize(combinedDataMatrix['current_name'])
+
+    for layer in ['biome', 'province']:
+        abundance, incidence, n_units = region_frequencies(combinedDataMatrix[f'{layer}_code'], taxon_codes, cells)
+        estimates, curves = completeness_by_region(abundance, incidence, n_units, region_labels[layer],
+                                                   n_bootstrap=completeness_bootstrap, n_points=rarefaction_points,
+                                                   seed=completeness_seed, max_workers=completeness_max_workers)
+
+        if use_strict_spatial:
+            estimates.to_csv(output+f'completeness_{layer}_strict.csv')
+            curves.to_csv(output+f'rarefaction_{layer}_strict.csv', index=False)
+        else:
+            estimates.to_csv(output+f'completeness_{layer}_relaxed.csv')
+            curves.to_csv(output+f'rarefaction_{layer}_relaxed.csv', index=False)
+
+        logging.info(f"Completeness estimated for {len(estimates)} regions ({layer})")
+
+def plot_results(neo_path, render_mode=None):
+    """
+    Generate draft map showing species richness across biogeographical provinces from saved richness tables.
+    Occurrences are drawn from the saved occurrence grid ('grid') or, as before, as individual points ('points').
+    Does not depend on objects from the spatial analysis, so maps can be regenerated on their own.
+    render_mode defaults to map_render_mode as set when the function is called (e.g. by cli.py --set).
+    """
+
+    if render_mode is None:
+        render_mode = map_render_mode
+
+    logging.info(f"Plotting results ({render_mode} mode)")
+
+    neo = simplified_layer(neo_path, tolerance=map_simplify_tolerance, cache_dir=output+'cache/')
+
+    if use_strict_spatial:
+        richness = pd.read_csv(output+'richness_province_strict.csv', index_col=0)['sppNumber']
+        grid_path = output+'occurrence_grid_strict.npz'
+        comb_matrix = comb_matrix_strict
+        map_path = output+'provinceMap_plasma_strict.png'
+    else:
+        richness = pd.read_csv(output+'richness_province_relaxed.csv', index_col=0)['sppNumber']
+        grid_path = output+'occurrence_grid_relaxed.npz'
+        comb_matrix = comb_matrix_relaxed
+        map_path = output+'provinceMap_plasma_relaxed.png'
+
+    ## Mapping species numbers to each province and plotting it (draft map that was edited for publication)
+    if render_mode == 'grid':
+        render_richness_map(neo, 'Provincias', richness, map_path, extent=map_extent,
+                            grid=load_point_grid(grid_path))
+    elif render_mode == 'points':
+        points = gpd.GeoSeries.from_wkt(pd.read_csv(comb_matrix, usecols=['geometry'])['geometry'], crs='epsg:4326')
+        render_richness_map(neo, 'Provincias', richness, map_path, extent=map_extent,
+                            points=points)
+    else:
+        raise ValueError(f"Unknown render mode '{render_mode}', use 'grid' or 'points'")
+
+    logging.info("Map saved")
@@ -0,0 +1,218 @@
+import os
+import re
+import json
+import logging
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from config import *
+from modules.streaming import *
+from modules.format_mb import format_mb
+from modules.taxonomic_harmonisation import resolve_names
+from modules.verification_store import load_store, merge_decisions, save_store
+from modules.encoding import taxon_vocabulary, encode, save_vocabulary
+from modules.occurrence_cube import OccurrenceCube
+from modules.specimen_duplicates import SpecimenClusters
+from modules.coordinate_cleaning import reference_coordinates
+from modules.locality_geocoding import load_gazetteer
+from modules.spatial_analysis import read_layer, load_reference_layers, label_regions, richness_by_region
+from modules.incidence_matrix import build_incidence_matrix, save_incidence_matrix
+from modules.map_rendering import bin_points, save_point_grid
+from modules.instrumentation import count, current_rss
+from handlers.taxonomic_handlers import occurrence_columns, collapse_specimens, shs_treatment, join_df_shs
+from handlers.spatial_handlers import clean_coordinates, municipality_centroids, locality_points, join_gdfs
+
+
+## Numeric columns of GBIF downloads; every other kept column is read as text so all chunks share one schema
+NUMERIC_COLUMNS = ['year', 'month', 'day', 'decimalLatitude', 'decimalLongitude', 'coordinateUncertaintyInMeters', 'coordinatePrecision']
+
+
+def stream_occurrences(use_strict:bool, occ_strict:str, occ_relaxed:str, mb_path:str, muni_path:str, gazetteer_path:str,
+                       region_layers:dict, memory_budget_mb:float):
+    """
+    Run taxonomic harmonisation, coordinate cleaning, centroid and locality assignment and region labelling chunk by chunk,
+    from the raw GBIF download to labelled occurrences, keeping peak memory under memory_budget_mb.
+
+    Follows the rules of run1 and run2 record by record: duplicates are dropped across chunks, each distinct name is
+    harmonised once, and only distinct species x region pairs and grid counts are kept between chunks. Names awaiting
+    manual verification keep their fuzzy match and are written to pending_verification, as in headless mode.
+
+    Returns:
+        dict: Mapping of layer name to region labels (code -> label).
+    """
+
+    logging.info("Starting streaming run")
+
+    if use_strict:
+        path, read_options = occ_strict, {}
+    else:
+        path, read_options = occ_relaxed, {'sep': '\t'}
+
+    columns, dedup_subset = occurrence_columns(use_strict)
+    read_options.update({
+        'usecols': columns,
+        'dtype': {column: float if column in NUMERIC_COLUMNS else str for column in columns},
+        'on_bad_lines': 'warn'
+    })
+
+    ## Reference data loaded once and shared by every chunk
+    mycobank = format_mb(mb_path)
+
+    if use_strict:
+        verified_path = verified_manually_strict
+    else:
+        verified_path = verified_manually_relaxed
+
+    store = merge_decisions(load_store(verification_store), verified_path)
+    save_store(store, verification_store)
+    verified = store.set_index('scientificName')['current_name'].to_dict()
+    vocabulary = taxon_vocabulary(mycobank, extra=store['current_name'])
+
+    muni = read_layer(muni_path)
+    centroids, envelopes = reference_coordinates(muni)
+    ## Municipality polygons reduced to their centroids once, instead of once per matched record in every chunk
+    muni_points = muni.copy()
+    muni_points['geometry'] = muni.geometry.centroid
+    layers = load_reference_layers(region_layers)
+
+    if os.path.exists(gazetteer_path):
+        gazetteer = load_gazetteer(gazetteer_path)
+    else:
+        logging.warning(f"Gazetteer {gazetteer_path} not found, skipping locality geocoding")
+        gazetteer = None
+
+    if use_strict:
+        suffix, cube_path = 'strict', occurrence_cube_strict
+    else:
+        suffix, cube_path = 'relaxed', occurrence_cube_relaxed
+
+    ## Chunk size re-estimated after every chunk from measured RSS, which also counts the state growing between chunks
+    sizer = ChunkSizer(path, read_options, memory_budget_mb)
+    logging.info(f"Reading {path} in chunks of {sizer.rows} rows to start with ({memory_budget_mb} MB budget)")
+
+    dedup = DedupFilter()
+    clusterer = SpecimenClusters(score_threshold=collector_score_threshold)
+    sh_table = {}
+    current_names = pd.Series(dtype=object)
+    pending = []
+    flag_counts = None
+    rejected = 0
+    pairs = {layer: None for layer in layers}
+    region_labels = {}
+    grid = 0
+    raw_rows = 0
+
+    ## Species x region x year cube, built anew by every run (which reads the whole download) and updated chunk by chunk
+    cube = OccurrenceCube()
+
+    harmonised_writer = ParquetAppender(output+f'occurrences_harmonised_{suffix}.parquet')
+    labelled_writer = ParquetAppender(output+f'labelled_occurrences_{suffix}.parquet')
+
+    for chunk in sizer.iter_chunks(path, read_options):
+        raw_rows += len(chunk)
+
+        ## Formatting and duplicate removal (format_occurrences), with duplicates tracked across chunks
+        chunk = chunk.dropna(subset=['species'])[columns]
+        chunk = chunk[dedup.first_seen(chunk[dedup_subset])]
+        chunk = collapse_specimens(chunk, clusterer)
+        chunk['scientificName'] = [re.sub(r'\d+', '', i) for i in chunk['scientificName']]
+
+        shs = shs_treatment(chunk, sh_table=sh_table)
+        chunk = join_df_shs(chunk, shs).drop(columns='index')
+
+        ## Taxonomic harmonisation, each distinct name resolved once for the whole run
+        names = pd.unique(chunk['scientificName'].to_numpy(dtype=object))
+        new_names = names[current_names.index.get_indexer(names) < 0]
+        count('names_resolved', len(new_names))
+        if len(new_names) > 0:
+            resolved, new_pending = resolve_names(new_names, mycobank, verified=verified, score_threshold=jaro_threshold)
+            current_names = pd.concat([current_names, resolved])
+            pending.extend(new_pending)
+
+        ## Current names coded by one vocabulary for the whole run, so pairs from different chunks concatenate as codes
+        chunk['current_name'] = encode(chunk['scientificName'].map(current_names), vocabulary)
+        vocabulary = chunk['current_name'].cat.categories
+        chunk = chunk[~chunk['current_name'].isna()].reset_index(drop=True)
+        harmonised_writer.write(chunk)
+
+        ## Spatial treatment (run2) of the harmonised chunk
+        CoordsMatrix = chunk[~chunk['decimalLongitude'].isna()]
+        CoordsMatrix = CoordsMatrix[~CoordsMatrix['decimalLatitude'].isna()].reset_index(drop=True)
+        CoordsMatrix, chunk_flags = clean_coordinates(CoordsMatrix, centroids, envelopes)
+        flag_counts = chunk_flags if flag_counts is None else flag_counts.add(chunk_flags, fill_value=0)
+        rejected += chunk_flags.attrs['rejected']
+
+        noCoordsMatrix = chunk[chunk['decimalLongitude'].isna()]
+        NCcountyMatrix = municipality_centroids(noCoordsMatrix, 'county', muni_points)
+        NCmuniMatrix = municipality_centroids(noCoordsMatrix, 'municipality', muni_points)
+        if gazetteer is not None:
+            NClocalityMatrix = locality_points(noCoordsMatrix, gazetteer, output+f'geocoded_localities_{suffix}.csv')
+        else:
+            NClocalityMatrix = gpd.GeoDataFrame(columns=['gbifID', 'current_name', 'year', 'geometry'], geometry='geometry', crs="EPSG:4326")
+
+        combinedDataMatrix = join_gdfs(CoordsMatrix, NCcountyMatrix, NCmuniMatrix, NClocalityMatrix)
+        combinedDataMatrix, region_labels = label_regions(combinedDataMatrix, layers)
+        combinedDataMatrix = combinedDataMatrix[combinedDataMatrix['biome_code'] >= 0].reset_index(drop=True)
+
+        labelled = pd.DataFrame({
+            'gbifID': combinedDataMatrix['gbifID'].to_numpy(),
+            'current_name': combinedDataMatrix['current_name'].array,
+            'year': combinedDataMatrix['year'].to_numpy(),
+            'decimalLongitude': combinedDataMatrix.geometry.x.to_numpy(),
+            'decimalLatitude': combinedDataMatrix.geometry.y.to_numpy()
+        })
+        for layer in layers:
+            labelled[f'{layer}_code'] = combinedDataMatrix[f'{layer}_code'].to_numpy()
+            chunk_pairs = labelled.loc[labelled[f'{layer}_code'] >= 0, ['current_name', f'{layer}_code']]
+            pairs[layer] = chunk_pairs.drop_duplicates() if pairs[layer] is None else pd.concat([pairs[layer], chunk_pairs]).drop_duplicates()
+        labelled_writer.write(labelled)
+        cube.update(labelled, region_labels)
+
+        grid = grid + bin_points(labelled['decimalLongitude'], labelled['decimalLatitude'], extent=map_extent, cell_size=map_cell_size)
+
+        logging.info(f"Chunk done: {raw_rows} raw rows read, {harmonised_writer.rows} harmonised and {labelled_writer.rows} labelled records written, "
+                     f"RSS {(current_rss() or 0) / 2**20:.0f} MB")
+
+    harmonised_writer.close()
+    labelled_writer.close()
+
+    logging.info(f"Distinct names harmonised: {len(current_names)} ({current_names.isna().sum()} discarded)")
+    logging.info(f"Georeferenced records rejected by coordinate cleaning: {rejected}")
+
+    if flag_counts is not None:
+        flag_counts.astype(int).rename('records').to_csv(output+f'coordinate_flags_{suffix}.csv')
+
+    if len(pending) > 0:
+        pd.DataFrame({'scientificName': pending}).to_csv(pending_verification)
+        logging.warning(f"{len(pending)} names await manual verification, written to {pending_verification}")
+
+    ## Region-level outputs of perform_region_labelling and save_results, rebuilt from the distinct pairs
+    for layer in region_labels:
+        richness = richness_by_region(pairs[layer], region_labels, layer)
+        richness.to_csv(output+f'richness_{layer}_{suffix}.csv')
+        logging.info(f"Regions with records ({layer}): {len(richness)}")
+
+    if 'biome' in region_labels and 'province' in region_labels:
+        provinces = pd.DataFrame({'current_name': pairs['province']['current_name'].array,
+                                  'Provincias': region_labels['province'][pairs['province']['province_code'].to_numpy()]})
+        biomes = pd.DataFrame({'current_name': pairs['biome']['current_name'].array,
+                               'name': region_labels['biome'][pairs['biome']['biome_code'].to_numpy()]})
+        save_incidence_matrix(output+f'incidence_provinces_{suffix}.npz', *build_incidence_matrix(provinces, region_col='Provincias'))
+        save_incidence_matrix(output+f'incidence_biomes_{suffix}.npz', *build_incidence_matrix(biomes, region_col='name'))
+
+    cube.save(cube_path)
+
+    if use_strict:
+        save_vocabulary(taxon_vocabulary_strict, vocabulary)
+    else:
+        save_vocabulary(taxon_vocabulary_relaxed, vocabulary)
+
+    save_point_grid(output+f'occurrence_grid_{suffix}.npz', np.asarray(grid, dtype=np.int64), map_extent, map_cell_size)
+
+    with open(output+f'region_labels_{suffix}.json', 'w') as f:
+        json.dump({layer: list(map(str, layer_labels)) for layer, layer_labels in region_labels.items()}, f)
+
+    logging.info(f"Streaming run finished: {labelled_writer.rows} labelled records")
+
+    return region_labels
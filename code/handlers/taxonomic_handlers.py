@@ -1,18 +1,58 @@
 import os
 import re
 import numpy as np
-import aiohttp
 from tqdm import tqdm
 import pandas as pd
 import asyncio
-import nest_asyncio
 import logging
 
 from config import *
 from modules.taxonomic_harmonisation import *
 from modules.format_mb import *
+from modules.verification_store import *
+from modules.encoding import taxon_vocabulary, encode, save_vocabulary
+from modules.specimen_duplicates import SpecimenClusters
 
 
+def occurrence_columns(use_strict:bool):
+    """
+    Columns kept from GBIF downloads and the subset of them defining a duplicate record.
+    """
+
+    if use_strict:
+        columns = ['gbifID', 'institutionCode', 'collectionCode', 'catalogNumber', 'year', 'month', 'day', 
+                   'continent', 'stateProvince', 'county', 'municipality', 'locality', 'decimalLatitude',
+                   'decimalLongitude','scientificName','species', 'acceptedScientificName', 'recordedBy']
+        dedup_subset = ['species','recordedBy','institutionCode','catalogNumber','decimalLatitude','decimalLongitude',
+                        'year', 'month', 'day']
+
+    else:
+        columns = ['gbifID', 'publisher', 'type', 'institutionCode', 'collectionCode', 'basisOfRecord', 'occurrenceID', 'catalogNumber', 
+                   'eventDate', 'year', 'month', 'day', 'higherGeography', 'continent', 'countryCode', 'stateProvince', 'county', 'municipality', 'locality', 
+                   'verbatimLocality', 'verbatimElevation', 'decimalLatitude', 'decimalLongitude', 'coordinateUncertaintyInMeters', 
+                   'coordinatePrecision', 'pointRadiusSpatialFit', 'verbatimCoordinateSystem', 'georeferencedDate', 'scientificName', 'issue', 
+                   'hasCoordinate', 'hasGeospatialIssues', 'species', 'acceptedScientificName', 'recordedBy']
+        dedup_subset = ['species','recordedBy','institutionCode','catalogNumber','decimalLatitude','decimalLongitude',
+                        'verbatimLocality','year', 'month', 'day']
+
+    return columns, dedup_subset
+
+def collapse_specimens(df_species, clusterer):
+    """
+    Label duplicate specimens with their cluster ID ('specimenCluster') and, with collapse_duplicate_specimens, keep only
+    the first record of each cluster.
+    """
+
+    clusters, first = clusterer.assign(df_species)
+    df_species = df_species.assign(specimenCluster=clusters)
+
+    logging.info(f"Records duplicating an earlier specimen (same species, date and collector): {(~first).sum()}")
+
+    if collapse_duplicate_specimens:
+        df_species = df_species[first]
+
+    return df_species
+
 def format_occurrences(use_strict:bool, occ_strict:str, occ_relaxed:str):
     """
     Orchestrate relevant column selection and formatting in GBIF downloaded data.
@@ -36,25 +76,11 @@ def format_occurrences(use_strict:bool, occ_strict:str, occ_relaxed:str):
 
     logging.info(f"Records after dropping rows with missing species: {len(df_species)}")
 
-    if occ_strict:
-        df_species = df_species[['gbifID', 'institutionCode', 'collectionCode', 'catalogNumber', 'year', 'month', 'day', 
-                                'continent', 'stateProvince', 'county', 'municipality', 'locality', 'decimalLatitude',
-                                'decimalLongitude','scientificName','species', 'acceptedScientificName', 'recordedBy']]
-        
-        df_species.drop_duplicates(
-        subset=['species','recordedBy','institutionCode','catalogNumber','decimalLatitude','decimalLongitude',
-                'year', 'month', 'day'], inplace=True)
+    columns, dedup_subset = occurrence_columns(use_strict)
+    df_species = df_species[columns]
+    df_species.drop_duplicates(subset=dedup_subset, inplace=True)
 
-    else:
-        df_species = df_species[['gbifID', 'publisher', 'type', 'institutionCode', 'collectionCode', 'basisOfRecord', 'occurrenceID', 'catalogNumber', 
-                            'eventDate', 'year', 'month', 'day', 'higherGeography', 'continent', 'countryCode', 'stateProvince', 'county', 'municipality', 'locality', 
-                            'verbatimLocality', 'verbatimElevation', 'decimalLatitude', 'decimalLongitude', 'coordinateUncertaintyInMeters', 
-                            'coordinatePrecision', 'pointRadiusSpatialFit', 'verbatimCoordinateSystem', 'georeferencedDate', 'scientificName', 'issue', 
-                            'hasCoordinate', 'hasGeospatialIssues', 'species', 'acceptedScientificName', 'recordedBy']]
-
-        df_species.drop_duplicates(
-        subset=['species','recordedBy','institutionCode','catalogNumber','decimalLatitude','decimalLongitude',
-                'verbatimLocality','year', 'month', 'day'], inplace=True)
+    df_species = collapse_specimens(df_species, SpecimenClusters(score_threshold=collector_score_threshold))
 
     df_species['scientificName'] = [re.sub(r'\d+', '', i) for i in df_species['scientificName']]
 
@@ -67,6 +93,8 @@ async def fetch_sh_data(session, sh_code, retries=3):
     These are present only in the relaxed dataset. However, the function is called for both to maintain code integrity.
     """
 
+    import aiohttp
+
     api_sh = "https://api.plutof.ut.ee/v1/public/dshclusters/search/?name="
     api_taxon = "https://api.plutof.ut.ee/v1/public/taxa/"
 
@@ -100,7 +128,10 @@ async def main(shs_list, shs_code, shs_binomial_author, wait_time=1.5):
     Asynchronous function for connecting with PlutoF API service to retrieve taxonomic information for Species Hypothesis (SH).
     These are present only in the relaxed dataset. However, the function is called for both to maintain code integrity.
     """
-    
+
+    ## aiohttp and nest_asyncio are only loaded when there are SHs to look up
+    import aiohttp
+
     if isinstance(shs_list, np.ndarray):
         shs_list = shs_list.tolist()
 
@@ -119,9 +150,12 @@ async def main(shs_list, shs_code, shs_binomial_author, wait_time=1.5):
             shs_code.append(sh_code)
             shs_binomial_author.append(binomial_author)
 
-def shs_treatment(df_species):
+def shs_treatment(df_species, sh_table=None):
     """
     Orchestrate SHs asynchronous functions output handling along with non-SHs information present in GBIF data.
+
+    When sh_table (dict of SH code -> binomial with authors) is given, only SH codes missing from it are requested and
+    it is updated in place with the new answers, so chunks of one download share the PlutoF lookups.
     """
 
     logging.info("Starting SHs treatment")
@@ -130,17 +164,25 @@ def shs_treatment(df_species):
 
     if len(shs) > 0:
         shs_list = shs['acceptedScientificName'].unique()
+        if sh_table is not None:
+            shs_list = np.array([code for code in shs_list if code not in sh_table])
         
+        import nest_asyncio
         nest_asyncio.apply()
 
         shs_code = []
         shs_binomial_author = []
     
-        asyncio.run(main(shs_list, shs_code, shs_binomial_author, wait_time=1.5))
+        if len(shs_list) > 0:
+            asyncio.run(main(shs_list, shs_code, shs_binomial_author, wait_time=1.5))
 
         sh_dict = {'code':shs_code, 'scientificName':shs_binomial_author}
         sh_api = pd.DataFrame(sh_dict)
 
+        if sh_table is not None:
+            sh_table.update(zip(shs_code, shs_binomial_author))
+            sh_api = pd.DataFrame({'code':list(sh_table), 'scientificName':list(sh_table.values())})
+
         shs.drop('scientificName', axis=1, inplace=True)
         shs = pd.merge(shs, sh_api, how='left', left_on='acceptedScientificName', right_on='code')
         shs.drop('code', axis=1, inplace=True)
@@ -213,18 +255,27 @@ def perform_harmonisation(df_species, mb_path):
 
     logging.info(f"Manual check matches: {len(manual_check)} ({(len(manual_check)/len(df_species))*100:.1f}% of total occurrences)")
 
-    if occ_strict:
+    if use_strict:
         manual_check.drop_duplicates(subset='scientificName').to_csv(output+'manual_check_taxonomy_strict.csv')
     else:
         manual_check.drop_duplicates(subset='scientificName').to_csv(output+'manual_check_taxonomy_relaxed.csv')
 
-    ## Reading back verified names
-    if occ_strict:
+    ## Reading back verified names. Decisions accumulate in the verification store, so only new names need checking
+    if use_strict:
         filename = verified_manually_strict
     else:
         filename = verified_manually_relaxed
 
-    while not os.path.exists(filename):
+    store = load_store(verification_store)
+    store = merge_decisions(store, filename)
+    pending = pending_names(manual_check, store)
+
+    if len(pending) > 0 and headless:
+        ## Undecided names keep their fuzzy match for this run and are queued for the next round of checks
+        pending.to_csv(pending_verification)
+        logging.warning(f"{len(pending)} names await manual verification, written to {pending_verification}")
+
+    while len(pending) > 0 and not headless and not os.path.exists(filename):
         print(f'{filename} not found.')
         action = input(f'Please create {filename} or check if it is accessible. [A]bort or [T]ry again? (A/T): ').strip().upper()
 
@@ -232,10 +283,14 @@ def perform_harmonisation(df_species, mb_path):
             raise FileNotFoundError(f'File {filename} not found and user aborted')
         elif action == 'T':
             if os.path.exists(filename):
+                store = merge_decisions(store, filename)
                 break
-    
-    verified_names = pd.read_excel(filename)
-    verified_names_dict = verified_names.set_index('scientificName')['current_name'].to_dict()
+
+    save_store(store, verification_store)
+
+    logging.info(f"Verification decisions applied: {manual_check['scientificName'].isin(store['scientificName']).sum()} records ({len(store)} names in store)")
+
+    verified_names_dict = store.set_index('scientificName')['current_name'].to_dict()
 
     manual_check['current_name'] = manual_check['scientificName'].map(verified_names_dict).combine_first(manual_check['current_name'])
     manual_check = manual_check[manual_check['current_name']!='NOTFOUND']
@@ -247,9 +302,11 @@ def perform_harmonisation(df_species, mb_path):
 
     manual_check = manual_check.drop(['fuzzname', 'fuzzscore', 'epithet_score', 'author_score'], axis=1)
 
-    occurrences_harmonised = pd.concat([harmonised, fuzzymatched, fuzzymatchedfinal, manual_check])
-    occurrences_harmonised = pd.concat([harmonised, fuzzymatched, fuzzymatchedfinal, manual_check])
-    occurrences_harmonised = occurrences_harmonised.reset_index(drop=True)
+    occurrences_harmonised = pd.concat([harmonised, fuzzymatched, fuzzymatchedfinal, manual_check], ignore_index=True)
+
+    ## Current names coded by the MycoBank vocabulary (plus manual decisions), decoded to text only in the written tables
+    vocabulary = taxon_vocabulary(mycobank, extra=store['current_name'])
+    occurrences_harmonised['current_name'] = encode(occurrences_harmonised['current_name'], vocabulary)
 
     derep_occs = occurrences_harmonised.drop_duplicates(subset='current_name')
 
@@ -261,9 +318,11 @@ def perform_harmonisation(df_species, mb_path):
     logging.info(f"Total species harmonised (known and accepted total species estimate): {spp_n}")
     logging.info(f"Total genera harmonised (known and accepted total genera estimate): {len(gen_uni)}")
 
-    if occ_strict:
+    if use_strict:
         occurrences_harmonised.to_csv(output+'occurrences_harmonised_strict.csv')
         derep_occs.to_csv(output+'derep_occs_strict.csv')
+        save_vocabulary(taxon_vocabulary_strict, occurrences_harmonised['current_name'].cat.categories)
     else:
         occurrences_harmonised.to_csv(output+'occurrences_harmonised_relaxed.csv')
         derep_occs.to_csv(output+'derep_occs_relaxed.csv')
+        save_vocabulary(taxon_vocabulary_relaxed, occurrences_harmonised['current_name'].cat.categories)
@@ -0,0 +1,82 @@
+## Functions to stream GBIF SIMPLE_CSV download archives for the endemic species inferences presented in the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import io
+import zipfile
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+
+def archive_member(zf):
+    """
+    Name of the occurrence table inside a GBIF SIMPLE_CSV archive (the first .csv member).
+    """
+
+    names = [name for name in zf.namelist() if name.endswith('.csv')]
+
+    return names[0] if names else zf.namelist()[0]
+
+def iter_archive_tables(zip_path, columns=('species', 'countryCode'), stats=None, slab_size=256 << 20, block_size=16 << 20):
+    """
+    Stream a GBIF SIMPLE_CSV archive as Arrow tables holding only the requested columns, dictionary-encoded.
+
+    The archive member is decompressed through zipfile in slabs cut at line boundaries; each slab is parsed by the
+    multi-threaded Arrow CSV reader, so memory stays bounded by the slab size while parsing uses every core.
+    Malformed lines are skipped and counted in stats['bad_lines'] (stats['rows'] counts parsed rows).
+
+    Parameters:
+        zip_path (str): Path of the download archive.
+        columns (tuple): Columns to parse; every other column is skipped by the parser.
+        stats (dict): Optional dictionary updated with 'rows' and 'bad_lines' counts.
+        slab_size (int): Bytes of decompressed text parsed at once.
+        block_size (int): Arrow block size, the unit of parallel parsing.
+    """
+
+    if stats is None:
+        stats = {}
+    stats.setdefault('rows', 0)
+    stats.setdefault('bad_lines', 0)
+
+    def skip_invalid(row):
+        stats['bad_lines'] += 1
+        return 'skip'
+
+    dict_type = pa.dictionary(pa.int32(), pa.string())
+    convert_options = pacsv.ConvertOptions(
+        include_columns=list(columns),
+        column_types={column: dict_type for column in columns},
+        strings_can_be_null=True
+    )
+    ## SIMPLE_CSV is tab-delimited without quoting
+    parse_options = pacsv.ParseOptions(delimiter='\t', quote_char=False, invalid_row_handler=skip_invalid)
+
+    with zipfile.ZipFile(zip_path) as zf, zf.open(archive_member(zf)) as member:
+        header = member.readline()
+        column_names = header.decode('utf-8').rstrip('\r\n').split('\t')
+        read_options = pacsv.ReadOptions(use_threads=True, block_size=block_size, column_names=column_names)
+
+        remainder = b''
+        while True:
+            slab = member.read(slab_size)
+            if not slab and not remainder:
+                break
+
+            slab = remainder + slab
+            if len(slab) > len(remainder):
+                cut = slab.rfind(b'\n') + 1
+                ## A single line longer than the slab: keep reading
+                if cut == 0:
+                    remainder = slab
+                    continue
+                slab, remainder = slab[:cut], slab[cut:]
+            else:
+                remainder = b''
+
+            table = pacsv.read_csv(io.BytesIO(slab), read_options=read_options, parse_options=parse_options,
+                                   convert_options=convert_options)
+            stats['rows'] += table.num_rows
+
+            yield table
@@ -0,0 +1,128 @@
+## Functions to flag problematic coordinates ahead of the spatial analysis presented in the results of the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import unicodedata
+import numpy as np
+import pandas as pd
+
+
+## Brazilian territory including oceanic islands (Fernando de Noronha, Trindade and Martim Vaz, São Pedro e São Paulo)
+BR_BBOX = (-74.1, -28.6, -33.9, 5.4)
+
+## Country centroids commonly assigned to Brazil by georeferencing services (geographic centre and Google centroid)
+BR_CENTROIDS = np.array([[-53.0896, -10.7722], [-51.9253, -14.2350], [-55.0, -10.0]])
+
+STATES = {
+    'AC': 'ACRE', 'AL': 'ALAGOAS', 'AP': 'AMAPA', 'AM': 'AMAZONAS', 'BA': 'BAHIA', 'CE': 'CEARA',
+    'DF': 'DISTRITO FEDERAL', 'ES': 'ESPIRITO SANTO', 'GO': 'GOIAS', 'MA': 'MARANHAO', 'MT': 'MATO GROSSO',
+    'MS': 'MATO GROSSO DO SUL', 'MG': 'MINAS GERAIS', 'PA': 'PARA', 'PB': 'PARAIBA', 'PR': 'PARANA',
+    'PE': 'PERNAMBUCO', 'PI': 'PIAUI', 'RJ': 'RIO DE JANEIRO', 'RN': 'RIO GRANDE DO NORTE',
+    'RS': 'RIO GRANDE DO SUL', 'RO': 'RONDONIA', 'RR': 'RORAIMA', 'SC': 'SANTA CATARINA', 'SP': 'SAO PAULO',
+    'SE': 'SERGIPE', 'TO': 'TOCANTINS'
+}
+
+
+def normalise_state(state):
+    """
+    Map a free-text 'stateProvince' value to its two-letter UF code ('' when not recognised).
+    """
+
+    if not isinstance(state, str):
+        return ''
+
+    state = unicodedata.normalize('NFKD', state).encode('ASCII', 'ignore').decode().upper()
+    state = ' '.join(state.replace('-', ' ').replace('.', ' ').split())
+    state = state.removeprefix('ESTADO DO ').removeprefix('ESTADO DE ').removeprefix('ESTADO DA ')
+
+    if state in STATES:
+        return state
+    for uf, name in STATES.items():
+        if state == name:
+            return uf
+
+    return ''
+
+def reference_coordinates(muni):
+    """
+    Precompute municipality centroids and state envelopes from the IBGE municipality layer.
+
+    Parameters:
+        muni (GeoDataFrame): Municipalities in EPSG:4326 with 'SIGLA_UF' column.
+
+    Returns:
+        Tuple[ndarray, DataFrame]: Centroid coordinates (n x 2, lon/lat) and state envelopes (minx, miny, maxx, maxy) indexed by UF code.
+    """
+
+    centroids = muni.geometry.centroid
+    centroids = np.column_stack([centroids.x.to_numpy(), centroids.y.to_numpy()])
+
+    bounds = muni.geometry.bounds
+    bounds['SIGLA_UF'] = muni['SIGLA_UF'].to_numpy()
+    envelopes = bounds.groupby('SIGLA_UF').agg({'minx': 'min', 'miny': 'min', 'maxx': 'max', 'maxy': 'max'})
+
+    return centroids, envelopes
+
+def _in_envelope(lon, lat, env):
+    return (lon >= env[:, 0]) & (lon <= env[:, 2]) & (lat >= env[:, 1]) & (lat <= env[:, 3])
+
+def _coordinate_keys(coords, tolerance):
+    coords = np.round(np.asarray(coords, dtype=float) / tolerance).astype(np.int64)
+    return coords[:, 0] * 100_000_000 + coords[:, 1]
+
+def flag_coordinates(lon, lat, states, centroids, envelopes, centroid_tolerance=0.001, min_decimals=2):
+    """
+    Flag problematic coordinates with vectorised array tests.
+
+    Parameters:
+        lon, lat (array-like): Declared decimal longitude and latitude.
+        states (array-like): Declared 'stateProvince' values.
+        centroids (ndarray): Municipality centroids (n x 2, lon/lat), from reference_coordinates.
+        envelopes (DataFrame): State envelopes indexed by UF code, from reference_coordinates.
+        centroid_tolerance (float): Distance in degrees under which a point is considered to sit on a centroid.
+        min_decimals (int): Coordinates with fewer decimal places in both axes are flagged as low precision.
+
+    Returns:
+        DataFrame: One boolean column per flag ('zero', 'outside_bbox', 'swapped', 'outside_state', 'centroid',
+        'low_precision').
+    """
+
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+
+    flags = pd.DataFrame(index=range(len(lon)))
+
+    flags['zero'] = (lon == 0) | (lat == 0)
+
+    xmin, xmax, ymin, ymax = BR_BBOX
+    flags['outside_bbox'] = ~((lon >= xmin) & (lon <= xmax) & (lat >= ymin) & (lat <= ymax))
+
+    ## Declared state envelopes, broadcast to records; records without a recognised state are not tested
+    uf = pd.Series(states).map(normalise_state).to_numpy()
+    env = envelopes.reindex(uf)[['minx', 'miny', 'maxx', 'maxy']].to_numpy()
+    has_state = ~np.isnan(env[:, 0])
+
+    in_state = _in_envelope(lon, lat, env)
+    in_state_swapped = _in_envelope(lat, lon, env)
+    flags['swapped'] = has_state & ~in_state & in_state_swapped
+    flags['outside_state'] = has_state & ~in_state & ~in_state_swapped & ~flags['outside_bbox'].to_numpy()
+
+    ## Municipality and country centroids, matched on coordinates rounded to the tolerance (neighbouring cells included)
+    ref_keys = np.unique(np.concatenate([_coordinate_keys(centroids, centroid_tolerance),
+                                         _coordinate_keys(BR_CENTROIDS, centroid_tolerance)]))
+    coords = np.column_stack([lon, lat])
+    on_centroid = np.zeros(len(lon), dtype=bool)
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            shifted = coords + np.array([dx, dy]) * centroid_tolerance
+            on_centroid |= np.isin(_coordinate_keys(shifted, centroid_tolerance), ref_keys)
+    flags['centroid'] = on_centroid
+
+    scale = 10 ** (min_decimals - 1)
+    coarse_lon = np.isclose(lon * scale, np.round(lon * scale))
+    coarse_lat = np.isclose(lat * scale, np.round(lat * scale))
+    flags['low_precision'] = coarse_lon & coarse_lat
+
+    return flags
@@ -0,0 +1,119 @@
+## Functions to store and query species x country presence for the endemic species inferences presented in the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import os
+import numpy as np
+import pandas as pd
+
+
+## Every two-letter code gets a fixed slot (AA..ZZ, 676 slots), plus one slot for missing country codes ('UNK')
+N_SLOTS = 26 * 26 + 1
+UNK_SLOT = 26 * 26
+N_WORDS = (N_SLOTS + 63) // 64
+
+
+def country_slots(codes):
+    """
+    Fixed bit positions of ISO 3166-1 alpha-2 country codes ('UNK' and anything that is not two letters map to the UNK slot).
+    """
+
+    codes = pd.Series(codes, dtype=object).fillna('UNK').astype(str).str.upper()
+    slots = np.full(len(codes), UNK_SLOT, dtype=np.int64)
+
+    valid = codes.str.fullmatch('[A-Z]{2}').to_numpy(dtype=bool)
+    if valid.any():
+        letters = np.frombuffer(''.join(codes[valid]).encode('ascii'), dtype=np.uint8).reshape(-1, 2).astype(np.int64) - ord('A')
+        slots[valid] = letters[:, 0] * 26 + letters[:, 1]
+
+    return slots
+
+def country_mask(codes):
+    """
+    Bitset (N_WORDS uint64 words) with the bits of the given country codes set.
+    """
+
+    mask = np.zeros(N_WORDS, dtype=np.uint64)
+    for slot in country_slots(list(codes)):
+        mask[slot // 64] |= np.uint64(1) << np.uint64(slot % 64)
+
+    return mask
+
+class CountryIndex:
+    """
+    Species x country presence stored as one fixed-width bitset per species, with a species label table and the list of
+    download archives already merged (by content digest), so new archives can be added incrementally.
+    """
+
+    def __init__(self, species=None, bits=None, archives=None):
+        self.species = pd.Index(species if species is not None else [], dtype=object)
+        self.bits = bits if bits is not None else np.zeros((0, N_WORDS), dtype=np.uint64)
+        self.archives = list(archives or [])
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+
+        with np.load(path, allow_pickle=False) as npz:
+            return cls(npz['species'].astype(object), npz['bits'], npz['archives'].tolist())
+
+    def save(self, path):
+        np.savez_compressed(path, species=np.asarray(self.species, dtype=str), bits=self.bits,
+                            archives=np.asarray(self.archives, dtype=str))
+
+    def update(self, pairs, archive=None):
+        """
+        Merge distinct (species, countryCode) pairs into the index.
+        """
+
+        new_species = pd.Index(pairs['species'].unique()).difference(self.species)
+        if len(new_species):
+            self.species = self.species.append(new_species)
+            self.bits = np.vstack([self.bits, np.zeros((len(new_species), N_WORDS), dtype=np.uint64)])
+
+        rows = self.species.get_indexer(pairs['species'])
+        slots = country_slots(pairs['countryCode'])
+        values = np.left_shift(np.uint64(1), (slots % 64).astype(np.uint64))
+        np.bitwise_or.at(self.bits, (rows, slots // 64), values)
+
+        if archive is not None:
+            self.archives.append(archive)
+
+    def n_countries(self):
+        """
+        Number of countries (including 'UNK') where each species was recorded.
+        """
+
+        counts = np.unpackbits(self.bits.view(np.uint8), axis=1).sum(axis=1)
+
+        return pd.Series(counts, index=self.species, name='nCountries')
+
+    def endemic_to(self, code):
+        """
+        Species recorded only in the given country.
+        """
+
+        return self.species[(self.bits == country_mask([code])).all(axis=1)]
+
+    def restricted_to(self, codes):
+        """
+        Species recorded in at least one of the given countries and nowhere else (e.g. Mercosur, Amazon basin countries).
+        """
+
+        mask = country_mask(codes)
+        inside = ((self.bits & ~mask) == 0).all(axis=1)
+        present = (self.bits != 0).any(axis=1)
+
+        return self.species[inside & present]
+
+    def present_in_at_most(self, n):
+        """
+        Species recorded in n or fewer countries.
+        """
+
+        counts = self.n_countries()
+
+        return self.species[(counts <= n).to_numpy()]
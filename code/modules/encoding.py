@@ -0,0 +1,90 @@
+## Dictionary encoding of taxon and region labels shared by the analyses presented in the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import pandas as pd
+
+
+## Text columns of occurrence records holding taxon or region labels, read as categoricals (few distinct values, many records)
+CATEGORICAL_COLUMNS = ['scientificName', 'species', 'acceptedScientificName', 'current_name', 'stateProvince', 'county', 'municipality']
+
+
+def taxon_vocabulary(mycobank, extra=()):
+    """
+    Sorted current names of the parsed MycoBank table, plus names only found elsewhere (e.g. manual decisions).
+    A name's position in the vocabulary is its integer code.
+
+    Parameters:
+        mycobank (DataFrame): Output of format_mb.
+        extra (iterable): Further current names to include.
+
+    Returns:
+        Index: Unique names in sorted order.
+    """
+
+    names = pd.Index(mycobank['binomial_authors'].dropna().astype(str).unique())
+    extra = pd.Index(pd.Series(list(extra), dtype=object).dropna().astype(str).unique())
+
+    return names.union(extra).sort_values()
+
+def encode(values, vocabulary):
+    """
+    Categorical view of a column with the vocabulary as categories. Values missing from the vocabulary are added to it,
+    so nothing is turned into NaN; codes of the vocabulary names are then those of the extended (sorted) vocabulary.
+    """
+
+    values = pd.Series(values)
+
+    ## Categorical columns are recoded from their categories only, without materialising the labels of every record
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        missing = values.cat.categories.astype(str).difference(vocabulary)
+    else:
+        missing = pd.Index(values.dropna().astype(str).unique()).difference(vocabulary)
+    if len(missing):
+        vocabulary = vocabulary.union(missing).sort_values()
+
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.set_categories(vocabulary)
+
+    return values.astype(pd.CategoricalDtype(vocabulary))
+
+def save_vocabulary(path, vocabulary):
+    """
+    Write a vocabulary as a single-column CSV, in code order.
+    """
+
+    pd.DataFrame({'name': vocabulary}).to_csv(path, index=False)
+
+def load_vocabulary(path):
+    """
+    Read a vocabulary written by save_vocabulary.
+    """
+
+    return pd.Index(pd.read_csv(path, dtype={'name': str}, keep_default_na=False)['name'])
+
+def read_encoded_csv(path, vocabulary=None, columns=CATEGORICAL_COLUMNS):
+    """
+    Read occurrence records with taxon and region text columns as categoricals, and 'current_name' coded by the vocabulary
+    when one is given. Labels are decoded back to text only when written out.
+    """
+
+    header = pd.read_csv(path, nrows=0).columns
+    records = pd.read_csv(path, dtype={column: 'category' for column in columns if column in header})
+
+    if vocabulary is not None and 'current_name' in records.columns:
+        records['current_name'] = encode(records['current_name'], vocabulary)
+
+    return records
+
+def compact_columns(records, columns=CATEGORICAL_COLUMNS):
+    """
+    Convert the taxon and region text columns present in a frame to categoricals, in place.
+    """
+
+    for column in columns:
+        if column in records.columns and records[column].dtype == object:
+            records[column] = records[column].astype('category')
+
+    return records
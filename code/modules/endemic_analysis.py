@@ -2,25 +2,68 @@
 ## Authors: Domingos Cardoso & Kelmer Martins-Cunha
 ## Corresponding author: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
 
+import os
+import logging
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 
-def find_endemics(country_sets, binomials):
+from modules.archive_reader import iter_archive_tables
+
+
+def find_endemics(country_index, binomials, country='BR'):
+    """
+    Identify endemic species restricted to one country (by default Brazil, country code 'BR'), among the given binomials.
+    """
+
+    endemics = set(country_index.endemic_to(country))
+
+    ## Filter for match with 'binomials'
+    return [sp for sp in binomials if sp in endemics]
+
+def species_country_pairs(zip_path):
     """
-    Identify endemic species restricted to Brazil (country code 'BR').
+    Distinct (species, countryCode) pairs found in one GBIF SIMPLE_CSV download archive.
+
+    The archive is streamed through the Arrow reader (only 'species' and 'countryCode' are parsed, dictionary-encoded) and
+    each batch is reduced to its distinct pairs with integer codes, so no Python-level loop runs over species. Missing
+    country codes are reported as 'UNK'.
+
+    Returns:
+        Tuple[DataFrame, dict]: Distinct pairs, and reader counts ('rows', 'bad_lines').
     """
 
-    br_endemics = []
+    stats = {}
+    pairs = []
+    for table in iter_archive_tables(zip_path, columns=('species', 'countryCode'), stats=stats):
+        chunk = table.to_pandas()
+        chunk = chunk.dropna(subset=['species'])
+        chunk['countryCode'] = chunk['countryCode'].cat.add_categories(['UNK']).fillna('UNK')
+
+        sp_codes = chunk['species'].cat.codes.to_numpy(dtype=np.int64)
+        cc_codes = chunk['countryCode'].cat.codes.to_numpy(dtype=np.int64)
+        n_cc = len(chunk['countryCode'].cat.categories)
+
+        unique_keys = np.unique(sp_codes * n_cc + cc_codes)
+        pairs.append(pd.DataFrame({
+            'species': chunk['species'].cat.categories.to_numpy()[unique_keys // n_cc],
+            'countryCode': chunk['countryCode'].cat.categories.to_numpy()[unique_keys % n_cc]
+        }))
+
+    if not pairs:
+        return pd.DataFrame(columns=['species', 'countryCode']), stats
+
+    return pd.concat(pairs, ignore_index=True).drop_duplicates(ignore_index=True), stats
+
+def aggregate_country_pairs(zip_files, max_workers=None):
+    """
+    Process download archives in parallel, returning the distinct (species, countryCode) pairs of each archive in input order.
+    """
 
-    ## Find all single-country species
-    single_country_species = {
-        sp: cc for sp, cc in country_sets.items() 
-        if len(cc) == 1
-    }
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(species_country_pairs, zip_files))
 
-    ## Filter for match with 'binomials' and country set equal to 'BR'
-    br_endemics = [
-        sp for sp in binomials 
-        if sp in single_country_species 
-        and next(iter(single_country_species[sp])) == 'BR'
-    ]
+    for zip_path, (_, stats) in zip(zip_files, results):
+        logging.info(f"{os.path.basename(zip_path)}: {stats['rows']} records read, {stats['bad_lines']} malformed lines skipped")
 
-    return br_endemics
\ No newline at end of file
+    return [result[0] for result in results]
@@ -6,9 +6,15 @@
 import re
 import pandas as pd
 
+from modules.scenarios import shared
+
+@shared
 def format_mb(path):
     mycobank = pd.read_excel(path)
 
+    return format_mb_table(mycobank)
+
+def format_mb_table(mycobank):
     keys = ['gen.', 'fam.', 'ordo', 'subgen.', 'subfam.', 'sect.', 'tr.', 'subsect.', 'subcl.',
     'subdiv.', 'cl.', 'div.', 'ser.', 'subdivF.', 'regn.', 'subregn.', 'subordo', 'subtr.',
     'stirps', 'subser.']
@@ -0,0 +1,191 @@
+## Functions to resolve species names offline against a local copy of the GBIF Backbone Taxonomy for the endemic species
+## inferences presented in the manuscript entitled "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import os
+import csv
+import sqlite3
+import unicodedata
+import pandas as pd
+from rapidfuzz import fuzz
+from rapidfuzz.process import extract
+
+from modules.gbif_resolver import choose_match
+
+
+BACKBONE_COLUMNS = ['taxonID', 'scientificName', 'scientificNameAuthorship', 'canonicalName', 'genericName',
+                    'taxonRank', 'taxonomicStatus', 'kingdom']
+
+INFRASPECIFIC_MARKERS = {'var.', 'f.', 'subsp.', 'forma', 'ssp.'}
+
+
+def build_backbone_index(taxon_path, db_path, kingdom='Fungi', chunksize=500_000):
+    """
+    Build an indexed SQLite store from a GBIF Backbone Taxonomy Taxon.tsv dump, keeping only one kingdom.
+
+    Parameters:
+        taxon_path (str): Path to Taxon.tsv from the backbone Darwin Core Archive.
+        db_path (str): Path of the SQLite store to (re)create.
+        kingdom (str): Kingdom to keep (None keeps every record).
+    """
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP TABLE IF EXISTS taxa")
+    conn.execute("DROP TABLE IF EXISTS meta")
+
+    for chunk in pd.read_csv(taxon_path, sep='\t', usecols=BACKBONE_COLUMNS, dtype=str, chunksize=chunksize,
+                             quoting=csv.QUOTE_NONE, on_bad_lines='skip'):
+        if kingdom:
+            chunk = chunk[chunk['kingdom'] == kingdom]
+        chunk = chunk.dropna(subset=['canonicalName'])
+        chunk.drop(columns=['kingdom']).to_sql('taxa', conn, if_exists='append', index=False)
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_canonical ON taxa (canonicalName)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_genus ON taxa (genericName)")
+    ## Written last, so an interrupted build is not taken for a current one
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("INSERT INTO meta VALUES ('source', ?)", (source_stamp(taxon_path, kingdom),))
+    conn.commit()
+    conn.close()
+
+def source_stamp(taxon_path, kingdom='Fungi'):
+    """
+    Size and modification time of a Taxon.tsv dump, plus the kingdom kept, identifying the source of a backbone store.
+    """
+
+    stat = os.stat(taxon_path)
+
+    return f'{stat.st_size}|{stat.st_mtime_ns}|{kingdom}'
+
+def backbone_is_current(taxon_path, db_path, kingdom='Fungi'):
+    """
+    Whether the backbone store exists and was built from the current Taxon.tsv (a store without its dump is kept as is).
+    """
+
+    if not os.path.exists(db_path):
+        return False
+    if not os.path.exists(taxon_path):
+        return True
+
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        conn.close()
+
+    return row is not None and row[0] == source_stamp(taxon_path, kingdom)
+
+def _ascii(text):
+    return unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore').decode()
+
+def split_name(name):
+    """
+    Split a scientific name into canonical name (binomial or trinomial without rank marker) and authorship.
+    """
+
+    words = name.split()
+    if len(words) >= 4 and words[2] in INFRASPECIFIC_MARKERS:
+        return ' '.join([words[0], words[1], words[3]]), ' '.join(words[4:])
+
+    return ' '.join(words[:2]), ' '.join(words[2:])
+
+class BackboneIndex:
+    """
+    In-memory exact canonical-name index and genus-blocked fuzzy index over a backbone store built with build_backbone_index.
+    """
+
+    def __init__(self, db_path):
+        conn = sqlite3.connect(db_path)
+        self.taxa = pd.read_sql("SELECT * FROM taxa", conn)
+        conn.close()
+
+        self.taxa['canonicalName'] = self.taxa['canonicalName'].map(_ascii)
+        self.taxa['genericName'] = self.taxa['genericName'].fillna(self.taxa['canonicalName'].str.split().str[0]).map(_ascii)
+        self.taxa['taxonRank'] = self.taxa['taxonRank'].fillna('').str.upper()
+        self.taxa['scientificNameAuthorship'] = self.taxa['scientificNameAuthorship'].fillna('')
+
+        self.by_canonical = self.taxa.groupby('canonicalName', sort=False).indices
+        self.by_genus = self.taxa.groupby('genericName', sort=False).indices
+        self.genera = list(self.by_genus)
+
+    def _candidate(self, i, confidence):
+        row = self.taxa.iloc[i]
+        return {
+            'usageKey': int(row['taxonID']),
+            'scientificName': row['scientificName'],
+            'canonicalName': row['canonicalName'],
+            'rank': row['taxonRank'],
+            'status': row['taxonomicStatus'],
+            'confidence': int(round(confidence))
+        }
+
+    def _score(self, i, canonical, authorship, exact):
+        row = self.taxa.iloc[i]
+        score = 100.0 if exact else fuzz.ratio(canonical, row['canonicalName']) - 5
+        if authorship and row['scientificNameAuthorship']:
+            score -= (100 - fuzz.token_set_ratio(_ascii(authorship), _ascii(row['scientificNameAuthorship']))) / 10
+        if row['taxonomicStatus'] != 'accepted':
+            score -= 1
+
+        return score
+
+    def match(self, name, max_alternatives=5):
+        """
+        Match one name, returning a response shaped like the GBIF species/match API (rank, confidence, usageKey,
+        scientificName and alternatives), so the same acceptance rules apply.
+        """
+
+        canonical, authorship = split_name(_ascii(name))
+        genus = canonical.split()[0] if canonical else ''
+
+        if canonical in self.by_canonical:
+            exact = True
+            candidates = self.by_canonical[canonical]
+        else:
+            exact = False
+            block = self.by_genus.get(genus)
+            if block is None:
+                ## Misspelled genus: block on the closest genus names instead
+                close = extract(genus, self.genera, scorer=fuzz.ratio, score_cutoff=85, limit=3)
+                if not close:
+                    return {'matchType': 'NONE', 'confidence': 100}
+                block = [i for g, _, _ in close for i in self.by_genus[g]]
+            candidates = [i for i in block if self.taxa['taxonRank'].iat[i] not in {'GENUS', 'FAMILY'}]
+            if not candidates:
+                return self._candidate(block[0], 90) | {'matchType': 'HIGHERRANK'}
+            ## Only the closest canonical names within the block are scored in detail
+            names = self.taxa['canonicalName'].to_numpy()[candidates]
+            closest = extract(canonical, names, scorer=fuzz.ratio, limit=4 * (max_alternatives + 1))
+            candidates = [candidates[pos] for _, _, pos in closest]
+
+        scored = sorted(((self._score(i, canonical, authorship, exact), i) for i in candidates), reverse=True)
+        best = self._candidate(scored[0][1], scored[0][0]) | {'matchType': 'EXACT' if exact else 'FUZZY'}
+        best['alternatives'] = [self._candidate(i, score) for score, i in scored[1:max_alternatives + 1]]
+
+        return best
+
+    def resolve_chains(self, chains):
+        """
+        Offline counterpart of gbif_resolver.resolve_chains.
+
+        Returns:
+            list: (usageKey, scientificName, queried name) for each chain, in input order.
+        """
+
+        matches = {}
+        results = []
+        for chain in chains:
+            result = ('NA', 'NA', chain[0] if chain else 'NA')
+            for name in chain:
+                if name not in matches:
+                    matches[name] = choose_match(self.match(name))
+                if matches[name][0] != 'NA':
+                    result = (matches[name][0], matches[name][1], name)
+                    break
+            results.append(result)
+
+        return results
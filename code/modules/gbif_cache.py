@@ -0,0 +1,74 @@
+## Functions to persist GBIF name resolutions between runs of the endemic species inferences presented in the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import json
+import time
+import sqlite3
+
+
+def open_cache(path):
+    """
+    Open (and create if needed) the SQLite cache of GBIF species/match resolutions, keyed by queried name.
+    """
+
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS matches (
+            name TEXT PRIMARY KEY,
+            response TEXT,
+            usage_key TEXT,
+            scientific_name TEXT,
+            fetched_at REAL
+        )
+    """)
+    conn.commit()
+
+    return conn
+
+def get_cached(conn, names, ttl_days=None):
+    """
+    Look up names in bulk.
+
+    Parameters:
+        conn (Connection): Cache opened with open_cache.
+        names (list): Queried names.
+        ttl_days (float): Entries older than this are treated as misses (None keeps entries forever).
+
+    Returns:
+        dict: Mapping of name to (usageKey, scientificName, raw response) for every fresh hit.
+    """
+
+    min_time = time.time() - ttl_days * 86400 if ttl_days is not None else 0
+    hits = {}
+
+    ## Stay under SQLite's limit on bound parameters per statement
+    names = list(dict.fromkeys(names))
+    for i in range(0, len(names), 900):
+        chunk = names[i:i + 900]
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(
+            f"SELECT name, usage_key, scientific_name, response FROM matches WHERE fetched_at >= ? AND name IN ({placeholders})",
+            [min_time, *chunk]
+        )
+        for name, usage_key, scientific_name, response in rows:
+            key = int(usage_key) if usage_key.isdigit() else usage_key
+            hits[name] = (key, scientific_name, json.loads(response) if response else None)
+
+    return hits
+
+def put_cached(conn, names, results):
+    """
+    Store resolutions for names. Failed requests (no raw response) are not cached so they are retried on the next run.
+    """
+
+    now = time.time()
+    rows = [
+        (name, json.dumps(data), str(key), match_name, now)
+        for name, (key, match_name, data) in zip(names, results)
+        if data is not None
+    ]
+    conn.executemany("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
@@ -0,0 +1,245 @@
+## Functions to submit, follow and retrieve GBIF occurrence downloads for the endemic species inferences presented in the manuscript
+## entitled "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import os
+import json
+import time
+import hashlib
+import logging
+import asyncio
+
+
+FINAL_FAILED = {'KILLED', 'FAILED', 'CANCELLED', 'FILE_ERASED'}
+
+
+def load_jobs(jobs_path):
+    """
+    Read persisted download jobs (query digest -> {'query', 'key', 'status', 'path'}).
+    """
+
+    if os.path.exists(jobs_path):
+        with open(jobs_path) as f:
+            return json.load(f)
+
+    return {}
+
+def save_jobs(jobs_path, jobs):
+    """
+    Persist download jobs atomically, so an interrupted run can resume without resubmitting queries.
+    """
+
+    tmp_path = jobs_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(jobs, f, indent=2)
+    os.replace(tmp_path, jobs_path)
+
+def query_digest(query_path):
+    """
+    SHA-256 of a query's JSON content (key order ignored), identifying its download job whatever the file is named.
+    """
+
+    with open(query_path) as f:
+        query = json.load(f)
+
+    return hashlib.sha256(json.dumps(query, sort_keys=True).encode()).hexdigest()
+
+async def submit_query(session, base_url, query_path, auth):
+    """
+    Submit one download query and return its download key.
+    """
+
+    with open(query_path) as f:
+        query = json.load(f)
+
+    async with session.post(f'{base_url}/occurrence/download/request', json=query, auth=auth) as response:
+        body = await response.text()
+        if response.status not in (200, 201):
+            raise RuntimeError(f'Submission of {query_path} failed with status {response.status}: {body}')
+
+    return body.strip()
+
+async def download_status(session, base_url, key):
+    """
+    Download metadata (status, size, checksum when available) for one download key.
+    """
+
+    async with session.get(f'{base_url}/occurrence/download/{key}') as response:
+        response.raise_for_status()
+        return await response.json(content_type=None)
+
+def md5sum(path, block_size=1 << 20):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            md5.update(block)
+
+    return md5.hexdigest()
+
+async def fetch_archive(session, base_url, key, dest_dir, expected_size=None, checksum=None, block_size=1 << 20, retries=5):
+    """
+    Stream a finished download archive into dest_dir, resuming partial files with HTTP range requests.
+    The archive is verified against the expected size and MD5 checksum (when given) before being moved into place.
+
+    Returns:
+        str: Path of the verified archive.
+    """
+
+    import aiohttp
+
+    final_path = os.path.join(dest_dir, f'{key}.zip')
+    part_path = final_path + '.part'
+
+    if os.path.exists(final_path):
+        return final_path
+
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+        try:
+            async with session.get(f'{base_url}/occurrence/download/request/{key}.zip', headers=headers) as response:
+                if response.status == 416:
+                    ## Nothing left to fetch, the partial file is already complete
+                    pass
+                else:
+                    response.raise_for_status()
+                    ## Servers ignoring the range answer 200 with the full body, start over
+                    mode = 'ab' if response.status == 206 else 'wb'
+                    with open(part_path, mode) as f:
+                        async for block in response.content.iter_chunked(block_size):
+                            f.write(block)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"Download of {key} interrupted (attempt {attempt + 1}): {str(e)}")
+            await asyncio.sleep(2 ** attempt)
+            continue
+
+        size = os.path.getsize(part_path)
+        if expected_size and size < expected_size:
+            logging.warning(f"Download of {key} incomplete ({size}/{expected_size} bytes), resuming")
+            continue
+        if expected_size and size != expected_size:
+            os.remove(part_path)
+            raise RuntimeError(f'Download {key} has {size} bytes, expected {expected_size}')
+        if checksum and md5sum(part_path) != checksum.lower():
+            os.remove(part_path)
+            raise RuntimeError(f'Download {key} failed checksum verification')
+
+        os.replace(part_path, final_path)
+        return final_path
+
+    raise RuntimeError(f'Download {key} could not be completed after {retries + 1} attempts')
+
+async def follow_download(session, base_url, key, dest_dir, poll_interval, deadline):
+    """
+    Poll one download until it succeeds, then fetch its archive.
+
+    Returns:
+        Tuple[str, str]: Final status and archive path (None unless the download succeeded).
+    """
+
+    while True:
+        meta = await download_status(session, base_url, key)
+        status = meta.get('status')
+
+        if status == 'SUCCEEDED':
+            path = await fetch_archive(session, base_url, key, dest_dir,
+                                       expected_size=meta.get('size'), checksum=meta.get('checksum'))
+            return status, path
+        if status in FINAL_FAILED:
+            return status, None
+        if time.monotonic() > deadline:
+            return status, None
+
+        await asyncio.sleep(poll_interval)
+
+async def run_jobs_async(query_files, jobs_path, dest_dir, base_url, auth, poll_interval, timeout, max_connections):
+    import aiohttp
+
+    jobs = load_jobs(jobs_path)
+    deadline = time.monotonic() + timeout
+
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        ## Queries already submitted in an earlier run keep their download key, unless that download failed for good
+        current = {}
+        for query_path in query_files:
+            digest = query_digest(query_path)
+            name = os.path.basename(query_path)
+            if digest not in jobs or jobs[digest]['status'] in FINAL_FAILED:
+                try:
+                    key = await submit_query(session, base_url, query_path, auth)
+                except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+                    logging.warning(f"Could not submit {name}: {str(e)}")
+                    continue
+                jobs[digest] = {'query': name, 'key': key, 'status': 'SUBMITTED', 'path': None}
+                save_jobs(jobs_path, jobs)
+                logging.info(f"Submitted {name}: download key {key}")
+            current[digest] = jobs[digest]
+
+        pending = {digest: job for digest, job in current.items() if job['status'] != 'SUCCEEDED' or not job['path'] or not os.path.exists(job['path'])}
+
+        async def follow(digest, job):
+            ## A download that cannot be polled or fetched is left for a later run, without stopping the others
+            try:
+                status, path = await follow_download(session, base_url, job['key'], dest_dir, poll_interval, deadline)
+            except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+                logging.warning(f"Download {job['key']} ({job['query']}) failed: {str(e)}")
+                status, path = 'ERROR', None
+            jobs[digest].update({'status': status, 'path': path})
+            save_jobs(jobs_path, jobs)
+            logging.info(f"Download {job['key']} ({job['query']}): {status}")
+
+        await asyncio.gather(*(follow(digest, job) for digest, job in pending.items()))
+
+    return current
+
+def wait_for_archives(directory, expected, poll_interval=60, timeout=3600):
+    """
+    Wait until 'expected' .zip archives are present in directory, checking every poll_interval seconds for at most timeout seconds.
+
+    Returns:
+        list: Archive names found (fewer than expected when the timeout was reached).
+    """
+
+    deadline = time.monotonic() + timeout
+
+    while True:
+        zip_files = [file for file in os.listdir(directory) if file.endswith('.zip') and os.path.isfile(os.path.join(directory, file))]
+        if len(zip_files) >= expected or time.monotonic() + poll_interval > deadline:
+            return zip_files
+
+        logging.info(f"{len(zip_files)}/{expected} download archives in {directory}, checking again in {poll_interval} s")
+        time.sleep(poll_interval)
+
+def run_download_jobs(query_files, jobs_path, dest_dir, base_url, username_password, poll_interval=60, timeout=86400, max_connections=4):
+    """
+    Submit download queries (once per query content, again if GBIF reports the download failed), poll every download concurrently and fetch finished archives into dest_dir.
+
+    Parameters:
+        query_files (list): Paths of query JSON files.
+        jobs_path (str): File persisting download keys and statuses between runs.
+        dest_dir (str): Directory receiving the archives.
+        base_url (str): GBIF API base URL (e.g. 'https://api.gbif.org/v1'), or a local stub.
+        username_password (str): GBIF credentials as 'username:password'.
+        poll_interval (float): Seconds between status requests for each download.
+        timeout (float): Seconds after which downloads still running are left for a later run.
+
+    Returns:
+        dict: Jobs of the given queries by query digest, with query file name, download key, final status ('ERROR' when
+        polling or fetching failed) and archive path.
+    """
+
+    ## aiohttp and nest_asyncio are only loaded when downloads are actually run
+    import aiohttp
+    import nest_asyncio
+
+    user, password = username_password.split(':', 1)
+    auth = aiohttp.BasicAuth(user, password)
+
+    nest_asyncio.apply()
+
+    return asyncio.run(run_jobs_async(query_files, jobs_path, dest_dir, base_url, auth, poll_interval, timeout, max_connections))
@@ -0,0 +1,214 @@
+## Functions to resolve species names into GBIF usage keys for the endemic species inferences presented in the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import time
+import random
+import logging
+import asyncio
+from tqdm import tqdm
+
+from modules.gbif_cache import open_cache, get_cached, put_cached
+from modules.instrumentation import count
+
+
+EXCLUDED_RANKS = {'GENUS', 'KINGDOM', 'FAMILY', 'PHYLUM'}
+
+
+def choose_match(data):
+    """
+    Apply the acceptance rules to a GBIF species/match response.
+
+    The best match is accepted when its rank is below genus level and its confidence is >= 80. Otherwise, the first
+    alternative below genus level with confidence >= 75 is accepted.
+
+    Returns:
+        Tuple: (usageKey, scientificName), or ('NA', 'NA') when nothing is accepted.
+    """
+
+    if ('rank' in data
+        and data.get('rank') not in EXCLUDED_RANKS
+        and data.get('confidence', 0) >= 80
+        and 'usageKey' in data):
+        return data['usageKey'], data['scientificName']
+
+    for alt in data.get('alternatives', []):
+        if (alt.get('rank') not in EXCLUDED_RANKS
+            and alt.get('confidence', 0) >= 75
+            and 'usageKey' in alt):
+            return alt['usageKey'], alt.get('scientificName', 'NA')
+
+    return 'NA', 'NA'
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter that halves its rate on 429 responses (honouring 'Retry-After') and recovers it additively
+    after successful requests. 429 responses from the same burst (within one second) only halve the rate once.
+    """
+
+    def __init__(self, rate, capacity=None, min_rate=0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.throttled_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def throttle(self, retry_after=None):
+        now = time.monotonic()
+        if now - self.throttled_at > 1:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.throttled_at = now
+        self.tokens = 0
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def recover(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+async def fetch_match(session, limiter, api_url, name, max_retries=5, backoff=1.0):
+    """
+    Query the GBIF species/match endpoint for one name, retrying with exponential backoff on 429, 5xx and network errors.
+
+    Returns:
+        Tuple: (usageKey, scientificName, raw response or None).
+    """
+
+    import aiohttp
+
+    params = {'name': name, 'verbose': 'true'}
+
+    for attempt in range(max_retries + 1):
+        await limiter.acquire()
+        try:
+            async with session.get(api_url, params=params) as response:
+                if response.status == 200:
+                    try:
+                        data = await response.json(content_type=None)
+                    except ValueError:
+                        logging.warning(f"Error for {name}: response is not valid JSON")
+                        return 'NA', 'NA', None
+                    limiter.recover()
+                    key, match_name = choose_match(data)
+                    return key, match_name, data
+                elif response.status == 429:
+                    limiter.throttle(_retry_after(response))
+                elif response.status < 500:
+                    logging.warning(f"Error for {name}: Status code {response.status}")
+                    return 'NA', 'NA', None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.debug(f"Exception for {name} (attempt {attempt + 1}): {str(e)}")
+
+        if attempt < max_retries:
+            await asyncio.sleep(backoff * 2 ** attempt * (0.5 + random.random()))
+
+    logging.warning(f"Giving up on {name} after {max_retries + 1} attempts")
+
+    return 'NA', 'NA', None
+
+async def resolve_chains_async(chains, api_url, hits, max_in_flight=20, rate=10, max_retries=5, backoff=1.0, timeout=60):
+    """
+    Resolve fallback chains of names through a single pooled session and one concurrent work queue.
+
+    Each chain is tried name by name, stopping at the first accepted match, so fallback names are only queried when
+    needed and never wait for other chains. Names already in hits are answered without a request.
+
+    Returns:
+        Tuple[list, dict]: (usageKey, scientificName, queried name) for each chain in input order, and new raw
+        resolutions by queried name.
+    """
+
+    import aiohttp
+
+    results = [None] * len(chains)
+    fetched = {}
+    limiter = TokenBucket(rate)
+    window = asyncio.Semaphore(max_in_flight)
+
+    connector = aiohttp.TCPConnector(limit=max_in_flight)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+
+        async def fetch(name):
+            async with window:
+                return await fetch_match(session, limiter, api_url, name, max_retries, backoff)
+
+        async def worker(i, chain):
+            results[i] = ('NA', 'NA', chain[0] if chain else 'NA')
+            for name in chain:
+                if name in hits:
+                    result = hits[name]
+                else:
+                    ## Names shared between chains are requested once
+                    if name not in fetched:
+                        fetched[name] = asyncio.ensure_future(fetch(name))
+                    result = await fetched[name]
+                if result[0] != 'NA':
+                    results[i] = (result[0], result[1], name)
+                    return
+
+        tasks = [asyncio.ensure_future(worker(i, chain)) for i, chain in enumerate(chains)]
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Resolving GBIF keys"):
+            await task
+
+    return results, {name: task.result() for name, task in fetched.items()}
+
+def resolve_chains(chains, api_url, cache_path=None, ttl_days=None, **kwargs):
+    """
+    Resolve fallback chains of names (e.g. harmonised name followed by original names), answering from the on-disk cache
+    first and sending only misses (or expired entries) to the network. Keyword arguments are passed to resolve_chains_async.
+
+    Returns:
+        list: (usageKey, scientificName, queried name) for each chain, in input order.
+    """
+
+    ## aiohttp and nest_asyncio are only loaded when names are actually resolved
+    import nest_asyncio
+
+    chains = [list(dict.fromkeys(chain)) for chain in chains]
+    conn = open_cache(cache_path) if cache_path else None
+
+    try:
+        hits = get_cached(conn, [name for chain in chains for name in chain], ttl_days) if conn else {}
+
+        logging.info(f"GBIF cache hits: {len(hits)} names")
+        count('gbif_cache_hits', len(hits))
+
+        nest_asyncio.apply()
+        results, fetched = asyncio.run(resolve_chains_async(chains, api_url, hits, **kwargs))
+
+        logging.info(f"Names sent to the API: {len(fetched)}")
+        count('gbif_api_names', len(fetched))
+
+        if conn:
+            put_cached(conn, list(fetched), list(fetched.values()))
+    finally:
+        if conn:
+            conn.close()
+
+    return results
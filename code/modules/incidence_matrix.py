@@ -0,0 +1,120 @@
+## Functions to build sparse species x region incidence matrices used in the spatial analyses presented in the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def as_categorical(values):
+    """
+    Categorical of the labels present in a column, with sorted categories. Categorical columns are reused through their
+    codes instead of being converted to text.
+    """
+
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categorical = values.cat.remove_unused_categories().array
+        if not categorical.categories.is_monotonic_increasing:
+            categorical = categorical.reorder_categories(categorical.categories.sort_values())
+        return categorical
+
+    return pd.Categorical(values.astype(str))
+
+def build_incidence_matrix(occurrences, region_col, taxon_col='current_name'):
+    """
+    Build a binary region x species incidence matrix from category codes.
+
+    Parameters:
+        occurrences (DataFrame): Occurrence records with region and taxon columns (e.g. biome 'name', 'Provincias', 'NM_MUN').
+        region_col (str): Column holding the region label of each record.
+        taxon_col (str): Column holding the harmonised species name of each record.
+
+    Returns:
+        Tuple[csr_matrix, ndarray, ndarray]: Incidence matrix (regions as rows, species as columns), region labels and species labels.
+    """
+
+    subset = occurrences[[region_col, taxon_col]].dropna()
+    subset = subset[(subset[region_col] != '') & (subset[taxon_col] != '')]
+
+    regions = as_categorical(subset[region_col])
+    taxa = as_categorical(subset[taxon_col])
+
+    rows = regions.codes.astype(np.int32)
+    cols = taxa.codes.astype(np.int32)
+    shape = (len(regions.categories), len(taxa.categories))
+
+    ## Duplicated (region, species) pairs are summed by the COO -> CSR conversion, then clipped to presence/absence
+    matrix = sparse.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=shape).tocsr()
+    matrix.data = np.ones_like(matrix.data)
+
+    region_labels = np.asarray(regions.categories, dtype=str)
+    taxon_labels = np.asarray(taxa.categories, dtype=str)
+
+    return matrix, region_labels, taxon_labels
+
+def save_incidence_matrix(path, matrix, region_labels, taxon_labels):
+    """
+    Save an incidence matrix and its label arrays into a single .npz file.
+    """
+
+    matrix = matrix.tocsr()
+    np.savez_compressed(
+        path,
+        data=matrix.data,
+        indices=matrix.indices,
+        indptr=matrix.indptr,
+        shape=np.asarray(matrix.shape),
+        region_labels=np.asarray(region_labels, dtype=str),
+        taxon_labels=np.asarray(taxon_labels, dtype=str)
+    )
+
+def load_incidence_matrix(path):
+    """
+    Load an incidence matrix and its label arrays saved with save_incidence_matrix.
+
+    Returns:
+        Tuple[csr_matrix, ndarray, ndarray]: Incidence matrix, region labels and species labels.
+    """
+
+    with np.load(path) as npz:
+        matrix = sparse.csr_matrix((npz['data'], npz['indices'], npz['indptr']), shape=tuple(npz['shape']))
+        region_labels = npz['region_labels']
+        taxon_labels = npz['taxon_labels']
+
+    return matrix, region_labels, taxon_labels
+
+def region_richness(matrix, region_labels):
+    """
+    Number of species recorded in each region.
+    """
+
+    richness = np.asarray(matrix.sum(axis=1)).ravel()
+
+    return pd.Series(richness, index=region_labels, name='sppNumber')
+
+def shared_species(matrix, region_labels):
+    """
+    Number of species shared between every pair of regions (diagonal holds each region's richness).
+    """
+
+    matrix = matrix.astype(np.int32)
+    shared = (matrix @ matrix.T).toarray()
+
+    return pd.DataFrame(shared, index=region_labels, columns=region_labels)
+
+def turnover(matrix, region_labels):
+    """
+    Pairwise Sørensen dissimilarity (beta_sor = 1 - 2a / (2a + b + c)) between regions.
+    """
+
+    shared = shared_species(matrix, region_labels).to_numpy().astype(float)
+    richness = np.diag(shared)
+    total = richness[:, None] + richness[None, :]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = np.where(total > 0, 1 - (2 * shared) / total, 0.0)
+
+    return pd.DataFrame(beta, index=region_labels, columns=region_labels)
@@ -0,0 +1,188 @@
+## Stage timing, memory and cache statistics collected into a JSON run manifest for the analyses presented in the manuscript
+## entitled "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import cProfile
+import resource
+import threading
+import tracemalloc
+import contextlib
+
+
+## Stage currently being measured, so counters can be recorded from anywhere in the pipeline
+_current = []
+
+
+def count(name, value=1):
+    """
+    Add to a counter of the stage currently measured (e.g. count('gbif_cache_hits', 120)). No-op outside a measured stage.
+    """
+
+    if _current:
+        counters = _current[-1].setdefault('counters', {})
+        counters[name] = counters.get(name, 0) + value
+
+def rows(value):
+    """
+    Number of rows of a DataFrame-like value, or None for anything without a length.
+    """
+
+    if hasattr(value, 'shape') and len(getattr(value, 'shape', ())) > 0:
+        return int(value.shape[0])
+    if isinstance(value, (list, tuple, dict, set)):
+        return len(value)
+
+    return None
+
+def current_rss():
+    """
+    Resident set size of this process in bytes (None where /proc is not available).
+    """
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def max_rss():
+    """
+    Peak resident set size of this process since it started, in bytes.
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    ## ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class RssSampler(threading.Thread):
+    """
+    Background thread keeping the highest RSS seen while a stage (or a streaming chunk) runs; reset by assigning peak.
+    """
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss() or 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss() or 0)
+
+class RunManifest:
+    """
+    Collect per-stage wall time, CPU time (including worker processes), peak RSS, rows in/out, cache hits and counters,
+    and write them as one JSON file per run.
+
+    Parameters:
+        script (str): Name of the entry point (e.g. 'run2_spatial_analysis').
+        manifest_dir (str): Directory receiving manifests and profiles.
+        config_values (dict): Settings recorded in the manifest (credentials are left out).
+        profile_stage (str): Name of one stage to run under cProfile (dumped as .prof next to the manifest).
+        trace_memory (bool): Also record Python allocation peaks per stage with tracemalloc (slows the run down).
+        sample_interval (float): Seconds between RSS samples.
+    """
+
+    def __init__(self, script, manifest_dir, config_values=None, profile_stage=None, trace_memory=False, sample_interval=0.2):
+        self.script = script
+        self.manifest_dir = manifest_dir
+        self.profile_stage = profile_stage
+        self.trace_memory = trace_memory
+        self.sample_interval = sample_interval
+        self.started = time.strftime('%Y%m%dT%H%M%S')
+        self.path = os.path.join(manifest_dir, f'{script}_{self.started}.json')
+        self.manifest = {
+            'script': script,
+            'started': self.started,
+            'host': socket.gethostname(),
+            'python': sys.version.split()[0],
+            'config': {key: value for key, value in (config_values or {}).items() if 'password' not in key},
+            'stages': []
+        }
+
+        os.makedirs(manifest_dir, exist_ok=True)
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Measure one stage. The yielded dict can be completed inside the block (e.g. record['rows_out'] = len(df)).
+        """
+
+        record = {'stage': name, 'cached': False, 'rows_in': rows_in}
+        sampler = RssSampler(self.sample_interval)
+        profiler = cProfile.Profile() if name == self.profile_stage else None
+
+        if self.trace_memory:
+            tracemalloc.start()
+        sampler.start()
+        peak_before = max_rss()
+        cpu_self, cpu_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+        wall = time.perf_counter()
+        _current.append(record)
+        if profiler:
+            profiler.enable()
+
+        try:
+            yield record
+            record['status'] = 'ok'
+        except BaseException as e:
+            record['status'] = f'failed: {type(e).__name__}'
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+                profile_path = os.path.join(self.manifest_dir, f'{self.script}_{self.started}_{name}.prof')
+                profiler.dump_stats(profile_path)
+                record['profile'] = profile_path
+
+            _current.pop()
+            record['wall_s'] = round(time.perf_counter() - wall, 3)
+            end_self, end_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+            record['cpu_s'] = round((end_self.ru_utime + end_self.ru_stime) - (cpu_self.ru_utime + cpu_self.ru_stime), 3)
+            record['cpu_children_s'] = round((end_children.ru_utime + end_children.ru_stime) - (cpu_children.ru_utime + cpu_children.ru_stime), 3)
+
+            sampler.stopped.set()
+            sampler.join()
+            ## A new process-wide peak reached during the stage belongs to it, even when it fell between two samples
+            peak = max(sampler.peak, current_rss() or 0)
+            if max_rss() > peak_before:
+                peak = max(peak, max_rss())
+            record['peak_rss_mb'] = round(peak / 2**20, 1)
+            if self.trace_memory:
+                record['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+                tracemalloc.stop()
+
+            self.manifest['stages'].append(record)
+            logging.info(f"Stage {name}: {record['wall_s']} s wall, {record['cpu_s']} s CPU, peak RSS {record['peak_rss_mb']} MB")
+            self.write()
+
+    def skipped(self, name):
+        """
+        Record a stage answered from the pipeline cache.
+        """
+
+        self.manifest['stages'].append({'stage': name, 'cached': True, 'status': 'ok', 'wall_s': 0.0})
+        self.write()
+
+    def write(self):
+        stages = self.manifest['stages']
+        self.manifest['summary'] = {
+            'stages': len(stages),
+            'stage_cache_hit_rate': round(sum(s['cached'] for s in stages) / len(stages), 3) if stages else None,
+            'wall_s': round(sum(s.get('wall_s', 0) for s in stages), 3),
+            'max_rss_mb': round(max_rss() / 2**20, 1)
+        }
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2, default=str)
+        os.replace(tmp_path, self.path)
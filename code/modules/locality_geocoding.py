@@ -0,0 +1,172 @@
+## Functions to geocode free-text collection localities against a local gazetteer for the spatial analysis presented in the
+## results of the manuscript entitled "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import os
+import re
+import hashlib
+import unicodedata
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from rapidfuzz import fuzz
+from rapidfuzz.process import extractOne
+
+from modules.instrumentation import count
+from modules.scenarios import shared
+
+
+@shared
+def load_gazetteer(path):
+    """
+    Read the gazetteer CSV ('name', 'decimalLatitude' and 'decimalLongitude' columns).
+    """
+
+    return pd.read_csv(path)
+
+def normalise_locality(text):
+    """
+    Lowercase, strip accents and punctuation from a locality string.
+    """
+
+    if not isinstance(text, str):
+        return ''
+
+    text = unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore').decode().lower()
+    text = re.sub(r'[^a-z0-9 ]+', ' ', text)
+
+    return ' '.join(text.split())
+
+def ngrams(text, n=3):
+    """
+    Set of character n-grams of a normalised string (padded with spaces so short words still produce n-grams).
+    """
+
+    text = f' {text} '
+
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+def build_ngram_index(gazetteer, n=3):
+    """
+    Build an inverted index from character n-grams to gazetteer entries.
+
+    Parameters:
+        gazetteer (DataFrame): Gazetteer with 'name', 'decimalLatitude' and 'decimalLongitude' columns.
+        n (int): n-gram size.
+
+    Returns:
+        Tuple[list, dict]: Normalised gazetteer names and mapping of n-gram to array of gazetteer row positions.
+    """
+
+    names = [normalise_locality(name) for name in gazetteer['name']]
+
+    postings = defaultdict(list)
+    for i, name in enumerate(names):
+        for gram in ngrams(name, n):
+            postings[gram].append(i)
+
+    index = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    return names, index
+
+def match_locality(query, names, index, n=3, max_candidates=50, score_threshold=90):
+    """
+    Find the gazetteer entry best matching a normalised locality string.
+
+    Candidates are the entries sharing most n-grams with the query; they are then scored with RapidFuzz token set ratio,
+    so a gazetteer name contained in a longer locality description ('parque estadual da serra do mar cunha') still matches.
+
+    Returns:
+        Tuple[int, float]: Gazetteer row position and score, or (-1, 0.0) when no candidate reaches score_threshold.
+    """
+
+    posting_lists = [index[gram] for gram in ngrams(query, n) if gram in index]
+    if not posting_lists:
+        return -1, 0.0
+
+    shared = np.bincount(np.concatenate(posting_lists), minlength=len(names))
+    n_candidates = min(max_candidates, np.count_nonzero(shared))
+    candidates = np.argpartition(-shared, n_candidates - 1)[:n_candidates]
+
+    ## Prefer longer (more specific) gazetteer names among equally scored candidates
+    candidates = sorted(candidates, key=lambda i: -len(names[i]))
+    match = extractOne(query, [names[i] for i in candidates], scorer=fuzz.token_set_ratio, score_cutoff=score_threshold)
+    if match is None:
+        return -1, 0.0
+
+    return int(candidates[match[2]]), float(match[1])
+
+def gazetteer_stamp(gazetteer, n=3, max_candidates=50, score_threshold=90):
+    """
+    Digest of the gazetteer entries and of the matching settings, identifying the results stored in a geocoding cache.
+    """
+
+    md5 = hashlib.md5(pd.util.hash_pandas_object(gazetteer[['name', 'decimalLatitude', 'decimalLongitude']], index=False).to_numpy().tobytes())
+    md5.update(f'{n}|{max_candidates}|{score_threshold}'.encode())
+
+    return md5.hexdigest()
+
+def geocode_localities(localities, gazetteer, cache_path=None, n=3, max_candidates=50, score_threshold=90):
+    """
+    Geocode locality strings against a gazetteer, processing each distinct string once.
+
+    Parameters:
+        localities (Series): Locality strings of each record.
+        gazetteer (DataFrame): Gazetteer with 'name', 'decimalLatitude' and 'decimalLongitude' columns.
+        cache_path (str): Optional CSV caching results per normalised string across runs. Matches and misses are stored
+            with the gazetteer_stamp they were computed under; the whole cache is discarded when the gazetteer or the
+            matching settings change.
+
+    Returns:
+        DataFrame: 'gazetteerName', 'geocodeScore', 'decimalLatitude' and 'decimalLongitude' for each record (NaN when unmatched),
+        aligned on the index of localities.
+    """
+
+    normalised = localities.map(normalise_locality)
+    unique_strings = pd.Series(normalised.unique())
+    unique_strings = unique_strings[unique_strings != '']
+
+    stamp = gazetteer_stamp(gazetteer, n, max_candidates, score_threshold)
+
+    cache = None
+    if cache_path and os.path.exists(cache_path):
+        cache = pd.read_csv(cache_path, keep_default_na=False, na_values=[''])
+        if 'source' not in cache.columns or (cache['source'] != stamp).any():
+            count('geocode_cache_discarded')
+            cache = None
+        else:
+            cache = cache.drop(columns='source').drop_duplicates(subset='locality').set_index('locality')
+    if cache is None:
+        cache = pd.DataFrame(columns=['gazetteerName', 'geocodeScore', 'decimalLatitude', 'decimalLongitude'])
+        cache.index.name = 'locality'
+
+    pending = unique_strings[~unique_strings.isin(cache.index)].tolist()
+    count('geocode_cache_hits', len(unique_strings) - len(pending))
+    count('geocode_new_localities', len(pending))
+
+    if pending:
+        names, index = build_ngram_index(gazetteer, n)
+        lat = gazetteer['decimalLatitude'].to_numpy()
+        lon = gazetteer['decimalLongitude'].to_numpy()
+
+        rows = []
+        for query in pending:
+            pos, score = match_locality(query, names, index, n, max_candidates, score_threshold)
+            if pos >= 0:
+                rows.append((query, gazetteer['name'].iloc[pos], score, lat[pos], lon[pos]))
+            else:
+                rows.append((query, np.nan, np.nan, np.nan, np.nan))
+
+        new = pd.DataFrame(rows, columns=['locality', 'gazetteerName', 'geocodeScore', 'decimalLatitude', 'decimalLongitude'])
+        new = new.set_index('locality')
+        cache = new if cache.empty else pd.concat([cache, new])
+
+        if cache_path:
+            cache.assign(source=stamp).to_csv(cache_path)
+
+    geocoded = cache.reindex(normalised.to_numpy())
+    geocoded.index = localities.index
+
+    return geocoded
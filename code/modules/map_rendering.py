@@ -0,0 +1,143 @@
+## Functions to render the draft maps presented in the results of the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import os
+import math
+import numpy as np
+import geopandas as gpd
+
+from shapely.geometry import Point
+
+
+_simplified_layers = {}
+
+
+def bin_points(x, y, extent, cell_size):
+    """
+    Bin point coordinates into a regular 2D grid.
+
+    Parameters:
+        x, y (array-like): Point longitudes and latitudes.
+        extent (tuple): Map extent as (xmin, xmax, ymin, ymax).
+        cell_size (float): Grid cell size in degrees.
+
+    Returns:
+        ndarray: Record counts per cell, with rows running from south to north.
+    """
+
+    xmin, xmax, ymin, ymax = extent
+    nx = math.ceil((xmax - xmin) / cell_size)
+    ny = math.ceil((ymax - ymin) / cell_size)
+
+    counts, _, _ = np.histogram2d(
+        np.asarray(y, dtype=float), np.asarray(x, dtype=float),
+        bins=[ny, nx], range=[[ymin, ymin + ny * cell_size], [xmin, xmin + nx * cell_size]]
+    )
+
+    return counts.astype(np.int64)
+
+def save_point_grid(path, counts, extent, cell_size):
+    """
+    Save a binned point grid so maps can be redrawn without the occurrence records.
+    """
+
+    np.savez_compressed(path, counts=counts, extent=np.asarray(extent, dtype=float), cell_size=cell_size)
+
+def load_point_grid(path):
+    """
+    Load a binned point grid saved with save_point_grid.
+
+    Returns:
+        Tuple[ndarray, tuple, float]: Counts, extent and cell size.
+    """
+
+    with np.load(path) as npz:
+        counts = npz['counts']
+        extent = tuple(npz['extent'])
+        cell_size = float(npz['cell_size'])
+
+    return counts, extent, cell_size
+
+def simplified_layer(path, tolerance, cache_dir):
+    """
+    Read a polygon layer with topology-preserving simplified geometries.
+    Simplified layers are cached in memory and as GeoPackages in cache_dir, keyed by layer file name and tolerance.
+    The GeoPackage is written under a temporary name and moved into place, so concurrent runs never read a partial file.
+    """
+
+    key = (os.path.abspath(path), tolerance)
+    if key in _simplified_layers:
+        return _simplified_layers[key]
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(cache_dir, f'{stem}_simplified_{tolerance}.gpkg')
+
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        layer = gpd.read_file(cache_path)
+    else:
+        layer = gpd.read_file(path)
+        layer = layer.to_crs('epsg:4326')
+        layer['geometry'] = layer.geometry.simplify(tolerance, preserve_topology=True)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = os.path.join(cache_dir, f'{stem}_simplified_{tolerance}.{os.getpid()}.tmp.gpkg')
+        layer.to_file(tmp_path, driver='GPKG')
+        os.replace(tmp_path, cache_path)
+
+    _simplified_layers[key] = layer
+
+    return layer
+
+def render_richness_map(regions, region_field, richness, out_path, extent, grid=None, points=None):
+    """
+    Draw the species richness choropleth with occurrences overlaid and save it to out_path.
+
+    Occurrences are drawn either from a binned grid (grid, as returned by load_point_grid, drawn as one image layer)
+    or as individual points (points, GeoSeries).
+    """
+
+    ## Plotting libraries are only loaded by the runs that draw maps
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as mticker
+    from matplotlib.colors import ListedColormap
+    from matplotlib_scalebar.scalebar import ScaleBar
+
+    regions = regions.copy()
+    regions['sppNumber'] = regions[region_field].map(richness).fillna(0)
+
+    ## Scale bar reference distance
+    scale_points = gpd.GeoSeries([Point(-60,-20), Point(-61,-20)], crs=4326)
+    scale_points = scale_points.to_crs(32619)
+    distance_meters = scale_points[0].distance(scale_points[1])
+
+    xmin, xmax, ymin, ymax = extent
+    vmin, vmax = 0, math.ceil(max(regions['sppNumber']/100))*100
+    fig, ax = plt.subplots(1, figsize=(30,10))
+    ax.add_artist(ScaleBar(distance_meters, units='km', location='lower right', length_fraction=0.1))
+    ax.set_xticks([])
+    ax.set_yticks([])
+
+    sm = plt.cm.ScalarMappable(cmap='Blues',
+                            norm=plt.Normalize(vmin=vmin, vmax=vmax))
+    sm.set_array([])
+    fig.colorbar(sm, shrink=0.2, pad=0.0005, ticks=mticker.MultipleLocator(1500), ax=ax)
+    regions.plot(column='sppNumber', cmap='Blues', linewidth=0.8, ax=ax)
+
+    if grid is not None:
+        counts, grid_extent, cell_size = grid
+        ny, nx = counts.shape
+        gxmin, gymin = grid_extent[0], grid_extent[2]
+        occupied = np.ma.masked_equal(counts, 0)
+        ax.imshow(occupied, extent=(gxmin, gxmin + nx * cell_size, gymin, gymin + ny * cell_size),
+                  origin='lower', cmap=ListedColormap(['#ebcc34']), alpha=0.8, interpolation='nearest', zorder=2)
+    elif points is not None:
+        points.plot(ax=ax, markersize=0.1, color='#ebcc34', alpha=0.8)
+
+    ## imshow autoscales the axes to the grid, restore the map extent
+    ax.set_xlim([xmin, xmax])
+    ax.set_ylim([ymin, ymax])
+
+    plt.savefig(out_path, dpi=300, bbox_inches='tight')
+    plt.close(fig)
@@ -0,0 +1,291 @@
+## Species x region x year occurrence cube for the summaries of the spatial analyses presented in the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+
+
+## Axes accepted by OccurrenceCube.summary and OccurrenceCube.new_species
+DIMENSIONS = ['species', 'genus', 'region', 'year', 'decade']
+
+CELL_DTYPES = {'taxon': np.int32, 'region': np.int32, 'year': np.int16, 'records': np.int64}
+
+## Per-record coordinates kept with the cube (hashed gbifID, species and year codes, plus one region code per layer)
+RECORD_DTYPES = {'id': np.uint64, 'taxon': np.int32, 'year': np.int16}
+
+
+def _empty_cells():
+    return pd.DataFrame({column: np.empty(0, dtype=dtype) for column, dtype in CELL_DTYPES.items()})
+
+def _empty_records(layers=()):
+    return pd.DataFrame({column: np.empty(0, dtype=dtype) for column, dtype in RECORD_DTYPES.items()}
+                        | {layer: np.empty(0, dtype=np.int32) for layer in layers})
+
+def labels_digest(region_labels):
+    """
+    Digest of the region labels of every layer, identifying the region coding a cube was built with.
+    """
+
+    return hashlib.md5(json.dumps({layer: list(map(str, labels)) for layer, labels in region_labels.items()}, sort_keys=True).encode()).hexdigest()
+
+class OccurrenceCube:
+    """
+    Record counts per species x region x year for every reference layer, stored as integer-coded cells (one row per
+    distinct species, region and year) with label tables for species and regions.
+
+    The species, year and region codes of every merged record are kept by hashed gbifID, so the cube is updated
+    incrementally: new records are added, records whose name, year or regions changed are moved to their new cells, and
+    (when the full set of records is given) records that disappeared are subtracted. The cube is only rebuilt from
+    scratch when the region labels change (see labels_digest, stored as 'source').
+
+    Records without a year are kept with year -1; records outside every region of a layer are not counted in that layer.
+
+    Example:
+        cube = OccurrenceCube.load(occurrence_cube_strict)
+        cube.summary('province', by=['region', 'decade'])
+        cube.new_species('biome', by=['year'], regions=['Cerrado'])
+    """
+
+    def __init__(self, taxa=None, regions=None, cells=None, records=None, source=''):
+        self.source = source
+        self.taxa = pd.Index(taxa if taxa is not None else [], dtype=object)
+        self.regions = regions or {}
+        self.cells = cells or {}
+        self.records = records if records is not None else _empty_records(self.cells)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+
+        with np.load(path, allow_pickle=False) as npz:
+            if 'record_id' not in npz.files:
+                logging.info(f"Occurrence cube {path} has no per-record codes, rebuilding it")
+                return cls()
+
+            layers = npz['layers'].tolist()
+            regions = {layer: pd.Index(npz[f'{layer}_labels'].astype(object)) for layer in layers}
+            cells = {layer: pd.DataFrame({column: npz[f'{layer}_{column}'].astype(dtype) for column, dtype in CELL_DTYPES.items()})
+                     for layer in layers}
+            records = pd.DataFrame({column: npz[f'record_{column}'].astype(dtype) for column, dtype in RECORD_DTYPES.items()}
+                                   | {layer: npz[f'{layer}_record_region'].astype(np.int32) for layer in layers})
+
+            return cls(npz['taxa'].astype(object), regions, cells, records, str(npz['source']))
+
+    def save(self, path):
+        arrays = {'taxa': np.asarray(self.taxa, dtype=str), 'layers': np.asarray(list(self.cells), dtype=str), 'source': np.asarray(self.source)}
+        for column in RECORD_DTYPES:
+            arrays[f'record_{column}'] = self.records[column].to_numpy()
+        for layer, cells in self.cells.items():
+            arrays[f'{layer}_labels'] = np.asarray(self.regions[layer], dtype=str)
+            arrays[f'{layer}_record_region'] = self.records[layer].to_numpy()
+            for column in CELL_DTYPES:
+                arrays[f'{layer}_{column}'] = cells[column].to_numpy()
+
+        np.savez_compressed(path, **arrays)
+
+    def _record_codes(self, records, region_labels):
+        """
+        Cube codes of labelled records (first record of each gbifID), extending the species and region label tables.
+        """
+
+        ids = pd.util.hash_array(records['gbifID'].astype(str).to_numpy(dtype=object))
+        records = records[~pd.Series(ids).duplicated().to_numpy()]
+        ids = ids[~pd.Series(ids).duplicated().to_numpy()]
+
+        new_taxa = pd.Index(np.asarray(records['current_name'].unique(), dtype=object)).difference(self.taxa)
+        self.taxa = self.taxa.append(new_taxa)
+
+        codes = pd.DataFrame({
+            'id': ids,
+            'taxon': self.taxa.get_indexer(records['current_name']).astype(np.int32),
+            'year': pd.to_numeric(records['year'], errors='coerce').fillna(-1).to_numpy().astype(np.int16)
+        })
+
+        for layer, labels in region_labels.items():
+            labels = pd.Index(labels, dtype=object)
+            cube_labels = self.regions.get(layer, pd.Index([], dtype=object))
+            self.regions[layer] = cube_labels = cube_labels.append(labels.difference(cube_labels))
+
+            ## Region codes of the records translated to the cube's own (append-only) codes
+            layer_codes = records[f'{layer}_code'].to_numpy()
+            assigned = layer_codes >= 0
+            region = np.full(len(records), -1, dtype=np.int32)
+            region[assigned] = cube_labels.get_indexer(labels)[layer_codes[assigned]]
+            codes[layer] = region
+
+        return codes
+
+    def update(self, records, region_labels, complete=False):
+        """
+        Bring the cube up to date with labelled occurrence records.
+
+        Parameters:
+            records (DataFrame): Records with 'gbifID', 'current_name', 'year' and '<layer>_code' columns (see label_regions).
+            region_labels (dict): Mapping of layer name to region labels (code -> label) of the records.
+            complete (bool): True when records are all the records of the dataset (e.g. combinedDataMatrix), so merged
+                records missing from them are subtracted; False for a chunk of further records.
+
+        Returns:
+            int: Number of records added, changed or removed.
+        """
+
+        source = labels_digest(region_labels)
+        if source != self.source:
+            if self.source:
+                logging.info("Region labels changed, rebuilding the occurrence cube")
+            self.__init__(source=source)
+            self.records = _empty_records(region_labels)
+
+        new = self._record_codes(records[records['current_name'].notna()], region_labels)
+        old = self.records
+        layers = list(region_labels)
+
+        ## Records already merged with the same codes are left alone; changed ones are moved to their new cells
+        pos = pd.Index(old['id']).get_indexer(new['id'])
+        known = pos >= 0
+        same = known.copy()
+        for column in ['taxon', 'year'] + layers:
+            same[known] &= old[column].to_numpy()[pos[known]] == new[column].to_numpy()[known]
+
+        outdated = pos[known & ~same]
+        removed = np.flatnonzero(~np.isin(old['id'].to_numpy(), new['id'].to_numpy())) if complete else np.empty(0, dtype=np.int64)
+        added = new[~same]
+        dropped = old.iloc[np.concatenate([outdated, removed])]
+
+        if len(added) == 0 and len(dropped) == 0:
+            return 0
+
+        for layer in layers:
+            delta = pd.concat([added[added[layer] >= 0].groupby(['taxon', layer, 'year']).size(),
+                               -dropped[dropped[layer] >= 0].groupby(['taxon', layer, 'year']).size()])
+            delta = delta.rename('records').rename_axis(['taxon', 'region', 'year']).reset_index()
+
+            cells = pd.concat([self.cells.get(layer, _empty_cells()), delta], ignore_index=True)
+            cells = cells.groupby(['taxon', 'region', 'year'], as_index=False)['records'].sum()
+            self.cells[layer] = cells[cells['records'] != 0].reset_index(drop=True).astype(CELL_DTYPES)
+
+        self.records = pd.concat([old.drop(index=dropped.index), added], ignore_index=True)
+
+        return int((~known).sum() + len(outdated) + len(removed))
+
+    def genera(self):
+        """
+        Genus code of every species code, and genus labels.
+        """
+
+        return pd.factorize(self.taxa.str.split().str[0])
+
+    def select(self, layer, regions=None, taxa=None, genera=None, years=None):
+        """
+        Cells of a layer, optionally restricted to some regions, species, genera and an inclusive (first, last) year range.
+        """
+
+        cells = self.cells.get(layer, _empty_cells())
+        keep = np.ones(len(cells), dtype=bool)
+
+        if regions is not None:
+            keep &= np.isin(cells['region'].to_numpy(), self.regions[layer].get_indexer(list(regions)))
+        if taxa is not None:
+            keep &= np.isin(cells['taxon'].to_numpy(), self.taxa.get_indexer(list(taxa)))
+        if genera is not None:
+            genus_codes, genus_labels = self.genera()
+            keep &= np.isin(genus_codes[cells['taxon'].to_numpy()], genus_labels.get_indexer(list(genera)))
+        if years is not None:
+            first, last = years
+            keep &= (cells['year'].to_numpy() >= first) & (cells['year'].to_numpy() <= last)
+
+        return cells[keep]
+
+    def _keys(self, layer, cells, by):
+        """
+        Columns to group cells by for the requested dimensions, and how to decode each of them.
+        """
+
+        unknown = [dim for dim in by if dim not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Unknown dimensions {unknown}, expected some of {DIMENSIONS}")
+
+        keys = pd.DataFrame(index=cells.index)
+        labels = {}
+        for dim in by:
+            if dim == 'species':
+                keys[dim], labels[dim] = cells['taxon'].to_numpy(), self.taxa
+            elif dim == 'genus':
+                genus_codes, labels[dim] = self.genera()
+                keys[dim] = genus_codes[cells['taxon'].to_numpy()]
+            elif dim == 'region':
+                keys[dim], labels[dim] = cells['region'].to_numpy(), self.regions[layer]
+            elif dim == 'year':
+                keys[dim] = cells['year'].to_numpy()
+            else:
+                year = cells['year'].to_numpy()
+                keys[dim] = np.where(year >= 0, year // 10 * 10, -1)
+
+        return keys, labels
+
+    @staticmethod
+    def _decode(table, labels):
+        for dim, dim_labels in labels.items():
+            table[dim] = np.asarray(dim_labels, dtype=object)[table[dim].to_numpy()]
+
+        return table
+
+    def summary(self, layer, by=('region',), **filters):
+        """
+        Roll the cells of a layer up to the given dimensions (any of DIMENSIONS; none for overall totals).
+
+        Returns:
+            DataFrame: Number of records, species and genera, and first and last year seen, per group (decoded labels).
+        """
+
+        cells = self.select(layer, **filters)
+        keys, labels = self._keys(layer, cells, list(by))
+        genus_codes, _ = self.genera()
+
+        frame = pd.concat([keys, pd.DataFrame({
+            'records': cells['records'].to_numpy(),
+            'taxon': cells['taxon'].to_numpy(),
+            'genus_code': genus_codes[cells['taxon'].to_numpy()],
+            'known_year': np.where(cells['year'].to_numpy() >= 0, cells['year'].to_numpy(), np.nan)
+        }, index=cells.index)], axis=1)
+
+        grouped = frame.groupby(list(by), sort=True) if by else frame.groupby(np.zeros(len(frame), dtype=np.int8))
+        table = grouped.agg(records=('records', 'sum'), nSpecies=('taxon', 'nunique'), nGenera=('genus_code', 'nunique'),
+                            firstYear=('known_year', 'min'), lastYear=('known_year', 'max'))
+        table[['firstYear', 'lastYear']] = table[['firstYear', 'lastYear']].astype('Int16')
+
+        if not by:
+            return table.reset_index(drop=True)
+
+        return self._decode(table.reset_index(), labels).set_index(list(by))
+
+    def new_species(self, layer, by=('year',), **filters):
+        """
+        Number of species first recorded in each year (or decade) of the selection, within each group of the other
+        requested dimensions (e.g. by=['region', 'year'] for first records per region). Records without a year are ignored.
+        """
+
+        time = [dim for dim in by if dim in ('year', 'decade')]
+        if len(time) != 1:
+            raise ValueError("new_species needs exactly one of 'year' or 'decade' in by")
+
+        cells = self.select(layer, **filters)
+        cells = cells[cells['year'] >= 0]
+        groups = [dim for dim in by if dim not in ('year', 'decade', 'species')]
+        keys, labels = self._keys(layer, cells, groups)
+
+        firsts = pd.concat([keys, cells[['taxon', 'year']]], axis=1).groupby(groups + ['taxon'])['year'].min().reset_index()
+        if time[0] == 'decade':
+            firsts['decade'] = firsts['year'] // 10 * 10
+
+        table = firsts.groupby(groups + time).size().rename('newSpecies').reset_index()
+
+        return self._decode(table, labels).set_index(groups + time)
@@ -0,0 +1,241 @@
+## Stage runner with cached, resumable outputs for the analyses presented in the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import os
+import sys
+import glob
+import json
+import types
+import pickle
+import hashlib
+import logging
+import importlib
+import contextlib
+
+import config
+from modules.instrumentation import rows
+
+
+class Stage:
+    """
+    One pipeline step: a handler with the upstream outputs it consumes and the names of the values it returns.
+
+    Parameters:
+        name (str): Stage name (by default the handler name).
+        func (callable): Handler to call.
+        inputs (dict): Handler argument -> output name of an upstream stage.
+        outputs (list): Names given to the returned values (a single name for a single value, none for side effects only).
+        params (dict): Constant keyword arguments of the handler.
+        files (list): Files read by the handler; their content is part of the cache key.
+        config_keys (list): Names of config values the handler reads; their values are part of the cache key.
+        after (list): Stages that must run first although no value is passed (e.g. they write files read by this one).
+        produces (list): Files written by the handler; the stage runs again when any of them is missing, even if its
+            outputs are stored (glob patterns, e.g. for numbered batches, must match at least one file).
+        cache (bool): False for stages depending on external state (e.g. remote downloads), which always run.
+    """
+
+    def __init__(self, func, inputs=None, outputs=None, params=None, files=None, config_keys=None, after=None, produces=None, cache=True, name=None):
+        self.func = func
+        self.name = name or func.__name__
+        self.inputs = inputs or {}
+        self.outputs = outputs or []
+        self.params = params or {}
+        self.files = files or []
+        self.config_keys = config_keys or []
+        self.after = after or []
+        self.produces = produces or []
+        self.cache = cache
+
+def _digest(*parts):
+    md5 = hashlib.md5()
+    for part in parts:
+        md5.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        md5.update(b'\0')
+
+    return md5.hexdigest()
+
+def file_digest(path, digests, block_size=1 << 20):
+    """
+    MD5 of a file's content, memoised in 'digests' by path, size and modification time, so large inputs are read once.
+    """
+
+    if not os.path.exists(path):
+        return 'missing'
+
+    stat = os.stat(path)
+    memo_key = f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}'
+    if memo_key not in digests:
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                md5.update(block)
+        digests[memo_key] = md5.hexdigest()
+
+    return digests[memo_key]
+
+def _project_modules(name, found):
+    """
+    Add a project module and, recursively, every project module whose functions, classes or submodules it imports.
+    """
+
+    if name in found or name.split('.')[0] not in ('modules', 'handlers'):
+        return
+
+    found.add(name)
+    for obj in vars(importlib.import_module(name)).values():
+        dependency = obj.__name__ if isinstance(obj, types.ModuleType) else getattr(obj, '__module__', None)
+        if isinstance(dependency, str):
+            _project_modules(dependency, found)
+
+def code_digest(func):
+    """
+    Digest of the source of the handler module and of every project module it depends on, directly or through other
+    project modules (e.g. archive_reader, used by endemic_analysis).
+    """
+
+    found = set()
+    _project_modules(func.__module__, found)
+
+    return _digest(*(open(importlib.import_module(name).__file__, 'rb').read() for name in sorted(found)))
+
+def missing_products(stage):
+    """
+    Files declared in stage.produces that are not on disk (glob patterns matching nothing).
+    """
+
+    return [path for path in stage.produces if not (glob.glob(path) if glob.has_magic(path) else os.path.exists(path))]
+
+class Pipeline:
+    """
+    Run stages in dependency order, persisting each stage's outputs under a hash of its upstream keys, params, input
+    files, code and config values. Stages whose key already has stored outputs (and whose declared files all exist) are skipped; their outputs are only
+    loaded when a stage that has to run needs them, so a rerun resumes from the first invalidated stage.
+    When a RunManifest is given, every stage is measured and recorded in it.
+    """
+
+    def __init__(self, stages, cache_dir, force=(), manifest=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.manifest = manifest
+        self.cache_dir = cache_dir
+        self.force = set(force)
+        self.producer = {output: stage.name for stage in stages for output in stage.outputs}
+        self.digests_path = os.path.join(cache_dir, 'file_digests.json')
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _order(self):
+        order, seen = [], set()
+
+        def visit(name, path=()):
+            if name in seen:
+                return
+            if name in path:
+                raise ValueError(f'Stage dependency cycle: {" -> ".join(path + (name,))}')
+            stage = self.stages[name]
+            upstream = [self.producer[output] for output in stage.inputs.values()] + stage.after
+            for dependency in upstream:
+                visit(dependency, path + (name,))
+            seen.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+
+        return order
+
+    def _path(self, stage, key):
+        return os.path.join(self.cache_dir, f'{stage.name}-{key}.pkl')
+
+    def _store(self, stage, key, values):
+        ## Scenario workers can store the same stage at once, so each writes its own temporary file
+        tmp_path = self._path(stage, key) + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(values, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(stage, key))
+
+    def _load(self, stage, key):
+        with open(self._path(stage, key), 'rb') as f:
+            return pickle.load(f)
+
+    def _stage_key(self, stage, keys, values, digests):
+        ## Values produced by uncached stages are hashed by content, cached ones by their producer's key
+        upstream = []
+        for arg, output in sorted(stage.inputs.items()):
+            producer = self.stages[self.producer[output]]
+            if producer.cache:
+                upstream.append((arg, keys[producer.name]))
+            else:
+                upstream.append((arg, _digest(pickle.dumps(values[output], protocol=pickle.HIGHEST_PROTOCOL))))
+        upstream += [(name, keys[name]) for name in sorted(stage.after)]
+
+        return _digest(
+            stage.name,
+            upstream,
+            json.dumps(stage.params, sort_keys=True, default=str),
+            [(path, file_digest(path, digests)) for path in stage.files],
+            code_digest(stage.func),
+            json.dumps({key: getattr(config, key, None) for key in stage.config_keys}, sort_keys=True, default=str)
+        )
+
+    def run(self):
+        """
+        Run every stage that is not up to date.
+
+        Returns:
+            dict: Outputs of the stages that ran or were needed by them, by output name.
+        """
+
+        order = self._order()
+
+        digests = {}
+        if os.path.exists(self.digests_path):
+            with open(self.digests_path) as f:
+                digests = json.load(f)
+
+        keys, values = {}, {}
+
+        try:
+            for name in order:
+                stage = self.stages[name]
+                keys[name] = self._stage_key(stage, keys, values, digests)
+
+                if stage.cache and name not in self.force and os.path.exists(self._path(stage, keys[name])):
+                    missing = missing_products(stage)
+                    if not missing:
+                        logging.info(f"Stage {name}: up to date ({keys[name][:10]}), skipped")
+                        if self.manifest:
+                            self.manifest.skipped(name)
+                        continue
+                    logging.info(f"Stage {name}: files written by the stage are missing ({', '.join(missing)})")
+
+                ## Outputs of skipped stages are only read from disk once a stage that runs needs them
+                for output in stage.inputs.values():
+                    if output not in values:
+                        producer = self.stages[self.producer[output]]
+                        values.update(self._load(producer, keys[producer.name]))
+
+                logging.info(f"Stage {name}: running ({keys[name][:10]})")
+                kwargs = {arg: values[output] for arg, output in stage.inputs.items()}
+                rows_in = [rows(value) for value in kwargs.values()]
+                measure = self.manifest.stage(name, rows_in=rows_in) if self.manifest else contextlib.nullcontext({})
+
+                with measure as record:
+                    result = stage.func(**kwargs, **stage.params)
+
+                    if len(stage.outputs) == 1:
+                        result = (result,)
+                    stage_values = dict(zip(stage.outputs, result)) if stage.outputs else {}
+                    record['rows_out'] = [rows(value) for value in stage_values.values()]
+                values.update(stage_values)
+
+                self._store(stage, keys[name], stage_values)
+        finally:
+            tmp_path = self.digests_path + f'.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(digests, f)
+            os.replace(tmp_path, self.digests_path)
+
+        return values
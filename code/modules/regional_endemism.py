@@ -0,0 +1,47 @@
+## Functions to estimate sub-national endemism and range restriction presented in the results of the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import numpy as np
+import pandas as pd
+
+
+def endemism_metrics(matrix, region_labels, max_regions=1):
+    """
+    Score every region of an incidence matrix in one pass.
+
+    Range size of a species is the number of regions of the layer in which it was recorded.
+
+    Parameters:
+        matrix (csr_matrix): Binary region x species incidence matrix (see modules.incidence_matrix).
+        region_labels (array-like): Region label of each row.
+        max_regions (int): Species recorded in this many regions or fewer are counted as restricted-range.
+
+    Returns:
+        DataFrame: Per region, species richness ('sppNumber'), restricted-range species ('restrictedSpp'),
+        weighted endemism ('WE', sum of 1/range size over the species of the region) and corrected weighted endemism
+        ('CWE', WE divided by richness).
+    """
+
+    matrix = matrix.astype(np.float64)
+    range_size = np.asarray(matrix.sum(axis=0)).ravel()
+
+    with np.errstate(divide='ignore'):
+        inverse_range = np.where(range_size > 0, 1 / range_size, 0.0)
+    restricted = ((range_size > 0) & (range_size <= max_regions)).astype(np.float64)
+
+    richness = np.asarray(matrix.sum(axis=1)).ravel()
+    weighted = matrix @ inverse_range
+    n_restricted = matrix @ restricted
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corrected = np.where(richness > 0, weighted / richness, 0.0)
+
+    return pd.DataFrame({
+        'sppNumber': richness.astype(np.int64),
+        'restrictedSpp': n_restricted.astype(np.int64),
+        'WE': weighted,
+        'CWE': corrected
+    }, index=pd.Index(region_labels, name='region'))
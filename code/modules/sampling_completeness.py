@@ -0,0 +1,290 @@
+## Functions to estimate sampling completeness (rarefaction/extrapolation, Chao1, Chao2 and ACE) per region for the spatial analyses
+## presented in the manuscript entitled "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.special import gammaln
+from concurrent.futures import ProcessPoolExecutor
+
+
+## Species with this many records or fewer form the rare group of the ACE estimator
+ACE_RARE_THRESHOLD = 10
+
+
+def region_frequencies(region_codes, taxon_codes, unit_codes):
+    """
+    Per-region species frequencies from integer codes, without building any dense region x species table.
+
+    Parameters:
+        region_codes (array-like): Region code of each record (negative codes are dropped).
+        taxon_codes (array-like): Species code of each record.
+        unit_codes (array-like): Sampling unit code of each record (e.g. grid cell).
+
+    Returns:
+        Tuple[csr_matrix, csr_matrix, ndarray]: Record counts (regions x species), number of sampling units where each
+        species was recorded (regions x species) and number of sampling units per region.
+    """
+
+    region_codes = np.asarray(region_codes, dtype=np.int64)
+    taxon_codes = np.asarray(taxon_codes, dtype=np.int64)
+    unit_codes = np.asarray(unit_codes, dtype=np.int64)
+
+    keep = (region_codes >= 0) & (taxon_codes >= 0)
+    region_codes, taxon_codes, unit_codes = region_codes[keep], taxon_codes[keep], unit_codes[keep]
+
+    shape = (int(region_codes.max()) + 1 if len(region_codes) else 0, int(taxon_codes.max()) + 1 if len(taxon_codes) else 0)
+
+    abundance = sparse.coo_matrix((np.ones(len(region_codes), dtype=np.int64), (region_codes, taxon_codes)), shape=shape).tocsr()
+
+    records = pd.DataFrame({'region': region_codes, 'taxon': taxon_codes, 'unit': unit_codes})
+    detections = records.drop_duplicates()
+    incidence = sparse.coo_matrix((np.ones(len(detections), dtype=np.int64), (detections['region'], detections['taxon'])), shape=shape).tocsr()
+
+    units = records[['region', 'unit']].drop_duplicates()
+    n_units = np.bincount(units['region'], minlength=shape[0])
+
+    return abundance, incidence, n_units
+
+def _singletons_doubletons(freqs):
+    return (freqs == 1).sum(axis=-1).astype(float), (freqs == 2).sum(axis=-1).astype(float)
+
+def undetected_richness(freqs, total):
+    """
+    Bias-corrected Chao estimate of the number of undetected species (f0 for abundances, Q0 for incidences).
+    freqs may be a 1D vector or a 2D array (one row per assemblage).
+    """
+
+    f1, f2 = _singletons_doubletons(freqs)
+    factor = (total - 1) / total if total > 0 else 0.0
+
+    return factor * f1 * (f1 - 1) / (2 * (f2 + 1))
+
+def chao1(counts):
+    """
+    Bias-corrected Chao1 from record counts per species (1D vector or one assemblage per row).
+    """
+
+    n = counts.sum(axis=-1)
+    s_obs = (counts > 0).sum(axis=-1)
+    f1, f2 = _singletons_doubletons(counts)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = np.where(n > 0, (n - 1) / n, 0.0)
+
+    return s_obs + factor * f1 * (f1 - 1) / (2 * (f2 + 1))
+
+def chao2(frequencies, n_units):
+    """
+    Bias-corrected Chao2 from the number of sampling units where each species was recorded.
+    """
+
+    s_obs = (frequencies > 0).sum(axis=-1)
+
+    return s_obs + undetected_richness(frequencies, n_units)
+
+def ace(counts, rare_threshold=ACE_RARE_THRESHOLD):
+    """
+    Abundance-based coverage estimator, falling back to Chao1 when every rare species is a singleton.
+    """
+
+    rare = (counts > 0) & (counts <= rare_threshold)
+    s_abund = (counts > rare_threshold).sum(axis=-1)
+    s_rare = rare.sum(axis=-1)
+    n_rare = np.where(rare, counts, 0).sum(axis=-1).astype(float)
+    f1 = (counts == 1).sum(axis=-1)
+
+    ## sum of i * (i - 1) * f_i over the rare group, i.e. sum of X * (X - 1) over rare species
+    moments = np.where(rare, counts * (counts - 1), 0).sum(axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coverage = 1 - f1 / n_rare
+        gamma = np.maximum(s_rare / coverage * moments / (n_rare * (n_rare - 1)) - 1, 0)
+        estimate = s_abund + s_rare / coverage + f1 / coverage * gamma
+
+    return np.where((n_rare > 1) & (coverage > 0), estimate, chao1(counts))
+
+def expected_richness(freqs, total, sizes):
+    """
+    Rarefied (sizes < total) and extrapolated (sizes > total) species richness.
+
+    Works for abundances (total = number of records) and incidences (total = number of sampling units) alike,
+    for a single assemblage or for every row of a 2D array at once (e.g. bootstrap replicates).
+
+    Returns:
+        ndarray: Expected richness with one column per size (and one row per assemblage when freqs is 2D).
+    """
+
+    freqs = np.atleast_2d(freqs).astype(float)
+    sizes = np.asarray(sizes, dtype=float)
+    s_obs = (freqs > 0).sum(axis=1).astype(float)
+    f0 = undetected_richness(freqs, total)
+    f1, _ = _singletons_doubletons(freqs)
+
+    curves = np.empty((freqs.shape[0], len(sizes)))
+    log_total = gammaln(total + 1)
+
+    for j, m in enumerate(sizes):
+        if m <= total:
+            ## 1 - C(total - X, m) / C(total, m) per species, in log space; species with X > total - m are certain
+            remaining = total - freqs
+            valid = (freqs > 0) & (remaining >= m)
+            log_ratio = gammaln(remaining + 1) - gammaln(remaining - m + 1) - log_total + gammaln(total - m + 1)
+            missed = np.where(valid, np.exp(np.where(valid, log_ratio, 0.0)), 0.0)
+            curves[:, j] = s_obs - missed.sum(axis=1)
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                base = np.where(f0 > 0, 1 - f1 / (total * f0 + f1), 1.0)
+            curves[:, j] = s_obs + f0 * (1 - base ** (m - total))
+
+    return curves
+
+def sample_coverage(freqs, total):
+    """
+    Good-Turing sample coverage estimate, with the doubleton correction of Chao & Jost (2012).
+    The correction is undefined for a single record or sampling unit without doubletons; plain Good-Turing (1 - f1/n) is used then.
+    """
+
+    freqs = np.asarray(freqs)
+    f1, f2 = _singletons_doubletons(freqs)
+    if f1 == 0:
+        return 1.0
+
+    denominator = (total - 1) * f1 + 2 * f2
+    if total <= 1 or denominator == 0:
+        return float(1 - f1 / freqs.sum())
+
+    return float(1 - f1 / freqs.sum() * ((total - 1) * f1 / denominator))
+
+def bootstrap_assemblage(freqs, total, incidence=False):
+    """
+    Detection probabilities of the estimated complete assemblage (detected species with coverage-adjusted
+    probabilities plus the estimated undetected species with equal probabilities), used for bootstrap resampling.
+    """
+
+    freqs = np.asarray(freqs, dtype=float)
+    freqs = freqs[freqs > 0]
+    coverage = sample_coverage(freqs, total)
+
+    ## Incidence probabilities sum to the mean number of species per sampling unit instead of one
+    scale = freqs.sum() / total if incidence else 1.0
+    relative = freqs / total
+    weights = (relative * np.exp(-freqs)).sum()
+    detected = relative * (1 - (scale * (1 - coverage) / weights if weights > 0 else 0.0) * np.exp(-freqs))
+
+    n_undetected = int(np.ceil(undetected_richness(freqs, total)))
+    undetected = np.full(n_undetected, scale * (1 - coverage) / n_undetected) if n_undetected else np.empty(0)
+
+    probs = np.clip(np.concatenate([detected, undetected]), 0, None)
+
+    ## With zero coverage and no undetected species estimated (e.g. a single record), nothing is left to adjust: the
+    ## observed relative frequencies are resampled as they are
+    if not probs.sum() > 0:
+        probs = relative
+
+    if not incidence:
+        probs = probs / probs.sum()
+
+    return probs
+
+def curve_sizes(total, n_points=40, extrapolate=2.0):
+    """
+    Sample sizes at which curves are evaluated: n_points sizes up to extrapolate x the observed total (always including it).
+    """
+
+    sizes = np.unique(np.round(np.linspace(1, extrapolate * total, n_points)).astype(np.int64))
+
+    return np.unique(np.append(sizes, total))
+
+def region_completeness(counts, frequencies, n_units, n_bootstrap=200, n_points=40, seed=None):
+    """
+    Completeness estimators and interpolation/extrapolation curves for one region, with bootstrap standard errors.
+
+    Bootstrap replicates are drawn all at once (multinomial for record counts, binomial per species for incidences)
+    and every estimator and curve is evaluated on the whole replicate array, without a Python loop per replicate.
+
+    Parameters:
+        counts (ndarray): Record counts of the species detected in the region.
+        frequencies (ndarray): Number of sampling units where each detected species was recorded.
+        n_units (int): Number of sampling units in the region.
+        n_bootstrap (int): Bootstrap replicates.
+        n_points (int): Points per curve.
+        seed: Seed (or numpy SeedSequence) of the region's random generator.
+
+    Returns:
+        Tuple[dict, DataFrame]: Estimators of the region and its curves (method, size, richness and 95% interval).
+    """
+
+    rng = np.random.default_rng(seed)
+    counts = np.asarray(counts, dtype=np.int64)
+    frequencies = np.asarray(frequencies, dtype=np.int64)
+    n = int(counts.sum())
+
+    abundance_probs = bootstrap_assemblage(counts, n)
+    incidence_probs = bootstrap_assemblage(frequencies, n_units, incidence=True)
+    boot_counts = rng.multinomial(n, abundance_probs, size=n_bootstrap)
+    boot_frequencies = rng.binomial(n_units, np.clip(incidence_probs, 0, 1), size=(n_bootstrap, len(incidence_probs)))
+
+    estimates = {
+        'records': n,
+        'samplingUnits': int(n_units),
+        'sppObserved': int((counts > 0).sum()),
+        'coverage': sample_coverage(counts, n)
+    }
+    for name, point, replicates in [
+        ('chao1', chao1(counts), chao1(boot_counts)),
+        ('ace', ace(counts), ace(boot_counts)),
+        ('chao2', chao2(frequencies, n_units), chao2(boot_frequencies, n_units))
+    ]:
+        estimates[name] = float(point)
+        estimates[f'{name}_se'] = float(replicates.std(ddof=1)) if n_bootstrap > 1 else np.nan
+
+    curves = []
+    for method, freqs, boot, total in [('abundance', counts, boot_counts, n), ('incidence', frequencies, boot_frequencies, n_units)]:
+        sizes = curve_sizes(total, n_points)
+        richness = expected_richness(freqs, total, sizes)[0]
+        boot_richness = expected_richness(boot, total, sizes)
+        se = boot_richness.std(axis=0, ddof=1) if n_bootstrap > 1 else np.zeros(len(sizes))
+        curves.append(pd.DataFrame({
+            'method': method,
+            'size': sizes,
+            'type': np.where(sizes < total, 'rarefaction', np.where(sizes == total, 'observed', 'extrapolation')),
+            'richness': richness,
+            'lcl': np.maximum(richness - 1.96 * se, 0),
+            'ucl': richness + 1.96 * se
+        }))
+
+    return estimates, pd.concat(curves, ignore_index=True)
+
+def _region_task(args):
+    return region_completeness(*args)
+
+def completeness_by_region(abundance, incidence, n_units, region_labels, n_bootstrap=200, n_points=40, seed=42, max_workers=None):
+    """
+    Run region_completeness for every region with records, in a process pool.
+
+    Each region gets its own child of one SeedSequence, so results do not depend on worker scheduling.
+
+    Returns:
+        Tuple[DataFrame, DataFrame]: Estimators per region and curves per region (long format).
+    """
+
+    abundance, incidence = abundance.tocsr(), incidence.tocsr()
+    regions = [i for i in range(abundance.shape[0]) if abundance.indptr[i + 1] > abundance.indptr[i]]
+    seeds = np.random.SeedSequence(seed).spawn(abundance.shape[0])
+
+    ## Only the non-zero frequencies of each region are shipped to the workers
+    tasks = [(abundance.data[abundance.indptr[i]:abundance.indptr[i + 1]],
+              incidence.data[incidence.indptr[i]:incidence.indptr[i + 1]],
+              int(n_units[i]), n_bootstrap, n_points, seeds[i]) for i in regions]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_region_task, tasks))
+
+    estimates = pd.DataFrame([est for est, _ in results], index=pd.Index([region_labels[i] for i in regions], name='region'))
+    curves = pd.concat([curve.assign(region=region_labels[i]) for i, (_, curve) in zip(regions, results)], ignore_index=True)
+
+    return estimates, curves[['region'] + [col for col in curves.columns if col != 'region']]
@@ -0,0 +1,89 @@
+## Shared reference data and concurrent execution of dataset scenarios (e.g. strict and relaxed) for the analyses presented in
+## the manuscript entitled "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import sys
+import logging
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+
+
+## Loaded reference data by (loader, arguments), kept for the life of the process and inherited by forked workers
+_shared = {}
+
+
+def shared(loader):
+    """
+    Decorator memoising a reference data loader (MycoBank, shapefiles, gazetteer) by its arguments.
+
+    Data loaded in the parent before scenario workers are forked is inherited by every worker (copy-on-write), so each
+    scenario reuses it instead of reading and parsing it again. Returned objects are shared and must not be modified.
+    """
+
+    @functools.wraps(loader)
+    def wrapper(*args, **kwargs):
+        key = (loader.__module__, loader.__qualname__, repr(args), repr(sorted(kwargs.items())))
+        if key not in _shared:
+            _shared[key] = loader(*args, **kwargs)
+
+        return _shared[key]
+
+    return wrapper
+
+def apply_overrides(overrides):
+    """
+    Set config values for the current process, in config and in every pipeline module that imported them with
+    'from config import *' (handlers, modules and run scripts).
+    """
+
+    for key in overrides:
+        if not hasattr(config, key):
+            raise KeyError(f"Scenario sets '{key}', which is not a config value")
+
+    for name, module in list(sys.modules.items()):
+        if module is config or name.startswith(('handlers.', 'modules.', 'run')):
+            for key, value in overrides.items():
+                if hasattr(module, key):
+                    setattr(module, key, value)
+
+def _run_scenario(name, overrides, task):
+    apply_overrides(overrides)
+    logging.info(f"Scenario {name}: started")
+
+    return task(name)
+
+def run_scenarios(scenarios, task, max_workers=None):
+    """
+    Run task(name) once per scenario, each in its own worker process with the scenario's config values applied.
+
+    Workers are forked from this process, so reference data loaded beforehand through 'shared' loaders is not read
+    again. Where fork is unavailable, workers are spawned and load reference data themselves.
+
+    Parameters:
+        scenarios (dict): Scenario name -> config values overridden in that scenario.
+        task (callable): Module-level function run in each worker with the scenario name; its result must be picklable.
+        max_workers (int): Scenarios run at once (defaults to one per scenario).
+
+    Returns:
+        dict: Result of task by scenario name.
+    """
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        logging.warning("Fork is not available; scenario workers will load reference data themselves")
+        context = multiprocessing.get_context('spawn')
+
+    with ProcessPoolExecutor(max_workers=max_workers or len(scenarios), mp_context=context) as executor:
+        futures = {name: executor.submit(_run_scenario, name, overrides, task) for name, overrides in scenarios.items()}
+        results = {}
+        for name, future in futures.items():
+            results[name] = future.result()
+            logging.info(f"Scenario {name}: finished")
+
+    return results
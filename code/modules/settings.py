@@ -0,0 +1,182 @@
+## Typed settings loaded from config.py defaults, a settings file and environment variables for the analyses presented in the
+## manuscript entitled "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import os
+import json
+import types
+
+import config
+
+
+## Environment variables overriding settings are named with this prefix and the upper-cased setting name
+ENV_PREFIX = 'FUNGA_'
+
+## Roots of the default paths in config.py; paths under them follow when a root is changed
+PATH_ROOTS = ['data', 'output']
+
+_TRUE = {'1', 'true', 'yes', 'on'}
+_FALSE = {'0', 'false', 'no', 'off'}
+
+
+def config_defaults():
+    """
+    Settings defined in config.py, by name.
+    """
+
+    return {key: value for key, value in vars(config).items()
+            if not key.startswith('_') and not isinstance(value, (types.ModuleType, types.FunctionType, type))}
+
+def parse_value(key, text, default):
+    """
+    Convert an environment variable string to the type of the setting's default (JSON for lists, dicts and None defaults).
+    """
+
+    if isinstance(default, bool):
+        if text.strip().lower() in _TRUE:
+            return True
+        if text.strip().lower() in _FALSE:
+            return False
+        raise ValueError(f"Setting '{key}' expects a boolean, got '{text}'")
+
+    if isinstance(default, (int, float)):
+        return type(default)(text)
+
+    if isinstance(default, str):
+        return text
+
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        if default is None:
+            return text
+        raise ValueError(f"Setting '{key}' expects JSON ({type(default).__name__}), got '{text}'")
+
+def check_type(key, value, default):
+    """
+    Check a setting against the type of its default and return it in that type (ints accepted for floats, lists for tuples).
+    """
+
+    if default is None or value is None:
+        return value
+
+    if isinstance(default, bool):
+        if not isinstance(value, bool):
+            raise TypeError(f"Setting '{key}' must be a boolean, got {type(value).__name__}")
+        return value
+
+    if isinstance(default, float) and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+
+    if isinstance(default, tuple) and isinstance(value, list):
+        return tuple(value)
+
+    if not isinstance(value, type(default)) or isinstance(value, bool) != isinstance(default, bool):
+        raise TypeError(f"Setting '{key}' must be {type(default).__name__}, got {type(value).__name__}")
+
+    return value
+
+def rebase(value, old, new):
+    """
+    Replace the path prefix old by new in a value and in the strings nested in its lists, tuples and dicts.
+    """
+
+    if isinstance(value, str):
+        return new + value[len(old):] if value.startswith(old) else value
+    if isinstance(value, (list, tuple)):
+        return type(value)(rebase(v, old, new) for v in value)
+    if isinstance(value, dict):
+        return {k: rebase(v, old, new) for k, v in value.items()}
+
+    return value
+
+def read_settings_file(path):
+    """
+    Read settings from a JSON or TOML file (a flat table of setting names and values).
+    """
+
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            raise ImportError('TOML settings files need Python 3.11 or later; use a JSON file instead')
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+
+    with open(path) as f:
+        return json.load(f)
+
+class Settings:
+    """
+    Typed settings of a run: config.py defaults, then a settings file, then FUNGA_<NAME> environment variables, then
+    explicit overrides (later sources win). Every value is checked against the type of its config.py default and unknown
+    names are rejected. Loading has no side effects; apply() makes the values visible to the pipeline modules.
+
+    Example:
+        settings = Settings.load('settings.toml', overrides={'use_strict': False})
+        settings.apply()
+    """
+
+    def __init__(self, values, sources):
+        self.values = values
+        self.sources = sources
+
+    @classmethod
+    def load(cls, path=None, environ=None, overrides=None):
+        defaults = config_defaults()
+        values = dict(defaults)
+        sources = {key: 'config.py' for key in defaults}
+
+        layers = []
+        if path:
+            layers.append((path, read_settings_file(path)))
+
+        environ = os.environ if environ is None else environ
+        env_values = {}
+        for key, default in defaults.items():
+            if ENV_PREFIX + key.upper() in environ:
+                env_values[key] = parse_value(key, environ[ENV_PREFIX + key.upper()], default)
+        layers.append(('environment', env_values))
+        layers.append(('overrides', overrides or {}))
+
+        for source, layer in layers:
+            for key, value in layer.items():
+                if key not in defaults:
+                    raise KeyError(f"Unknown setting '{key}' in {source}")
+                values[key] = check_type(key, value, defaults[key])
+                sources[key] = source
+
+        ## Default paths under a changed root (data or output) follow it, unless they were set themselves
+        for root in PATH_ROOTS:
+            if root in defaults and values[root] != defaults[root]:
+                for key, default in defaults.items():
+                    if key not in PATH_ROOTS and sources[key] == 'config.py':
+                        values[key] = rebase(values[key], defaults[root], values[root])
+
+        return cls(values, sources)
+
+    def __getattr__(self, key):
+        try:
+            return self.__dict__['values'][key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def changed(self):
+        """
+        Settings differing from config.py, by name.
+        """
+
+        defaults = config_defaults()
+
+        return {key: value for key, value in self.values.items() if value != defaults.get(key)}
+
+    def apply(self):
+        """
+        Set the changed values in config and in the pipeline modules already imported.
+        """
+
+        from modules.scenarios import apply_overrides
+
+        apply_overrides(self.changed())
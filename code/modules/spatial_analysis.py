@@ -1,66 +1,98 @@
-## Functions to perform spatial analysis presented in the results of the manuscript entitled 
+## Functions to perform spatial analysis presented in the results of the manuscript entitled
 ## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
 ## Authors: Domingos Cardoso & Kelmer Martins-Cunha
 ## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
 
 
+import numpy as np
+import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point, Polygon
-from matplotlib_scalebar.scalebar import ScaleBar
 
+from modules.scenarios import shared
 
-def georeferenced_analysis(CoordsMatrix, biome_path):
+
+@shared
+def read_layer(path):
     """
-    Perform spatial join between georeferenced occurrence records and biomes.
-    
-    Parameters:
-        CoordsMatrix (GeoDataFrame): Georeferenced species occurrence records.
-        biome_path (str): Path to the biome shapefile.
-    
-    Returns:
-        GeoDataFrame: Filtered dataset with species names and biome names.
+    Read a shapefile in EPSG:4326.
     """
 
-    biomes = gpd.read_file(biome_path)
-    biomes = biomes.to_crs('epsg:4326')
+    return gpd.read_file(path).to_crs('epsg:4326')
+
+@shared
+def load_reference_layers(region_layers):
+    """
+    Read every reference layer used for region labelling.
 
-    CoordsMatrix = CoordsMatrix.set_crs('epsg:4326')
+    Parameters:
+        region_layers (dict): Mapping of layer name to (shapefile path, label field), e.g. {'biome': (biome_path, 'name')}.
 
-    if 'level_0' in CoordsMatrix.columns:
-        CoordsMatrix = CoordsMatrix.drop(columns=['level_0'])
+    Returns:
+        dict: Mapping of layer name to (GeoDataFrame with label field and geometry only, label field).
+    """
 
-    joinedMatrix = gpd.sjoin(CoordsMatrix, biomes, how='inner', predicate='within')
-    CoordsMatrix = joinedMatrix[['current_name', 'name', 'geometry']].fillna('')
+    layers = {}
+    for layer, (path, field) in region_layers.items():
+        gdf = read_layer(path)
+        layers[layer] = (gdf[[field, 'geometry']], field)
 
-    return CoordsMatrix
+    return layers
 
-def nongeoreferenced_analysis(NCcountyMatrix, NCmuniMatrix, biome_path):
+def label_regions(combinedDataMatrix, layers):
     """
-    Perform spatial join for non-georeferenced records (from county and municipality),
-    linking them with corresponding biomes.
-    
+    Assign every record to a region of each reference layer in a single pass over its unique locations.
+
+    Each unique coordinate pair is looked up once per layer, and labels are broadcast back to records as integer
+    codes ('<layer>_code', -1 when the location falls outside every polygon of the layer).
+
     Parameters:
-        NCcountyMatrix (GeoDataFrame): Occurrence records with only county-level spatial info.
-        NCmuniMatrix (GeoDataFrame): Occurrence records with only municipality-level spatial info.
-        biome_path (str): Path to the biome shapefile.
-    
+        combinedDataMatrix (GeoDataFrame): Point occurrence records.
+        layers (dict): Output of load_reference_layers.
+
     Returns:
-        Tuple[GeoDataFrame, GeoDataFrame]: Filtered datasets (county and municipality) with species and biome info.
+        Tuple[GeoDataFrame, dict]: Records with integer-coded region columns, and mapping of layer name to label Index (code -> label).
     """
 
-    biomes = gpd.read_file(biome_path)
-    biomes = biomes.to_crs('epsg:4326')
+    x = combinedDataMatrix.geometry.x.to_numpy()
+    y = combinedDataMatrix.geometry.y.to_numpy()
+
+    ## Factorise coordinate pairs so each location is tested against the polygons only once
+    loc_codes, locations = pd.MultiIndex.from_arrays([x, y]).factorize()
+    unique_points = gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy(locations.get_level_values(0), locations.get_level_values(1)), crs='epsg:4326'
+    )
+
+    region_labels = {}
+    for layer, (gdf, field) in layers.items():
+        joined = gpd.sjoin(unique_points, gdf, how='inner', predicate='within')
+        ## Points on shared borders can fall within two polygons; keep the first one as before
+        joined = joined[~joined.index.duplicated(keep='first')]
+
+        labels = pd.Categorical(gdf[field].dropna().astype(str).unique())
+        loc_region = np.full(len(unique_points), -1, dtype=np.int32)
+        loc_region[joined.index.to_numpy()] = labels.categories.get_indexer(joined[field].astype(str))
+
+        combinedDataMatrix[f'{layer}_code'] = loc_region[loc_codes]
+        region_labels[layer] = labels.categories
 
-    if 'level_0' in NCcountyMatrix.columns:
-        NCcountyMatrix = NCcountyMatrix.drop(columns=['level_0'])
+    return combinedDataMatrix, region_labels
 
-    joined_county = gpd.sjoin(NCcountyMatrix, biomes, how='inner', predicate='within')
-    NCcountyMatrix = joined_county[['current_name', 'name', 'geometry']].fillna('')
+def decode_regions(combinedDataMatrix, region_labels, layer):
+    """
+    Decode an integer-coded region column back into its labels (NaN for unassigned records).
+    """
+
+    return pd.Categorical.from_codes(combinedDataMatrix[f'{layer}_code'], categories=region_labels[layer])
 
-    if 'level_0' in NCmuniMatrix.columns:
-        NCmuniMatrix = NCmuniMatrix.drop(columns=['level_0'])
+def richness_by_region(combinedDataMatrix, region_labels, layer, taxon_col='current_name'):
+    """
+    Number of species per region of a layer, computed by a group-by on the integer region codes.
+    """
 
-    joined_muni = gpd.sjoin(NCmuniMatrix, biomes, how='inner', predicate='within')
-    NCmuniMatrix = joined_muni[['current_name', 'name', 'geometry']].fillna('')
+    assigned = combinedDataMatrix[combinedDataMatrix[f'{layer}_code'] >= 0]
+    richness = assigned.groupby(f'{layer}_code')[taxon_col].nunique()
+    richness.index = region_labels[layer][richness.index]
+    richness.index.name = layer
+    richness.name = 'sppNumber'
 
-    return NCcountyMatrix, NCmuniMatrix
\ No newline at end of file
+    return richness
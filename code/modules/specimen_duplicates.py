@@ -0,0 +1,222 @@
+## Functions to normalise collector names and cluster duplicate specimens for the analyses presented in the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz
+
+from modules.instrumentation import count
+
+
+## Name particles ignored when looking for surnames and initials ('A. da Silva' -> 'silva a')
+PARTICLES = {'da', 'de', 'do', 'das', 'dos', 'di', 'du', 'van', 'von', 'der', 'den', 'del', 'la', 'le'}
+
+## Separators between collectors of the same record ('Rick, J. & Sehnem, A.', 'J. Rick; A. Sehnem', 'Rick J et al.'); comma-separated
+## lists ('Rick, J., Sehnem, A.') are split by split_collectors
+COLLECTOR_SEPARATORS = r'\s*(?:;|&|\||/|\+|\bet\s+al\b\.?|\s(?:e|and|et|y|with|com)\s)\s*'
+
+## Record fields defining a block of candidate duplicates, besides the normalised surname of the first collector
+BLOCK_COLUMNS = ['species', 'year', 'month', 'day']
+
+
+def _tokens(text):
+    return [t for t in re.findall(r'[A-Za-z]+', text) if t.lower() not in PARTICLES]
+
+def _is_initial(token):
+    ## Initials are single letters or short upper-case groups ('JP')
+    return len(token) == 1 or (token.isupper() and len(token) <= 2)
+
+def split_collectors(text):
+    """
+    Split one part of a 'recordedBy' string on commas into one name per collector, keeping 'Surname, Initials' pairs
+    together ('Rick, J., Sehnem, A.' -> ['Rick, J.', 'Sehnem, A.']; 'J. Rick, A. Sehnem' -> ['J. Rick', 'A. Sehnem']).
+
+    A segment made of names only is a surname when the next segment holds initials or a single given name.
+    """
+
+    segments = [segment for segment in text.split(',') if re.search(r'[A-Za-z]', segment)]
+
+    names, i = [], 0
+    while i < len(segments):
+        tokens = _tokens(segments[i])
+        if tokens and not any(_is_initial(t) for t in tokens) and i + 1 < len(segments):
+            given = _tokens(segments[i + 1])
+            if given and (all(_is_initial(t) for t in given) or len(given) == 1):
+                names.append(segments[i] + ',' + segments[i + 1])
+                i += 2
+                continue
+        names.append(segments[i])
+        i += 1
+
+    return names
+
+def collector_name(text):
+    """
+    Surname and initials of one collector, written as 'Rick, J.', 'J. Rick', 'Rick J', 'RICK, Johannes' or 'J.P. Souza'.
+    """
+
+    surname_part, comma, given_part = text.partition(',')
+    if comma:
+        surnames = _tokens(surname_part)
+        if surnames:
+            return surnames[-1].lower(), [t[0].lower() for t in _tokens(given_part)]
+
+    tokens = _tokens(text)
+
+    ## The surname is the last token that is not an initial
+    is_initial = [_is_initial(t) for t in tokens]
+    names = [t for t, initial in zip(tokens, is_initial) if not initial]
+    if not names:
+        return '', []
+
+    surname = names[-1]
+    initials = []
+    for t, initial in zip(tokens, is_initial):
+        if t is surname:
+            continue
+        initials.extend(t.lower() if initial else t[0].lower())
+
+    return surname.lower(), initials
+
+def normalise_collector(text):
+    """
+    Canonical form of a 'recordedBy' string: accents and punctuation removed, every collector written as surname followed
+    by its initials ('J. Rick & A. Sehnem' and 'Rick, J., Sehnem, A.' -> 'rick j sehnem a').
+
+    Returns:
+        Tuple[str, str]: Surname of the first collector and canonical string ('' for both when no name is recognised).
+    """
+
+    if not isinstance(text, str):
+        return '', ''
+
+    text = unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore').decode()
+
+    collectors = []
+    for part in re.split(COLLECTOR_SEPARATORS, text, flags=re.IGNORECASE):
+        for name in split_collectors(part):
+            surname, initials = collector_name(name)
+            if surname:
+                collectors.append(' '.join([surname] + initials))
+
+    if not collectors:
+        return '', ''
+
+    return collectors[0].split()[0], ' '.join(collectors)
+
+def collector_keys(recorded_by):
+    """
+    Surname and canonical collector string of every record, normalising each distinct 'recordedBy' value once.
+    """
+
+    codes, uniques = pd.factorize(pd.Series(recorded_by, dtype=object))
+    keys = [normalise_collector(value) for value in uniques]
+
+    surnames = np.asarray([k[0] for k in keys] + [''], dtype=object)
+    canonical = np.asarray([k[1] for k in keys] + [''], dtype=object)
+
+    ## Missing values have code -1, which picks the trailing empty strings
+    return surnames[codes], canonical[codes]
+
+class SpecimenClusters:
+    """
+    Assign duplicate-specimen cluster IDs to occurrence records, all at once or chunk by chunk (IDs are kept across calls).
+
+    Records are blocked on species, year, month, day and the normalised surname of the first collector through a hash
+    of these fields; only collectors in the same block are compared, and those whose canonical strings reach
+    score_threshold (RapidFuzz token set ratio, 0-100) join the cluster of the best-scoring earlier collector. Records without a
+    complete block key (e.g. no date or no recognisable collector) are clusters of their own.
+
+    Example:
+        clusters, first = SpecimenClusters(score_threshold=90).assign(df_species)
+        df_species = df_species[first]
+    """
+
+    def __init__(self, score_threshold=90):
+        self.score_threshold = score_threshold
+        ## One row per distinct (block, canonical collector) seen so far, with its cluster ID
+        self.known = pd.DataFrame({'block': np.empty(0, dtype=np.uint64), 'collector': np.empty(0, dtype=object),
+                                   'cluster': np.empty(0, dtype=np.int64)})
+        self.n_clusters = 0
+
+    def _new_ids(self, n):
+        ids = np.arange(self.n_clusters, self.n_clusters + n, dtype=np.int64)
+        self.n_clusters += n
+
+        return ids
+
+    def assign(self, occurrences):
+        """
+        Cluster IDs of the records, and a mask of the first record of each cluster (False for records whose cluster was
+        already seen, in this call or an earlier one).
+
+        Parameters:
+            occurrences (DataFrame): Records with 'recordedBy' and the BLOCK_COLUMNS columns.
+
+        Returns:
+            Tuple[ndarray, ndarray]: Cluster ID per record (int64) and first-of-cluster mask.
+        """
+
+        n_before = self.n_clusters
+        surnames, canonical = collector_keys(occurrences['recordedBy'])
+
+        block_fields = occurrences[BLOCK_COLUMNS].reset_index(drop=True).copy()
+        block_fields['surname'] = surnames
+        complete = (block_fields.notna().all(axis=1) & (surnames != '')).to_numpy()
+        blocks = pd.util.hash_pandas_object(block_fields, index=False).to_numpy()
+
+        clusters = np.empty(len(occurrences), dtype=np.int64)
+        clusters[~complete] = self._new_ids(int((~complete).sum()))
+
+        ## Distinct (block, collector) pairs of this call, in order of first appearance
+        records = pd.DataFrame({'block': blocks[complete], 'collector': canonical[complete]})
+        pairs = records.drop_duplicates().reset_index(drop=True)
+        pairs = pairs.merge(self.known, on=['block', 'collector'], how='left')
+        pairs['cluster'] = pairs['cluster'].fillna(-1).astype(np.int64)
+
+        unseen = pairs['cluster'].to_numpy() < 0
+        if unseen.any():
+            new = pairs[unseen]
+            known = self.known[self.known['block'].isin(new['block'])]
+            block_size = pd.concat([new['block'], known['block']]).value_counts()
+
+            ## Pairs alone in their block open a new cluster without any comparison
+            alone = (block_size.reindex(new['block']).to_numpy() == 1)
+            pairs.loc[new.index[alone], 'cluster'] = self._new_ids(int(alone.sum()))
+
+            ## Remaining blocks: each collector joins the best-scoring earlier collector of its block, or opens a cluster
+            candidates = {block: list(zip(group['collector'], group['cluster'])) for block, group in known.groupby('block', sort=False)}
+            count('duplicate_blocks_compared', int(new.loc[~alone, 'block'].nunique()))
+            for index, block, collector in zip(new.index[~alone], new['block'].to_numpy()[~alone], new['collector'].to_numpy()[~alone]):
+                block_candidates = candidates.setdefault(block, [])
+                best_score, best_cluster = -1, -1
+                for other, other_cluster in block_candidates:
+                    score = fuzz.token_set_ratio(collector, other)
+                    if score > best_score:
+                        best_score, best_cluster = score, other_cluster
+                if best_score < self.score_threshold:
+                    best_cluster = self._new_ids(1)[0]
+                pairs.at[index, 'cluster'] = best_cluster
+                block_candidates.append((collector, best_cluster))
+
+            self.known = pd.concat([self.known, pairs.loc[unseen, ['block', 'collector', 'cluster']]], ignore_index=True)
+
+        clusters[complete] = records.merge(pairs, on=['block', 'collector'], how='left')['cluster'].to_numpy()
+
+        ## New clusters are renumbered in order of first appearance, so IDs do not depend on how records are chunked
+        new_ids = clusters >= n_before
+        order, provisional = pd.factorize(clusters[new_ids])
+        clusters[new_ids] = n_before + order
+        renumber = pd.Series(np.arange(n_before, n_before + len(provisional), dtype=np.int64), index=provisional)
+        renumbered = self.known['cluster'].to_numpy() >= n_before
+        self.known.loc[renumbered, 'cluster'] = renumber.reindex(self.known.loc[renumbered, 'cluster']).to_numpy()
+        self.n_clusters = n_before + len(provisional)
+
+        first = ~pd.Series(clusters).duplicated().to_numpy() & new_ids
+
+        return clusters, first
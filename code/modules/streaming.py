@@ -0,0 +1,175 @@
+## Helpers to process occurrence datasets in chunks under a memory budget for the analyses presented in the manuscript entitled
+## "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from modules.instrumentation import current_rss, RssSampler
+
+
+## Initial guess of the copies of a chunk alive at once while it flows through cleaning, name resolution and spatial
+## labelling; replaced by the cost measured on the first chunk wherever RSS can be read
+CHUNK_AMPLIFICATION = 12
+
+## Chunks grow at most this much from one chunk to the next, so a chunk that happened to be cheap does not overshoot
+MAX_CHUNK_GROWTH = 2
+
+
+def chunk_rows_for_budget(path, read_options, memory_budget_mb, reserved_bytes=0, sample_rows=10_000, min_rows=1_000):
+    """
+    Number of rows per chunk so that a chunk and its working copies fit in the memory left by the reference data.
+
+    The size of a row in memory is measured on the first sample_rows rows read with the same options.
+
+    Parameters:
+        path (str): Occurrence file.
+        read_options (dict): Keyword arguments of pd.read_csv used for the chunks.
+        memory_budget_mb (float): Peak memory allowed for the whole run.
+        reserved_bytes (int): Memory already taken (reference tables, layers and interpreter).
+    """
+
+    sample = pd.read_csv(path, nrows=sample_rows, **read_options)
+    bytes_per_row = max(sample.memory_usage(deep=True).sum() / max(len(sample), 1), 1)
+    available = memory_budget_mb * 2**20 - reserved_bytes
+
+    if available <= 0:
+        logging.warning(f"Reference data already takes {reserved_bytes / 2**20:.0f} MB, above the {memory_budget_mb} MB budget; using {min_rows}-row chunks")
+        return min_rows
+
+    return max(int(available / (bytes_per_row * CHUNK_AMPLIFICATION)), min_rows)
+
+class ChunkSizer:
+    """
+    Rows per chunk, re-estimated after every chunk from measured memory, so that the state carried between chunks
+    (duplicate hashes, resolved names, species x region pairs, collector clusters, cube) plus the working copies of the
+    next chunk fit in the budget.
+
+    The first chunk is sized by chunk_rows_for_budget. After each chunk, the memory cost of a row is taken as the peak RSS
+    sampled while the chunk ran minus the RSS before it, divided by its rows, and the next chunk gets the budget left over
+    the RSS measured between chunks. Where RSS cannot be read (no /proc), the first size is kept and the budget is only
+    a target.
+
+    Example:
+        sizer = ChunkSizer(path, read_options, memory_budget_mb=4096)
+        for chunk in sizer.iter_chunks(path, read_options):
+            ...
+    """
+
+    def __init__(self, path, read_options, memory_budget_mb, min_rows=1_000, sample_interval=0.1):
+        self.budget = memory_budget_mb * 2**20
+        self.min_rows = min_rows
+        self.sample_interval = sample_interval
+        self.rows = chunk_rows_for_budget(path, read_options, memory_budget_mb, reserved_bytes=current_rss() or 0, min_rows=min_rows)
+        self.over_budget = False
+
+    def record(self, rows, rss_before, peak, rss_after):
+        """
+        Size the next chunk from the RSS before a chunk of the given rows, the peak RSS and the RSS once it is processed.
+        """
+
+        if not rows or rss_before is None or rss_after is None:
+            return self.rows
+
+        cost = max(peak - rss_before, 0) / rows
+        available = self.budget - rss_after
+
+        if available <= 0 or peak > self.budget:
+            if not self.over_budget:
+                logging.warning(f"Memory reached {max(peak, rss_after) / 2**20:.0f} MB, above the {self.budget / 2**20:.0f} MB budget; "
+                                f"shrinking chunks (state kept between chunks: {rss_after / 2**20:.0f} MB)")
+            self.over_budget = True
+
+        if available <= 0:
+            self.rows = self.min_rows
+        elif cost > 0:
+            self.rows = int(min(max(available / cost, self.min_rows), MAX_CHUNK_GROWTH * self.rows))
+
+        return self.rows
+
+    def iter_chunks(self, path, read_options):
+        """
+        Read the file in chunks of the current size, measuring memory while each chunk is processed and between chunks.
+        """
+
+        sampler = RssSampler(self.sample_interval)
+        sampler.start()
+
+        try:
+            with pd.read_csv(path, chunksize=self.rows, **read_options) as reader:
+                while True:
+                    rss_before = current_rss()
+                    sampler.peak = rss_before or 0
+                    try:
+                        chunk = reader.get_chunk(self.rows)
+                    except StopIteration:
+                        return
+                    rows = len(chunk)
+
+                    yield chunk
+
+                    del chunk
+                    rss_after = current_rss()
+                    self.record(rows, rss_before, max(sampler.peak, rss_after or 0), rss_after)
+        finally:
+            sampler.stopped.set()
+            sampler.join()
+
+class DedupFilter:
+    """
+    Keep the first occurrence of each key across chunks, as drop_duplicates(keep='first') would on the whole table.
+    Only a sorted array of 64-bit key hashes is kept between chunks (8 bytes per distinct record).
+    """
+
+    def __init__(self):
+        self.seen = np.empty(0, dtype=np.uint64)
+
+    def first_seen(self, keys):
+        """
+        Boolean mask of the rows of keys (DataFrame of key columns) not seen in this or earlier chunks.
+        """
+
+        hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+        first_in_chunk = ~pd.Series(hashes).duplicated().to_numpy()
+
+        pos = np.searchsorted(self.seen, hashes)
+        found = (pos < len(self.seen)) & (self.seen[np.minimum(pos, len(self.seen) - 1)] == hashes) if len(self.seen) else np.zeros(len(hashes), dtype=bool)
+        keep = first_in_chunk & ~found
+
+        ## New hashes are unique and absent from seen, so a sorted insert keeps seen sorted without re-sorting it
+        new = np.sort(hashes[keep])
+        self.seen = np.insert(self.seen, np.searchsorted(self.seen, new), new)
+
+        return keep
+
+class ParquetAppender:
+    """
+    Append DataFrame chunks to one Parquet file. The schema is fixed by the first chunk (all-missing columns are
+    stored as strings) and later chunks are cast to it. Categorical columns are written as their labels.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+
+    def write(self, df):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+
+        if self.writer is None:
+            self.schema = pa.schema([pa.field(f.name, pa.string() if pa.types.is_null(f.type) else
+                                              f.type.value_type if pa.types.is_dictionary(f.type) else f.type) for f in table.schema])
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+
+        self.writer.write_table(table.select(self.schema.names).cast(self.schema))
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
@@ -5,6 +5,7 @@
 
 
 import unicodedata
+import pandas as pd
 from tqdm import tqdm
 from rapidfuzz.process import extract
 from rapidfuzz.distance import JaroWinkler
@@ -208,4 +209,55 @@ def fuzzy_match_genera(mismatches, mycobank):
             author_scores.append('NA')
             
 
-    return fuzznames, fuzzscores, current_names, epithet_scores, author_scores
\ No newline at end of file
+    return fuzznames, fuzzscores, current_names, epithet_scores, author_scores
+
+def resolve_names(names, mycobank, verified=None, score_threshold=0.15, manual_threshold=0.07):
+    """
+    Harmonise distinct scientific names with the same steps and rules as perform_harmonisation (exact match, fuzzy match,
+    genus-blocked fuzzy match, manual verification decisions), so records can be resolved by a lookup on their name.
+
+    Parameters:
+        names (array-like): Scientific names (duplicates are resolved once).
+        mycobank (DataFrame): Output of format_mb.
+        verified (dict): Manual decisions (scientificName -> current_name, 'NOTFOUND' to discard).
+        score_threshold (float): Jaro Winkler distance threshold of the first fuzzy iteration.
+        manual_threshold (float): Epithet distance from which genus-blocked matches need manual verification.
+
+    Returns:
+        Tuple[Series, list]: current_name by scientificName (NaN for names discarded), and names needing manual
+        verification that have no decision yet.
+    """
+
+    verified = verified or {}
+    resolved = pd.DataFrame({'scientificName': pd.unique(pd.Series(names, dtype=object))})
+
+    resolved['current_name'] = exact_matches(resolved, mycobank)
+
+    mismatches = resolved[resolved['current_name'] == 'NA'].reset_index(drop=True)
+    _, _, mismatches['current_name'] = fuzzy_match(mismatches, mycobank, score_threshold=score_threshold)
+
+    fuzzymismatched = mismatches[mismatches['current_name'] == 'NA'].reset_index(drop=True)
+    pending = []
+    if len(fuzzymismatched) > 0:
+        _, fuzzscores, current_names, epithet_scores, _ = fuzzy_match_genera(fuzzymismatched, mycobank)
+        fuzzymismatched['fuzzscore'] = fuzzscores
+        fuzzymismatched['current_name'] = current_names
+        fuzzymismatched['epithet_score'] = epithet_scores
+
+        ## Names without any genus-blocked match are discarded
+        fuzzymismatched.loc[fuzzymismatched['fuzzscore'] == 'NA', 'current_name'] = None
+
+        matched = fuzzymismatched['fuzzscore'] != 'NA'
+        manual = matched & (pd.to_numeric(fuzzymismatched['epithet_score'], errors='coerce') >= manual_threshold)
+        decisions = fuzzymismatched.loc[manual, 'scientificName'].map(verified)
+        pending = fuzzymismatched.loc[manual & decisions.reindex(fuzzymismatched.index).isna(), 'scientificName'].tolist()
+        fuzzymismatched.loc[manual, 'current_name'] = decisions.combine_first(fuzzymismatched.loc[manual, 'current_name'])
+        fuzzymismatched.loc[fuzzymismatched['current_name'] == 'NOTFOUND', 'current_name'] = None
+
+    current = pd.concat([
+        resolved.loc[resolved['current_name'] != 'NA', ['scientificName', 'current_name']],
+        mismatches.loc[mismatches['current_name'] != 'NA', ['scientificName', 'current_name']],
+        fuzzymismatched[['scientificName', 'current_name']] if len(fuzzymismatched) > 0 else None
+    ])
+
+    return current.set_index('scientificName')['current_name'].reindex(resolved['scientificName']), pending
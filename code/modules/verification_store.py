@@ -0,0 +1,78 @@
+## Functions to keep manual name verification decisions across runs for the taxonomic harmonisation presented in the manuscript
+## entitled "Brazil as a global player in Fungal Conservation: A rapid shift from neglect to Action"
+## Authors: Domingos Cardoso & Kelmer Martins-Cunha
+## Contact: Kelmer Martins-Cunha (kelmermartinscunha@gmail.com)
+
+
+import os
+import fcntl
+import contextlib
+import pandas as pd
+
+
+STORE_COLUMNS = ['scientificName', 'current_name', 'source', 'decided']
+
+
+def load_store(store_path):
+    """
+    Read accumulated verification decisions (one row per original scientificName).
+    """
+
+    if os.path.exists(store_path):
+        return pd.read_csv(store_path, dtype=str, keep_default_na=False)
+
+    return pd.DataFrame(columns=STORE_COLUMNS)
+
+def merge_decisions(store, verified_path):
+    """
+    Add the decisions of a manually verified spreadsheet ('scientificName' and 'current_name' columns, 'NOTFOUND' for
+    names to discard) to the store. Decisions in the spreadsheet replace earlier ones for the same name.
+    """
+
+    if not os.path.exists(verified_path):
+        return store
+
+    verified = pd.read_excel(verified_path, dtype=str)[['scientificName', 'current_name']].dropna()
+    verified = verified.drop_duplicates(subset='scientificName', keep='last')
+    verified['source'] = os.path.basename(verified_path)
+    verified['decided'] = pd.Timestamp.fromtimestamp(os.path.getmtime(verified_path)).isoformat(timespec='seconds')
+
+    store = store[~store['scientificName'].isin(verified['scientificName'])]
+
+    return pd.concat([store, verified[STORE_COLUMNS]], ignore_index=True)
+
+@contextlib.contextmanager
+def store_lock(store_path):
+    """
+    Exclusive lock on a store (held on a '.lock' file next to it), so runs of different scenarios write it one at a time.
+    """
+
+    with open(store_path + '.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def save_store(store, store_path):
+    """
+    Write the store, merged under the store lock with the decisions saved meanwhile by other runs (e.g. the other
+    scenario), so none is lost. For a name decided in both, the later decision is kept (this run's on ties).
+    """
+
+    with store_lock(store_path):
+        store = pd.concat([load_store(store_path), store[STORE_COLUMNS]], ignore_index=True)
+        store = store.sort_values('decided', kind='stable').drop_duplicates(subset='scientificName', keep='last')
+
+        tmp_path = store_path + f'.{os.getpid()}.tmp'
+        store.sort_index().to_csv(tmp_path, index=False)
+        os.replace(tmp_path, store_path)
+
+def pending_names(manual_check, store):
+    """
+    Records of the names to check that have no decision in the store yet, one per scientificName.
+    """
+
+    undecided = ~manual_check['scientificName'].isin(store['scientificName'])
+
+    return manual_check[undecided].drop_duplicates(subset='scientificName')
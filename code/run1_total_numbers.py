@@ -4,26 +4,60 @@ from handlers.taxonomic_handlers import format_occurrences
 from handlers.taxonomic_handlers import shs_treatment
 from handlers.taxonomic_handlers import join_df_shs
 from handlers.taxonomic_handlers import perform_harmonisation
+from modules.pipeline import Stage, Pipeline
+from modules.instrumentation import RunManifest
+import config
 from config import *
 
-## Start log file
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("run1_total_numbers.log", mode='a'),
-        logging.StreamHandler()
+
+def build_stages():
+    """
+    Stages of the taxonomic harmonisation and total species estimates for the dataset chosen in config.
+    """
+
+    if use_strict:
+        verified_manually = verified_manually_strict
+        suffix, taxon_vocabulary_path = 'strict', taxon_vocabulary_strict
+    else:
+        verified_manually = verified_manually_relaxed
+        suffix, taxon_vocabulary_path = 'relaxed', taxon_vocabulary_relaxed
+
+    stages = [
+        Stage(format_occurrences, outputs=['df_species'], params={'use_strict': use_strict, 'occ_strict': occ_strict, 'occ_relaxed': occ_relaxed},
+              files=[occ_strict if use_strict else occ_relaxed], config_keys=['collector_score_threshold', 'collapse_duplicate_specimens']),
+        Stage(shs_treatment, inputs={'df_species': 'df_species'}, outputs=['shs']),
+        Stage(join_df_shs, inputs={'df_species': 'df_species', 'shs': 'shs'}, outputs=['df_joined']),
+        Stage(perform_harmonisation, inputs={'df_species': 'df_joined'}, params={'mb_path': mb_path},
+              files=[mb_path, verified_manually, verification_store], config_keys=['jaro_threshold', 'headless', 'use_strict'],
+              produces=[output+f'occurrences_harmonised_{suffix}.csv', output+f'derep_occs_{suffix}.csv', output+f'manual_check_taxonomy_{suffix}.csv',
+                        taxon_vocabulary_path])
     ]
-)
 
-logging.captureWarnings(True)
-warnings.simplefilter('default')
+    return stages
+
+def main():
+    """
+    Run the taxonomic harmonisation stages, skipping those already up to date.
+    """
+
+    ## Start log file
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("run1_total_numbers.log", mode='a'),
+            logging.StreamHandler()
+        ]
+    )
 
-## Perform taxonomic harmonisation and run analysis for total species estimates
-df_species = format_occurrences(use_strict=True, occ_strict=occ_strict, occ_relaxed=occ_relaxed)
+    logging.captureWarnings(True)
+    warnings.simplefilter('default')
 
-shs = shs_treatment(df_species)
+    ## Perform taxonomic harmonisation and run analysis for total species estimates
+    manifest = RunManifest('run1_total_numbers', manifest_dir, config_values={key: value for key, value in vars(config).items() if not key.startswith('_')},
+                           profile_stage=profile_stage, trace_memory=trace_memory)
 
-df_species = join_df_shs(df_species, shs)
+    Pipeline(build_stages(), cache_dir=pipeline_cache_dir, force=pipeline_force, manifest=manifest).run()
 
-perform_harmonisation(df_species, mb_path)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
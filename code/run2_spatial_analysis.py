@@ -2,39 +2,94 @@ import logging
 import warnings
 from handlers.spatial_handlers import read_harmonised_occurrences
 from handlers.spatial_handlers import treat_georeferenced
-from handlers.spatial_handlers import perform_georeferenced_analysis
 from handlers.spatial_handlers import treat_nongeoreferenced_county
 from handlers.spatial_handlers import treat_nongeoreferenced_muni
-from handlers.spatial_handlers import perform_nongeoreferenced_analysis
+from handlers.spatial_handlers import treat_nongeoreferenced_locality
 from handlers.spatial_handlers import join_gdfs
+from handlers.spatial_handlers import perform_region_labelling
+from handlers.spatial_handlers import update_occurrence_cube
+from handlers.spatial_handlers import save_results
+from handlers.spatial_handlers import perform_endemism_analysis
+from handlers.spatial_handlers import perform_completeness_analysis
 from handlers.spatial_handlers import plot_results
+from modules.pipeline import Stage, Pipeline
+from modules.instrumentation import RunManifest
+import config
 from config import *
 
-## Start log file
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("run2_spatial_analysis.log", mode='a'),
-        logging.StreamHandler()
-    ]
-)
 
-logging.captureWarnings(True)
-warnings.simplefilter('default')
+def build_stages():
+    """
+    Stages of the spatial analysis (including plots) for the dataset chosen in config.
+    """
+
+    shapefiles = [path for path, _ in region_layers.values()] + [path.replace('.shp', '.dbf') for path, _ in region_layers.values()]
+
+    if use_strict_spatial:
+        suffix = 'strict'
+    else:
+        suffix = 'relaxed'
+
+    stages = [
+        Stage(read_harmonised_occurrences, outputs=['occurrences_harmonised'],
+              params={'use_strict_spatial': use_strict_spatial, 'occ_strict_harmonised': occ_strict_harmonised, 'occ_relaxed_harmonised': occ_relaxed_harmonised},
+              files=[occ_strict_harmonised if use_strict_spatial else occ_relaxed_harmonised]),
+        Stage(treat_georeferenced, inputs={'occurrences_harmonised': 'occurrences_harmonised'}, outputs=['CoordsMatrix'],
+              params={'muni_path': muni_path}, files=[muni_path],
+              config_keys=['coordinate_flags_reject', 'fix_swapped_coordinates', 'centroid_tolerance', 'min_coordinate_decimals'],
+              produces=[output+f'coordinate_flags_{suffix}.csv']),
+        Stage(treat_nongeoreferenced_county, inputs={'occurrences_harmonised': 'occurrences_harmonised'}, outputs=['NCcountyMatrix'],
+              params={'muni_path': muni_path}, files=[muni_path]),
+        Stage(treat_nongeoreferenced_muni, inputs={'occurrences_harmonised': 'occurrences_harmonised'}, outputs=['NCmuniMatrix'],
+              params={'muni_path': muni_path}, files=[muni_path]),
+        Stage(treat_nongeoreferenced_locality, inputs={'occurrences_harmonised': 'occurrences_harmonised'}, outputs=['NClocalityMatrix'],
+              params={'gazetteer_path': gazetteer_path}, files=[gazetteer_path], config_keys=['geocode_score_threshold']),
+        Stage(join_gdfs, inputs={'CoordsMatrix': 'CoordsMatrix', 'NCcountyMatrix': 'NCcountyMatrix', 'NCmuniMatrix': 'NCmuniMatrix',
+                                 'NClocalityMatrix': 'NClocalityMatrix'}, outputs=['combinedDataMatrix']),
+        Stage(perform_region_labelling, inputs={'combinedDataMatrix': 'combinedDataMatrix'}, outputs=['labelledMatrix', 'region_labels'],
+              params={'region_layers': region_layers}, files=shapefiles, produces=[output+f'richness_{layer}_{suffix}.csv' for layer in region_layers]),
+        Stage(update_occurrence_cube, inputs={'combinedDataMatrix': 'labelledMatrix', 'region_labels': 'region_labels'},
+              config_keys=['use_strict_spatial'], produces=[occurrence_cube_strict if use_strict_spatial else occurrence_cube_relaxed]),
+        Stage(save_results, inputs={'combinedDataMatrix': 'labelledMatrix', 'region_labels': 'region_labels'},
+              config_keys=['map_extent', 'map_cell_size'],
+              produces=[output+f'incidence_provinces_{suffix}.npz', output+f'incidence_biomes_{suffix}.npz', output+f'occurrence_grid_{suffix}.npz',
+                        comb_matrix_strict if use_strict_spatial else comb_matrix_relaxed]),
+        Stage(perform_endemism_analysis, after=['save_results'], params={'use_strict_spatial': use_strict_spatial},
+              config_keys=['restricted_range_max_regions'],
+              produces=[output+f'endemism_{layer}_{suffix}.csv' for layer in ['biomes', 'provinces']]),
+        Stage(perform_completeness_analysis, inputs={'combinedDataMatrix': 'labelledMatrix', 'region_labels': 'region_labels'},
+              config_keys=['completeness_unit_size', 'completeness_bootstrap', 'rarefaction_points', 'completeness_seed'],
+              produces=[output+f'{table}_{layer}_{suffix}.csv' for table in ['completeness', 'rarefaction'] for layer in ['biome', 'province']]),
+        ## Maps only depend on the saved results and can be regenerated on their own
+        Stage(plot_results, after=['save_results'], params={'neo_path': neo_path, 'render_mode': map_render_mode},
+              files=[neo_path], config_keys=['map_simplify_tolerance', 'map_extent', 'use_strict_spatial'], produces=[output+f'provinceMap_plasma_{suffix}.png'])
+    ]
 
-## Perform spatial analysis (including plots)
-occurrences_harmonised = read_harmonised_occurrences(use_strict_spatial=True, occ_strict_harmonised=occ_strict_harmonised, occ_relaxed_harmonised=occ_relaxed_harmonised)
+    return stages
 
-CoordsMatrix = treat_georeferenced(occurrences_harmonised)
+def main():
+    """
+    Run the spatial analysis stages, skipping those already up to date.
+    """
 
-CoordsMatrix = perform_georeferenced_analysis(CoordsMatrix=CoordsMatrix, biome_path=biome_path)
+    ## Start log file
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("run2_spatial_analysis.log", mode='a'),
+            logging.StreamHandler()
+        ]
+    )
 
-NCcountyMatrix = treat_nongeoreferenced_county(occurrences_harmonised, muni_path=muni_path)
-NCmuniMatrix = treat_nongeoreferenced_muni(occurrences_harmonised, muni_path=muni_path)
+    logging.captureWarnings(True)
+    warnings.simplefilter('default')
 
-NCcountyMatrix, NCmuniMatrix = perform_nongeoreferenced_analysis(NCcountyMatrix, NCmuniMatrix)
+    ## Perform spatial analysis (including plots)
+    manifest = RunManifest('run2_spatial_analysis', manifest_dir, config_values={key: value for key, value in vars(config).items() if not key.startswith('_')},
+                           profile_stage=profile_stage, trace_memory=trace_memory)
 
-combinedDataMatrix = join_gdfs(CoordsMatrix=CoordsMatrix, NCcountyMatrix=NCcountyMatrix, NCmuniMatrix=NCmuniMatrix)
+    Pipeline(build_stages(), cache_dir=pipeline_cache_dir, force=pipeline_force, manifest=manifest).run()
 
-plot_results(combinedDataMatrix, neo_path=neo_path)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -3,34 +3,60 @@ import warnings
 import pandas as pd
 from handlers.endemic_handlers import read_combined_matrix
 from handlers.endemic_handlers import gather_gbif_keys
-from handlers.endemic_handlers import gather_gbif_keys_original
 from handlers.endemic_handlers import create_queries_gbif
 from handlers.endemic_handlers import send_requests
 from handlers.endemic_handlers import perform_endemic_analysis
+from modules.pipeline import Stage, Pipeline
+from modules.instrumentation import RunManifest
+import config
 from config import *
 
 
-## Start log file
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("run3_endemic_analysis.log", mode='a'),
-        logging.StreamHandler()
+def build_stages():
+    """
+    Stages of the endemicity analysis for the dataset chosen in config.
+    """
+
+    stages = [
+        Stage(read_combined_matrix, outputs=['combinedDataMatrix'],
+              params={'use_strict_endemic': use_strict_endemic, 'comb_matrix_strict': comb_matrix_strict, 'comb_matrix_relaxed': comb_matrix_relaxed},
+              files=[comb_matrix_strict if use_strict_endemic else comb_matrix_relaxed]),
+        Stage(gather_gbif_keys, inputs={'combinedDataMatrix': 'combinedDataMatrix'}, outputs=['keys_gbif_conct'],
+              params={'use_strict_endemic': use_strict_endemic}, files=[occ_strict_harmonised if use_strict_endemic else occ_relaxed_harmonised],
+              config_keys=['use_offline_backbone', 'gbif_backbone_path', 'api_url']),
+        Stage(create_queries_gbif, inputs={'keys_gbif_conct': 'keys_gbif_conct'}, outputs=['key_gbif_conct'], params={'batch_size': batch_size},
+              produces=[output+'query_*.json']),
+        ## Download status lives on the GBIF side, so requests are always followed up
+        Stage(send_requests, after=['create_queries_gbif'], outputs=['zip_files'], params={'output': output}, cache=False),
+        Stage(perform_endemic_analysis, inputs={'keys_gbif_conct': 'key_gbif_conct', 'zip_files': 'zip_files'}, outputs=['br_endemics'],
+              config_keys=['use_strict_endemic', 'country_groups'],
+              produces=[output+'br_endemics.csv', country_index_strict if use_strict_endemic else country_index_relaxed])
     ]
-)
 
-logging.captureWarnings(True)
-warnings.simplefilter('default')
+    return stages
 
-combinedDataMatrix = read_combined_matrix(use_strict_endemic=True, comb_matrix_strict=comb_matrix_strict, comb_matrix_relaxed=comb_matrix_relaxed)
+def main():
+    """
+    Run the endemicity analysis stages, skipping those already up to date.
+    """
 
-keys_gbif, spp_no_keys = gather_gbif_keys(combinedDataMatrix)
+    ## Start log file
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("run3_endemic_analysis.log", mode='a'),
+            logging.StreamHandler()
+        ]
+    )
 
-keys_gbif2 = gather_gbif_keys_original(spp_no_keys, use_strict_endemic=True)
+    logging.captureWarnings(True)
+    warnings.simplefilter('default')
 
-key_gbif_conct = create_queries_gbif(keys_gbif, keys_gbif2, batch_size=batch_size)
+    manifest = RunManifest('run3_endemic_analysis', manifest_dir, config_values={key: value for key, value in vars(config).items() if not key.startswith('_')},
+                           profile_stage=profile_stage, trace_memory=trace_memory)
 
-send_requests(output=output)
+    Pipeline(build_stages(), cache_dir=pipeline_cache_dir, force=pipeline_force, manifest=manifest).run()
 
-br_endemics = perform_endemic_analysis(key_gbif_conct)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import logging
+import warnings
+from handlers.scenario_handlers import preload_references, run_scenario, compare_scenarios
+from modules.scenarios import run_scenarios
+from config import *
+
+
+def main():
+    """
+    Run every scenario in config.scenarios side by side, sharing reference data loaded once, and compare their totals.
+    """
+
+    ## Start log file
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("run_scenarios.log", mode='a'),
+            logging.StreamHandler()
+        ]
+    )
+
+    logging.captureWarnings(True)
+    warnings.simplefilter('default')
+
+    preload_references(scenario_scripts)
+
+    totals = run_scenarios(scenarios, run_scenario, max_workers=scenario_max_workers)
+
+    compare_scenarios(totals)
+
+if __name__ == '__main__':
+    main()
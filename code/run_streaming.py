@@ -0,0 +1,67 @@
+import logging
+import warnings
+from handlers.streaming_handlers import stream_occurrences
+from handlers.spatial_handlers import perform_endemism_analysis
+from modules.pipeline import Stage, Pipeline
+from modules.instrumentation import RunManifest
+import config
+from config import *
+
+
+def build_stages():
+    """
+    Stages of the taxonomic harmonisation and region labelling (run1 and run2 up to save_results) in bounded memory.
+    """
+
+    if use_strict:
+        verified_manually = verified_manually_strict
+        suffix, taxon_vocabulary_path, cube_path = 'strict', taxon_vocabulary_strict, occurrence_cube_strict
+    else:
+        verified_manually = verified_manually_relaxed
+        suffix, taxon_vocabulary_path, cube_path = 'relaxed', taxon_vocabulary_relaxed, occurrence_cube_relaxed
+
+    shapefiles = [path for path, _ in region_layers.values()] + [path.replace('.shp', '.dbf') for path, _ in region_layers.values()]
+
+    stages = [
+        Stage(stream_occurrences, outputs=['region_labels'],
+              params={'use_strict': use_strict, 'occ_strict': occ_strict, 'occ_relaxed': occ_relaxed, 'mb_path': mb_path, 'muni_path': muni_path,
+                      'gazetteer_path': gazetteer_path, 'region_layers': region_layers, 'memory_budget_mb': streaming_memory_budget_mb},
+              files=[occ_strict if use_strict else occ_relaxed, mb_path, verified_manually, verification_store, gazetteer_path] + shapefiles,
+              config_keys=['jaro_threshold', 'use_strict', 'collector_score_threshold', 'collapse_duplicate_specimens', 'coordinate_flags_reject',
+                           'fix_swapped_coordinates', 'centroid_tolerance', 'min_coordinate_decimals', 'geocode_score_threshold', 'map_extent',
+                           'map_cell_size'],
+              produces=[output+f'occurrences_harmonised_{suffix}.parquet', output+f'labelled_occurrences_{suffix}.parquet',
+                        output+f'occurrence_grid_{suffix}.npz', output+f'region_labels_{suffix}.json', taxon_vocabulary_path, cube_path]
+                       + [output+f'richness_{layer}_{suffix}.csv' for layer in region_layers]),
+        ## Endemism tables are computed for the dataset that was streamed, whatever 'use_strict_spatial' says
+        Stage(perform_endemism_analysis, after=['stream_occurrences'], params={'use_strict_spatial': use_strict},
+              config_keys=['restricted_range_max_regions'], produces=[output+f'endemism_{layer}_{suffix}.csv' for layer in ['biomes', 'provinces']])
+    ]
+
+    return stages
+
+def main():
+    """
+    Run the streaming stages, skipping those already up to date.
+    """
+
+    ## Start log file
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("run_streaming.log", mode='a'),
+            logging.StreamHandler()
+        ]
+    )
+
+    logging.captureWarnings(True)
+    warnings.simplefilter('default')
+
+    manifest = RunManifest('run_streaming', manifest_dir, config_values={key: value for key, value in vars(config).items() if not key.startswith('_')},
+                           profile_stage=profile_stage, trace_memory=trace_memory)
+
+    Pipeline(build_stages(), cache_dir=pipeline_cache_dir, force=pipeline_force, manifest=manifest).run()
+
+if __name__ == '__main__':
+    main()
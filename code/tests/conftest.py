@@ -0,0 +1,5 @@
+import os
+import sys
+
+## Tests import the pipeline modules the way the run scripts do, from the code directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,74 @@
+import os
+import shutil
+
+import pytest
+
+from modules.gbif_backbone import build_backbone_index, backbone_is_current, BackboneIndex
+from modules.gbif_resolver import choose_match
+
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'data', 'Taxon.tsv')
+
+
+@pytest.fixture
+def backbone(tmp_path):
+    taxon_path = str(tmp_path / 'Taxon.tsv')
+    db_path = str(tmp_path / 'backbone.sqlite')
+    shutil.copy(FIXTURE, taxon_path)
+    build_backbone_index(taxon_path, db_path)
+
+    return taxon_path, db_path
+
+def test_exact_match_keeps_only_fungi(backbone):
+    _, db_path = backbone
+    index = BackboneIndex(db_path)
+
+    match = index.match('Boletus edulis Bull.')
+
+    assert match['matchType'] == 'EXACT'
+    assert choose_match(match) == (3100, 'Boletus edulis Bull.')
+    assert 9000 not in index.taxa['taxonID'].astype(int).tolist()
+
+def test_fuzzy_epithet_and_infraspecific_names(backbone):
+    index = BackboneIndex(backbone[1])
+
+    assert choose_match(index.match('Amanita muscarai (L.) Lam.'))[0] == 2526
+    assert choose_match(index.match('Amanita muscaria var. flavivolvata (Singer) Rodham Tulloss'))[0] == 2528
+
+def test_misspelled_genus_is_blocked_on_close_genera(backbone):
+    index = BackboneIndex(backbone[1])
+
+    match = index.match('Amanitta phalloides')
+
+    assert match['matchType'] == 'FUZZY'
+    assert choose_match(match)[0] == 2527
+    assert index.match('Xylaria hypoxylon')['matchType'] == 'NONE'
+
+def test_genus_only_names_are_not_accepted(backbone):
+    index = BackboneIndex(backbone[1])
+
+    assert index.resolve_chains([['Amanita sp.', 'Pycnoporus sanguineus']]) == [(4000, 'Pycnoporus sanguineus (L.) Murrill', 'Pycnoporus sanguineus')]
+
+def test_store_is_rebuilt_when_taxon_file_changes(backbone):
+    taxon_path, db_path = backbone
+    assert backbone_is_current(taxon_path, db_path)
+
+    with open(taxon_path, 'a') as f:
+        f.write('5000\td7\tAgaricus campestris L.\tL.\tAgaricus campestris\tAgaricus\tspecies\taccepted\tFungi\n')
+
+    assert not backbone_is_current(taxon_path, db_path)
+    build_backbone_index(taxon_path, db_path)
+    assert backbone_is_current(taxon_path, db_path)
+    assert choose_match(BackboneIndex(db_path).match('Agaricus campestris'))[0] == 5000
+
+def test_store_without_source_stamp_is_stale(backbone, tmp_path):
+    taxon_path, db_path = backbone
+    assert not backbone_is_current(taxon_path, str(tmp_path / 'missing.sqlite'))
+
+    import sqlite3
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP TABLE meta")
+    conn.commit()
+    conn.close()
+
+    assert not backbone_is_current(taxon_path, db_path)
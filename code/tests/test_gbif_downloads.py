@@ -0,0 +1,144 @@
+import os
+import json
+import asyncio
+import hashlib
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from modules.gbif_downloads import run_jobs_async, load_jobs
+
+
+def archive_bytes(key):
+    return (key * 4000).encode()
+
+def stub_occurrence_download(state):
+    """
+    Stub of the GBIF occurrence download API. Downloads run for one poll before succeeding; archives are served at most
+    'max_bytes' bytes per request, honouring Range headers. Query predicates pick the behaviour of each download:
+    'failed' ends as FAILED, 'badsum' advertises a wrong checksum, 'gone' answers 500 to status requests.
+    """
+
+    async def submit(request):
+        query = await request.json()
+        state['submitted'].append(query)
+        key = f"{query['predicate']['value']}-{len(state['submitted'])}"
+        state['polls'][key] = 0
+
+        return web.Response(status=201, text=key)
+
+    async def status(request):
+        key = request.match_info['key']
+        state['polls'][key] += 1
+        kind = key.rsplit('-', 1)[0]
+
+        if kind == 'gone':
+            return web.Response(status=500)
+        if state['polls'][key] == 1:
+            return web.json_response({'key': key, 'status': 'RUNNING'})
+        if kind == 'failed':
+            return web.json_response({'key': key, 'status': 'FAILED'})
+
+        body = archive_bytes(key)
+        checksum = '0' * 32 if kind == 'badsum' else hashlib.md5(body).hexdigest()
+
+        return web.json_response({'key': key, 'status': 'SUCCEEDED', 'size': len(body), 'checksum': checksum})
+
+    async def archive(request):
+        key = request.match_info['key']
+        body = archive_bytes(key)
+        state['ranges'].append(request.headers.get('Range'))
+
+        offset = 0
+        if 'Range' in request.headers:
+            offset = int(request.headers['Range'].split('=')[1].rstrip('-'))
+            if offset >= len(body):
+                return web.Response(status=416)
+
+        part = body[offset:offset + state['max_bytes']]
+
+        return web.Response(status=206 if offset else 200, body=part)
+
+    app = web.Application()
+    app.router.add_post('/occurrence/download/request', submit)
+    app.router.add_get('/occurrence/download/request/{key}.zip', archive)
+    app.router.add_get('/occurrence/download/{key}', status)
+
+    return app
+
+def write_queries(directory, *values):
+    paths = []
+    for i, value in enumerate(values):
+        path = os.path.join(directory, f'query_{i + 1}.json')
+        with open(path, 'w') as f:
+            json.dump({'format': 'SIMPLE_CSV', 'predicate': {'type': 'equals', 'key': 'TAXON_KEY', 'value': value}}, f)
+        paths.append(path)
+
+    return paths
+
+def run(query_files, tmp_path, state=None):
+    state = state if state is not None else {}
+    state.setdefault('submitted', [])
+    state.setdefault('polls', {})
+    state.setdefault('ranges', [])
+    state.setdefault('max_bytes', 1 << 30)
+
+    async def main():
+        server = TestServer(stub_occurrence_download(state))
+        await server.start_server()
+        try:
+            return await run_jobs_async(query_files, str(tmp_path / 'jobs.json'), str(tmp_path), str(server.make_url('')).rstrip('/'),
+                                        None, poll_interval=0.01, timeout=5, max_connections=4)
+        finally:
+            await server.close()
+
+    return asyncio.run(main()), state
+
+def test_submit_poll_and_fetch(tmp_path):
+    queries = write_queries(tmp_path, 'ok', 'ok2')
+
+    jobs, state = run(queries, tmp_path)
+
+    assert len(state['submitted']) == 2
+    assert sorted(job['status'] for job in jobs.values()) == ['SUCCEEDED', 'SUCCEEDED']
+    for job in jobs.values():
+        with open(job['path'], 'rb') as f:
+            assert f.read() == archive_bytes(job['key'])
+
+    ## A rerun with the same queries neither resubmits nor downloads again
+    _, state = run(queries, tmp_path)
+    assert state['submitted'] == [] and state['ranges'] == []
+
+def test_jobs_follow_query_content_not_file_names(tmp_path):
+    run(write_queries(tmp_path, 'ok', 'ok2'), tmp_path)
+
+    ## query_1.json now holds a different query, and an unrelated job is left in the jobs file
+    queries = write_queries(tmp_path, 'ok3')
+    jobs, state = run(queries, tmp_path)
+
+    assert [query['predicate']['value'] for query in state['submitted']] == ['ok3']
+    assert [job['query'] for job in jobs.values()] == ['query_1.json']
+    assert len(load_jobs(str(tmp_path / 'jobs.json'))) == 3
+
+def test_range_resume(tmp_path):
+    jobs, state = run(write_queries(tmp_path, 'ok'), tmp_path, {'max_bytes': 3000})
+
+    job = next(iter(jobs.values()))
+    size = len(archive_bytes(job['key']))
+    assert job['status'] == 'SUCCEEDED'
+    assert os.path.getsize(job['path']) == size
+    assert state['ranges'] == [None] + [f'bytes={offset}-' for offset in range(3000, size, 3000)]
+
+def test_failures_are_isolated_and_failed_downloads_resubmitted(tmp_path):
+    queries = write_queries(tmp_path, 'badsum', 'gone', 'failed', 'ok')
+
+    jobs, _ = run(queries, tmp_path)
+    statuses = {job['query']: job['status'] for job in jobs.values()}
+
+    assert statuses == {'query_1.json': 'ERROR', 'query_2.json': 'ERROR', 'query_3.json': 'FAILED', 'query_4.json': 'SUCCEEDED'}
+    assert not [file for file in os.listdir(tmp_path) if file.endswith('.part')]
+
+    ## Errors are polled again under the same key; only the FAILED download is submitted again
+    jobs, state = run(queries, tmp_path)
+    assert [query['predicate']['value'] for query in state['submitted']] == ['failed']
+    assert {job['query']: job['status'] for job in jobs.values()}['query_3.json'] == 'FAILED'
@@ -0,0 +1,77 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from modules.gbif_resolver import resolve_chains_async
+
+
+ACCEPTED = {'rank': 'SPECIES', 'confidence': 99, 'usageKey': 1, 'scientificName': 'Amanita muscaria (L.) Lam.'}
+
+
+def stub_species_match(calls):
+    """
+    Stub of GBIF /v1/species/match: answers by name after some latency, with 429s, 5xx errors and broken bodies.
+    """
+
+    async def handler(request):
+        name = request.query['name']
+        calls[name] = calls.get(name, 0) + 1
+        await asyncio.sleep(0.01)
+
+        if name == 'throttled' and calls[name] == 1:
+            return web.Response(status=429, headers={'Retry-After': '0'})
+        if name == 'flaky' and calls[name] <= 2:
+            return web.Response(status=503)
+        if name == 'broken':
+            return web.Response(status=200, text='<html>not json</html>')
+        if name == 'down':
+            return web.Response(status=500)
+        if name == 'unknown':
+            return web.json_response({'matchType': 'NONE', 'confidence': 100})
+
+        return web.json_response(dict(ACCEPTED, scientificName=name))
+
+    app = web.Application()
+    app.router.add_get('/v1/species/match', handler)
+
+    return app
+
+def resolve(chains):
+    calls = {}
+
+    async def run():
+        server = TestServer(stub_species_match(calls))
+        await server.start_server()
+        try:
+            return await resolve_chains_async(chains, str(server.make_url('/v1/species/match')), {}, max_in_flight=4, rate=1000,
+                                              max_retries=3, backoff=0.001, timeout=5)
+        finally:
+            await server.close()
+
+    results, fetched = asyncio.run(run())
+
+    return results, fetched, calls
+
+def test_accepted_and_retried_names_resolve():
+    results, _, calls = resolve([['Amanita muscaria'], ['throttled'], ['flaky']])
+
+    assert [r[0] for r in results] == [1, 1, 1]
+    assert calls['throttled'] == 2
+    assert calls['flaky'] == 3
+
+def test_failures_do_not_abort_other_names():
+    results, fetched, calls = resolve([['broken'], ['down'], ['unknown'], ['Amanita muscaria']])
+
+    assert results[0] == ('NA', 'NA', 'broken')
+    assert fetched['broken'][2] is None
+    assert results[1] == ('NA', 'NA', 'down')
+    assert calls['down'] == 4
+    assert results[2] == ('NA', 'NA', 'unknown')
+    assert results[3][0] == 1
+
+def test_chain_falls_back_and_shares_requests():
+    results, _, calls = resolve([['unknown', 'Amanita muscaria'], ['Amanita muscaria']])
+
+    assert results[0] == (1, 'Amanita muscaria', 'Amanita muscaria')
+    assert calls['Amanita muscaria'] == 1
@@ -0,0 +1,43 @@
+import pandas as pd
+
+import modules.locality_geocoding
+from modules.locality_geocoding import geocode_localities
+
+
+GAZETTEER = pd.DataFrame({'name': ['Serra do Mar', 'Parque Estadual de Vila Velha'],
+                          'decimalLatitude': [-23.5, -25.2], 'decimalLongitude': [-45.1, -50.0]})
+
+LOCALITIES = pd.Series(['Parque Estadual da Serra do Mar, Cunha', 'Parque Estadual de Vila Velha, Ponta Grossa', 'Morro do Anhangava'])
+
+
+def test_cache_is_reused_for_the_same_gazetteer_and_threshold(tmp_path, monkeypatch):
+    cache_path = str(tmp_path / 'geocoded.csv')
+
+    first = geocode_localities(LOCALITIES, GAZETTEER, cache_path=cache_path, score_threshold=90)
+
+    ## Matches and misses both come from the cache on the second run
+    def no_matching(*args, **kwargs):
+        raise AssertionError('locality matched again')
+    monkeypatch.setattr(modules.locality_geocoding, 'match_locality', no_matching)
+    again = geocode_localities(LOCALITIES, GAZETTEER, cache_path=cache_path, score_threshold=90)
+
+    assert first['gazetteerName'].tolist()[:2] == ['Serra do Mar', 'Parque Estadual de Vila Velha']
+    pd.testing.assert_frame_equal(first, again, check_dtype=False)
+
+def test_cache_is_discarded_when_the_gazetteer_changes(tmp_path):
+    cache_path = str(tmp_path / 'geocoded.csv')
+    geocode_localities(LOCALITIES, GAZETTEER, cache_path=cache_path)
+
+    gazetteer = pd.concat([GAZETTEER, pd.DataFrame({'name': ['Morro do Anhangava'], 'decimalLatitude': [-25.4],
+                                                    'decimalLongitude': [-49.0]})], ignore_index=True)
+    geocoded = geocode_localities(LOCALITIES, gazetteer, cache_path=cache_path)
+
+    assert geocoded['gazetteerName'].iloc[2] == 'Morro do Anhangava'
+
+def test_cache_is_discarded_when_the_threshold_changes(tmp_path):
+    cache_path = str(tmp_path / 'geocoded.csv')
+    low = geocode_localities(pd.Series(['Vila Velh']), GAZETTEER, cache_path=cache_path, score_threshold=50)
+    high = geocode_localities(pd.Series(['Vila Velh']), GAZETTEER, cache_path=cache_path, score_threshold=99)
+
+    assert low['gazetteerName'].notna().all()
+    assert high['gazetteerName'].isna().all()
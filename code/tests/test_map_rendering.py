@@ -0,0 +1,19 @@
+import os
+
+from benchmarks.generators import polygon_layer
+from modules.map_rendering import simplified_layer, _simplified_layers
+
+
+def test_simplified_layer_is_cached_atomically(tmp_path):
+    path = str(tmp_path / 'provinces.shp')
+    polygon_layer(8, 'Provincias', seed=2).to_file(path)
+    cache_dir = str(tmp_path / 'cache')
+
+    layer = simplified_layer(path, tolerance=0.5, cache_dir=cache_dir)
+    assert os.listdir(cache_dir) == ['provinces_simplified_0.5.gpkg']
+
+    ## A fresh process (empty memory cache) reads the GeoPackage back
+    _simplified_layers.clear()
+    cached = simplified_layer(path, tolerance=0.5, cache_dir=cache_dir)
+    assert len(cached) == len(layer)
+    assert cached.geometry.geom_equals_exact(layer.geometry, tolerance=1e-9).all()
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+from modules.occurrence_cube import OccurrenceCube
+
+
+REGION_LABELS = {'biome': pd.Index(['Amazonia', 'Cerrado', 'Pampa'], dtype=object)}
+
+
+def labelled(names, codes, years, ids=None):
+    ids = np.arange(len(names)) if ids is None else ids
+    return pd.DataFrame({'gbifID': ids, 'current_name': names, 'year': years, 'biome_code': codes})
+
+def load_and_update(path, records, region_labels=REGION_LABELS):
+    cube = OccurrenceCube.load(path)
+    changed = cube.update(records, region_labels, complete=True)
+    cube.save(path)
+
+    return changed
+
+def test_update_matches_group_by_and_survives_save(tmp_path):
+    path = str(tmp_path / 'cube.npz')
+    records = labelled(['Amanita muscaria', 'Amanita muscaria', 'Boletus edulis', 'Boletus edulis'], [0, 0, 1, -1], [2001, 2001, np.nan, 2003])
+
+    load_and_update(path, records)
+    summary = OccurrenceCube.load(path).summary('biome', by=['region'])
+
+    assert summary['records'].to_dict() == {'Amazonia': 2, 'Cerrado': 1}
+    assert summary.loc['Cerrado', 'firstYear'] is pd.NA
+
+def test_new_records_are_merged_into_the_stored_cube(tmp_path):
+    path = str(tmp_path / 'cube.npz')
+    records = labelled(['Amanita muscaria', 'Boletus edulis', 'Boletus edulis'], [0, 1, 2], [2001, 2002, 2003])
+    load_and_update(path, records.iloc[:2])
+
+    ## Only the record not merged before is counted, and the result matches a cube built in one go
+    assert load_and_update(path, records) == 1
+    assert load_and_update(path, records) == 0
+
+    full = OccurrenceCube()
+    full.update(records, REGION_LABELS)
+    summary = OccurrenceCube.load(path).summary('biome', by=['region', 'species'])
+    pd.testing.assert_frame_equal(summary, full.summary('biome', by=['region', 'species']))
+
+def test_changed_and_removed_records_are_subtracted(tmp_path):
+    path = str(tmp_path / 'cube.npz')
+    load_and_update(path, labelled(['Amanita muscaria', 'Boletus edulis', 'Boletus edulis'], [0, 1, 1], [2001, 2002, 2002]))
+
+    ## gbifID 0 harmonised to another name and region, gbifID 2 gone
+    records = labelled(['Amanita phalloides', 'Boletus edulis'], [2, 1], [2001, 2002])
+    assert load_and_update(path, records) == 2
+
+    summary = OccurrenceCube.load(path).summary('biome', by=['region', 'species'])
+    assert summary['records'].to_dict() == {('Cerrado', 'Boletus edulis'): 1, ('Pampa', 'Amanita phalloides'): 1}
+
+def test_chunks_do_not_subtract_records_merged_earlier():
+    cube = OccurrenceCube()
+    cube.update(labelled(['Amanita muscaria'], [0], [2001], ids=[10]), REGION_LABELS)
+    cube.update(labelled(['Boletus edulis'], [1], [2002], ids=[11]), REGION_LABELS)
+
+    assert cube.summary('biome', by=['region'])['records'].to_dict() == {'Amazonia': 1, 'Cerrado': 1}
+
+def test_cube_is_rebuilt_when_region_labels_change(tmp_path):
+    path = str(tmp_path / 'cube.npz')
+    records = labelled(['Amanita muscaria', 'Boletus edulis'], [0, 1], [2001, 2002])
+    load_and_update(path, records)
+
+    ## The same codes now refer to other regions, so every record is counted again under its new label
+    region_labels = {'biome': pd.Index(['Caatinga', 'Mata Atlantica'], dtype=object)}
+    assert load_and_update(path, records, region_labels) == 2
+
+    summary = OccurrenceCube.load(path).summary('biome', by=['region'])
+    assert summary['records'].to_dict() == {'Caatinga': 1, 'Mata Atlantica': 1}
@@ -0,0 +1,59 @@
+import os
+
+from modules.pipeline import Stage, Pipeline, _project_modules
+
+
+def run(stages, cache_dir):
+    return Pipeline(stages, cache_dir=str(cache_dir)).run()
+
+def test_stage_reruns_when_a_produced_file_is_missing(tmp_path):
+    calls = []
+    table = tmp_path / 'table.csv'
+
+    def make_values():
+        calls.append('make_values')
+        return [1, 2, 3]
+
+    def write_table(values):
+        calls.append('write_table')
+        table.write_text(','.join(map(str, values)))
+
+    stages = [Stage(make_values, outputs=['values']),
+              Stage(write_table, inputs={'values': 'values'}, produces=[str(table)])]
+
+    run(stages, tmp_path / 'cache')
+    run(stages, tmp_path / 'cache')
+    assert calls == ['make_values', 'write_table']
+
+    ## Only the stage whose file was deleted runs again, from the stored upstream values
+    os.remove(table)
+    run(stages, tmp_path / 'cache')
+    assert calls == ['make_values', 'write_table', 'write_table']
+    assert table.read_text() == '1,2,3'
+
+def test_glob_products_need_one_match(tmp_path):
+    calls = []
+
+    def write_batches():
+        calls.append('write_batches')
+        for i in range(2):
+            (tmp_path / f'query_{i}.json').write_text('{}')
+
+    stages = [Stage(write_batches, produces=[str(tmp_path / 'query_*.json')])]
+
+    run(stages, tmp_path / 'cache')
+    os.remove(tmp_path / 'query_0.json')
+    run(stages, tmp_path / 'cache')
+    assert calls == ['write_batches']
+
+    os.remove(tmp_path / 'query_1.json')
+    run(stages, tmp_path / 'cache')
+    assert calls == ['write_batches', 'write_batches']
+
+def test_code_digest_follows_project_imports():
+    found = set()
+    _project_modules('modules.endemic_analysis', found)
+
+    ## archive_reader is only imported by endemic_analysis, never by the handlers
+    assert {'modules.endemic_analysis', 'modules.archive_reader'} <= found
+    assert all(name.split('.')[0] in ('modules', 'handlers') for name in found)
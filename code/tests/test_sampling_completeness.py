@@ -0,0 +1,44 @@
+import numpy as np
+
+from modules.sampling_completeness import region_completeness, sample_coverage, bootstrap_assemblage
+
+
+def check_finite(estimates, curves):
+    for name in ['coverage', 'chao1', 'ace', 'chao2', 'chao1_se', 'ace_se', 'chao2_se']:
+        assert np.isfinite(estimates[name]), name
+    assert np.isfinite(curves[['richness', 'lcl', 'ucl']].to_numpy()).all()
+
+def test_sample_coverage_falls_back_to_good_turing():
+    assert sample_coverage(np.array([1]), 1) == 0.0
+    assert sample_coverage(np.array([1, 1]), 1) == 0.0
+    assert sample_coverage(np.array([2, 3]), 5) == 1.0
+    assert np.isclose(sample_coverage(np.array([3, 1]), 4), 1 - 1 / 4)
+
+def test_degenerate_assemblages_give_valid_probabilities():
+    for freqs, total, incidence in [([1], 1, False), ([1], 1, True), ([1, 1], 1, True)]:
+        probs = bootstrap_assemblage(np.array(freqs), total, incidence=incidence)
+        assert np.isfinite(probs).all() and (probs >= 0).all() and (probs <= 1).all()
+
+def test_one_record_region():
+    estimates, curves = region_completeness([1], [1], 1, n_bootstrap=20, seed=1)
+
+    check_finite(estimates, curves)
+    assert estimates['records'] == 1 and estimates['sppObserved'] == 1
+    assert estimates['chao1_se'] == 0.0
+
+def test_one_cell_region():
+    estimates, curves = region_completeness([3, 1], [1, 1], 1, n_bootstrap=20, seed=1)
+
+    check_finite(estimates, curves)
+    assert estimates['samplingUnits'] == 1 and estimates['sppObserved'] == 2
+    assert estimates['chao2'] == 2.0
+
+def test_bootstrap_is_reproducible():
+    counts, frequencies = np.array([5, 3, 2, 1, 1, 1]), np.array([3, 2, 2, 1, 1, 1])
+
+    first = region_completeness(counts, frequencies, 6, n_bootstrap=50, seed=7)
+    second = region_completeness(counts, frequencies, 6, n_bootstrap=50, seed=7)
+
+    assert first[0] == second[0]
+    assert 0 < first[0]['coverage'] < 1
+    assert first[0]['chao1'] >= 6
@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+from modules.specimen_duplicates import normalise_collector, split_collectors, SpecimenClusters
+
+
+@pytest.mark.parametrize('recorded_by, canonical', [
+    ('Rick, J.', 'rick j'),
+    ('J. Rick', 'rick j'),
+    ('RICK, Johannes', 'rick j'),
+    ('A. da Silva', 'silva a'),
+    ('Rick, J. & Sehnem, A.', 'rick j sehnem a'),
+    ('J. Rick; A. Sehnem', 'rick j sehnem a'),
+    ('Rick, J., Sehnem, A.', 'rick j sehnem a'),
+    ('J. Rick, A. Sehnem', 'rick j sehnem a'),
+    ('Martins-Cunha, K., Cardoso, D.', 'cunha k cardoso d'),
+    ('Rick J et al.', 'rick j'),
+])
+def test_normalise_collector(recorded_by, canonical):
+    assert normalise_collector(recorded_by)[1] == canonical
+
+def test_split_collectors_keeps_surname_initial_pairs():
+    assert split_collectors('Rick, J., Sehnem, A.') == ['Rick, J.', ' Sehnem, A.']
+    assert split_collectors('J. Rick, A. Sehnem') == ['J. Rick', ' A. Sehnem']
+    assert split_collectors('da Silva, J.P.') == ['da Silva, J.P.']
+
+def test_clusters_match_across_name_formats_and_chunks():
+    records = pd.DataFrame({
+        'recordedBy': ['Rick, J., Sehnem, A.', 'J. Rick & A. Sehnem', 'Sehnem, A.', 'Rick, J., Sehnem, A.', None],
+        'species': ['Amanita muscaria'] * 5,
+        'year': [1930, 1930, 1930, 1931, 1930],
+        'month': [5] * 5,
+        'day': [2] * 5
+    })
+
+    clusters, first = SpecimenClusters(score_threshold=90).assign(records)
+    assert clusters.tolist() == [0, 0, 1, 2, 3]
+    assert first.tolist() == [True, False, True, True, True]
+
+    ## Chunked assignment gives the same IDs
+    clusterer = SpecimenClusters(score_threshold=90)
+    chunked = [clusterer.assign(records.iloc[i:i + 2])[0] for i in range(0, len(records), 2)]
+    assert [c for chunk in chunked for c in chunk] == clusters.tolist()
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+from modules.streaming import ChunkSizer, DedupFilter
+
+
+MB = 2**20
+
+
+def write_occurrences(path, n):
+    pd.DataFrame({'gbifID': np.arange(n), 'species': [f'Amanita sp{i % 50}' for i in range(n)]}).to_csv(path, index=False)
+
+def test_chunks_shrink_when_memory_runs_over_budget(tmp_path):
+    path = tmp_path / 'occurrences.csv'
+    write_occurrences(path, 100)
+    sizer = ChunkSizer(path, {}, memory_budget_mb=100, min_rows=10)
+    sizer.rows = 1_000
+
+    ## 1 MB per row measured on the chunk, 40 MB carried between chunks: 60 rows fit in what is left
+    assert sizer.record(1_000, rss_before=0, peak=1_000 * MB, rss_after=40 * MB) == 60
+    assert sizer.over_budget
+
+    ## Growth is capped, and chunks never fall below min_rows, even once the state alone is over budget
+    assert sizer.record(60, rss_before=40 * MB, peak=41 * MB, rss_after=40 * MB) == 120
+    assert sizer.record(120, rss_before=40 * MB, peak=50 * MB, rss_after=120 * MB) == 10
+
+def test_unmeasured_memory_keeps_the_chunk_size(tmp_path):
+    path = tmp_path / 'occurrences.csv'
+    write_occurrences(path, 100)
+    sizer = ChunkSizer(path, {}, memory_budget_mb=100, min_rows=10)
+    sizer.rows = 30
+
+    assert sizer.record(30, rss_before=None, peak=0, rss_after=None) == 30
+
+def test_resized_chunks_cover_the_file_in_order(tmp_path):
+    path = tmp_path / 'occurrences.csv'
+    write_occurrences(path, 1_000)
+    sizer = ChunkSizer(path, {}, memory_budget_mb=100, min_rows=10)
+    sizer.rows = 64
+    ## Sizes are set by the loop below instead of the measured RSS
+    sizer.record = lambda *measures: sizer.rows
+
+    sizes, ids = [], []
+    for chunk in sizer.iter_chunks(path, {}):
+        sizes.append(len(chunk))
+        ids.extend(chunk['gbifID'])
+        sizer.rows = max(sizer.rows // 2, 10)
+
+    assert ids == list(range(1_000))
+    assert sizes[:3] == [64, 32, 16]
+
+def test_dedup_filter_matches_drop_duplicates():
+    records = pd.DataFrame({'gbifID': [1, 2, 1, 3, 2, 4, 5, 4]})
+    dedup = DedupFilter()
+
+    keep = np.concatenate([dedup.first_seen(records.iloc[i:i + 3]) for i in range(0, len(records), 3)])
+
+    assert keep.tolist() == (~records.duplicated()).tolist()
+
+def test_streaming_matches_the_batch_handlers(tmp_path, monkeypatch):
+    import handlers.taxonomic_handlers as taxonomic
+    import handlers.spatial_handlers as spatial
+    import handlers.streaming_handlers as streaming
+    from benchmarks.generators import mycobank_table, occurrence_table, polygon_layer
+    from modules.encoding import load_vocabulary
+    from modules.occurrence_cube import OccurrenceCube
+
+    ## One synthetic download, MycoBank export, gazetteer and set of layers shared by both runs
+    data = tmp_path / 'data'
+    data.mkdir()
+    mycobank = mycobank_table(300, seed=1)
+    mycobank.to_excel(data / 'mb.xlsx', index=False)
+    occurrences = occurrence_table(mycobank, 2_000, seed=1)
+    occurrences.to_csv(data / 'occ.csv', index=False)
+    polygon_layer(4, 'name', seed=1).to_file(data / 'biome.shp')
+    polygon_layer(12, 'Provincias', seed=2).to_file(data / 'prov.shp')
+    municipalities = polygon_layer(60, 'CD_MUN', seed=3)
+    counties = pd.Series(occurrences['county'].dropna().unique())
+    municipalities['NM_MUN'] = counties.iloc[np.arange(len(municipalities)) % len(counties)].to_numpy()
+    municipalities['SIGLA_UF'] = np.array(['AM', 'PA', 'BA', 'MG', 'SP', 'PR'])[np.arange(len(municipalities)) % 6]
+    municipalities.to_file(data / 'muni.shp')
+    localities = occurrences['locality'].dropna().unique()
+    rng = np.random.default_rng(0)
+    pd.DataFrame({'name': localities, 'decimalLatitude': rng.uniform(-30, 0, len(localities)).round(4),
+                  'decimalLongitude': rng.uniform(-70, -40, len(localities)).round(4)}).to_csv(data / 'gaz.csv', index=False)
+
+    layers = {'biome': (str(data / 'biome.shp'), 'name'), 'province': (str(data / 'prov.shp'), 'Provincias'),
+              'municipality': (str(data / 'muni.shp'), 'CD_MUN')}
+    occ, mb, muni, gazetteer = str(data / 'occ.csv'), str(data / 'mb.xlsx'), str(data / 'muni.shp'), str(data / 'gaz.csv')
+
+    def use_output(name):
+        out = tmp_path / name
+        out.mkdir()
+        out = str(out) + '/'
+        for module in (taxonomic, spatial, streaming):
+            for variable, value in {'output': out, 'headless': True, 'use_strict_spatial': True, 'occ_strict': occ,
+                                    'verification_store': out + 'store.csv', 'pending_verification': out + 'pending.csv',
+                                    'verified_manually_strict': out + 'verified.xlsx', 'taxon_vocabulary_strict': out + 'vocabulary.csv',
+                                    'occurrence_cube_strict': out + 'cube.npz'}.items():
+                monkeypatch.setattr(module, variable, value, raising=False)
+        return out
+
+    batch = use_output('batch')
+    df = taxonomic.format_occurrences(True, occ, None)
+    df = taxonomic.join_df_shs(df, taxonomic.shs_treatment(df))
+    taxonomic.perform_harmonisation(df, mb)
+    harmonised = spatial.read_harmonised_occurrences(True, batch + 'occurrences_harmonised_strict.csv', None)
+    combined = spatial.join_gdfs(spatial.treat_georeferenced(harmonised, muni), spatial.treat_nongeoreferenced_county(harmonised, muni),
+                                 spatial.treat_nongeoreferenced_muni(harmonised, muni), spatial.treat_nongeoreferenced_locality(harmonised, gazetteer))
+    combined, region_labels = spatial.perform_region_labelling(combined, layers)
+    spatial.update_occurrence_cube(combined, region_labels)
+
+    stream = use_output('stream')
+    streaming.stream_occurrences(True, occ, None, mb, muni, gazetteer, layers, 50)
+
+    ## Harmonised names, coded by the same current_name vocabulary
+    batch_names = pd.read_csv(batch + 'occurrences_harmonised_strict.csv')
+    stream_names = pd.read_parquet(stream + 'occurrences_harmonised_strict.parquet')
+    assert sorted(zip(batch_names['gbifID'], batch_names['current_name'].astype(str))) == \
+           sorted(zip(stream_names['gbifID'].astype(int), stream_names['current_name'].astype(str)))
+    assert load_vocabulary(batch + 'vocabulary.csv').equals(load_vocabulary(stream + 'vocabulary.csv'))
+
+    for layer in layers:
+        pd.testing.assert_frame_equal(pd.read_csv(batch + f'richness_{layer}_strict.csv'), pd.read_csv(stream + f'richness_{layer}_strict.csv'))
+
+    ## Cubes are merged in a different record order, so cells are compared sorted
+    batch_cube, stream_cube = OccurrenceCube.load(batch + 'cube.npz'), OccurrenceCube.load(stream + 'cube.npz')
+    for layer in layers:
+        pd.testing.assert_frame_equal(batch_cube.summary(layer, by=['region', 'species', 'year']).sort_index(),
+                                      stream_cube.summary(layer, by=['region', 'species', 'year']).sort_index())
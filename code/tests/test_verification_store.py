@@ -0,0 +1,43 @@
+import multiprocessing
+
+import pandas as pd
+
+from modules.verification_store import load_store, save_store, STORE_COLUMNS
+
+
+def decisions(rows):
+    return pd.DataFrame(rows, columns=STORE_COLUMNS)
+
+def save_after_delay(store_path, rows, delay):
+    import time
+    store = load_store(store_path)
+    time.sleep(delay)
+    save_store(pd.concat([store, decisions(rows)], ignore_index=True), store_path)
+
+def test_concurrent_scenarios_keep_each_others_decisions(tmp_path):
+    store_path = str(tmp_path / 'store.csv')
+    save_store(decisions([['Amanita muscara', 'Amanita muscaria', 'seed.xlsx', '2025-01-01T00:00:00']]), store_path)
+
+    ## Both runs read the store before either saves it, as scenario workers do
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=save_after_delay, args=(store_path, [[name, current, f'{scenario}.xlsx', '2025-02-01T00:00:00']], delay))
+               for scenario, name, current, delay in [('strict', 'Boletus edulys', 'Boletus edulis', 0.2),
+                                                      ('relaxed', 'Pycnoporus sanguineous', 'Pycnoporus sanguineus', 0.4)]]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    store = load_store(store_path)
+    assert sorted(store['scientificName']) == ['Amanita muscara', 'Boletus edulys', 'Pycnoporus sanguineous']
+
+def test_later_decision_wins(tmp_path):
+    store_path = str(tmp_path / 'store.csv')
+    save_store(decisions([['Boletus edulys', 'Boletus edulis', 'new.xlsx', '2025-03-01T00:00:00']]), store_path)
+
+    ## A run holding an older decision for the same name does not overwrite the newer one
+    save_store(decisions([['Boletus edulys', 'NOTFOUND', 'old.xlsx', '2025-01-01T00:00:00']]), store_path)
+    assert load_store(store_path)['current_name'].tolist() == ['Boletus edulis']
+
+    save_store(decisions([['Boletus edulys', 'NOTFOUND', 'newer.xlsx', '2025-04-01T00:00:00']]), store_path)
+    assert load_store(store_path)['current_name'].tolist() == ['NOTFOUND']